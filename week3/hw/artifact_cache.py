@@ -0,0 +1,75 @@
+"""
+跨运行的图片/表格提取结果缓存
+VLM图片摘要和LLM上下文增强是step2中最昂贵的部分, 结果按
+(文件哈希, 页码, 类型, 条目键, prompt版本) 持久化到本地SQLite,
+重新切分或重新向量化时可以直接回放, 不再调用任何模型。prompt或模型变化时修改版本号即可使旧结果失效。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, path="artifact_cache.sqlite"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            " file_hash TEXT NOT NULL, page INTEGER NOT NULL, kind TEXT NOT NULL, item_key TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL,"
+            " PRIMARY KEY (file_hash, page, kind, item_key, prompt_version))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_hash, page, kind, item_key, prompt_version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM artifacts WHERE file_hash=? AND page=? AND kind=? AND item_key=? AND prompt_version=?",
+                (file_hash, page, kind, str(item_key), prompt_version),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, file_hash, page, kind, item_key, prompt_version, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, page, kind, str(item_key), prompt_version,
+                 json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def cached_keys(self, file_hash, kind, prompt_version):
+        """某个文件某类结果已缓存的 (页码, 条目键) 集合, 用于解析阶段提前跳过"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, item_key FROM artifacts WHERE file_hash=? AND kind=? AND prompt_version=?",
+                (file_hash, kind, prompt_version),
+            ).fetchall()
+        return {(page, item_key) for page, item_key in rows}
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,925 @@
+#!/usr/bin/env python3
+"""
+RAG流水线性能基准测试
+每个子命令对应一项优化，输出可直接对比的内存、召回率和延迟数据
+
+用法:
+  python benchmark.py quantization --source-index rag_pipeline_index
+  python benchmark.py parse --pdf big.pdf --workers 1 2 4 8 16 32
+  python benchmark.py chunk-memory --count 10000
+  python benchmark.py rerank-gate --index rag_pipeline_index --queries-file queries.txt
+  python benchmark.py two-stage --sizes 10000 100000 300000
+  python benchmark.py two-stage --index rag_pipeline_index --queries-file queries.txt
+  python benchmark.py text-store --source-index rag_pipeline_index
+  python benchmark.py embed-batch --users 1 8 32 64
+  python benchmark.py hedging --requests 2000
+  python benchmark.py image-filter --pdf report.pdf
+  python benchmark.py table-prefilter --pdf a.pdf b.pdf --labels table_labels.json
+  python benchmark.py import-time --modules pipeline retrieve_documents
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+import fitz
+import numpy as np
+from elasticsearch import helpers
+
+from chunk_store import ChunkBatch, orjson
+from config import get_es, IMAGE_FILTER_THRESHOLD
+from embedding import local_embedding
+from embedding_batcher import EmbeddingBatcher
+from hedging import Hedger
+from image_filter import image_features, image_score
+from es_functions import create_elastic_index, delete_elastic_index, get_vector_index_type, VECTOR_INDEX_TYPES
+from page_parser import parse_pdf_pages, MIN_PAGES_PER_WORKER
+from table_prefilter import table_candidate
+from retrieve_documents import vector_search, elastic_search, rerank, gated_rerank
+from snapshot import iter_es_docs
+from text_store import get_text_store
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values), pct))
+
+
+def _print_table(rows: List[Dict[str, Any]], columns: List[str]):
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    print("  ".join("-" * widths[c] for c in columns))
+    for r in rows:
+        print("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def _load_queries(queries_file: Optional[str]) -> List[str]:
+    """每行一个问题的文本文件"""
+    if not queries_file:
+        return []
+    with open(queries_file, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# ---------------------------------------------------------------------------
+# 向量量化: 内存 / recall@10 / 延迟
+# ---------------------------------------------------------------------------
+
+# 每个向量常驻内存(page cache)的估算字节数, 参考Elasticsearch官方的kNN内存估算公式
+# HNSW图本身每个向量约 4 * m 字节 (m=16)
+_HNSW_GRAPH_BYTES = 4 * 16
+
+def _estimated_vector_bytes(mode: str, dims: int) -> float:
+    per_vector = {
+        "hnsw": dims * 4,
+        "int8_hnsw": dims + 4,
+        "int4_hnsw": dims / 2 + 4,
+        "bbq_hnsw": dims / 8 + 14,
+    }[mode]
+    return per_vector + _HNSW_GRAPH_BYTES
+
+
+def bench_quantization(source_index: str, modes: List[str], queries_file: Optional[str] = None,
+                       num_queries: int = 100, k: int = 10, rescore_oversample: float = 0,
+                       keep_indices: bool = False) -> List[Dict[str, Any]]:
+    """把source_index中的向量分别写入不同布局的临时索引，对比内存、recall@k和延迟
+
+    ground truth 为NumPy上的float32精确余弦相似度top-k
+    """
+    es = get_es()
+    print(f"📥 读取 {source_index} 中的向量...")
+    ids, sources, vectors = [], [], []
+    for hit in helpers.scan(es, index=source_index, _source=["text", "vector", "content_type", "page_num"]):
+        if not hit["_source"].get("vector"):
+            continue
+        ids.append(hit["_id"])
+        sources.append(hit["_source"])
+        vectors.append(hit["_source"]["vector"])
+    if not ids:
+        raise ValueError(f"索引 {source_index} 中没有向量")
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    dims = matrix.shape[1]
+
+    # 查询向量: 优先使用真实问题, 否则从库中抽样向量并加入少量噪声
+    query_texts = _load_queries(queries_file)[:num_queries]
+    if query_texts:
+        query_vectors = np.asarray(local_embedding(query_texts), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(ids), size=min(num_queries, len(ids)), replace=False)
+        query_vectors = matrix[sample] + rng.normal(0, 0.02, size=(len(sample), dims)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True) + 1e-12
+
+    ground_truth = []
+    for q in query_vectors:
+        top = np.argsort(-(matrix @ q))[:k]
+        ground_truth.append({ids[i] for i in top})
+
+    rows = []
+    for mode in modes:
+        bench_index = f"{source_index}_bench_{mode}"
+        if es.indices.exists(index=bench_index):
+            delete_elastic_index(bench_index)
+        create_elastic_index(bench_index, mode)
+
+        actions = ({"_index": bench_index, "_id": doc_id, "_source": source}
+                   for doc_id, source in zip(ids, sources))
+        helpers.bulk(es.options(request_timeout=300), actions, chunk_size=500)
+        es.indices.refresh(index=bench_index)
+        es.options(request_timeout=600).indices.forcemerge(index=bench_index, max_num_segments=1)
+
+        disk = es.indices.disk_usage(index=bench_index, run_expensive_tasks=True)
+        vector_disk = disk[bench_index]["fields"].get("vector", {}).get("total_in_bytes", 0)
+
+        # 预热
+        for q in query_vectors[:5]:
+            vector_search(es, bench_index, q.tolist(), size=k, rescore_oversample=rescore_oversample)
+
+        latencies, recalls = [], []
+        for q, truth in zip(query_vectors, ground_truth):
+            start = time.perf_counter()
+            hits = vector_search(es, bench_index, q.tolist(), size=k, rescore_oversample=rescore_oversample)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len({h["id"] for h in hits} & truth) / k)
+
+        rows.append({
+            "mode": mode,
+            "vectors": len(ids),
+            "est_ram_mb": round(_estimated_vector_bytes(mode, dims) * len(ids) / 1024 / 1024, 2),
+            "vector_disk_mb": round(vector_disk / 1024 / 1024, 2),
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+            "p50_ms": round(_percentile(latencies, 50), 2),
+            "p95_ms": round(_percentile(latencies, 95), 2),
+        })
+        if not keep_indices:
+            delete_elastic_index(bench_index)
+
+    print(f"\n📊 向量量化对比 (rescore_oversample={rescore_oversample})")
+    _print_table(rows, list(rows[0].keys()))
+    print("注: vector_disk 包含为重打分保留的原始float向量; est_ram 为HNSW搜索需要常驻page cache的部分")
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 多进程解析: 页/秒 随进程数的扩展曲线
+# ---------------------------------------------------------------------------
+
+def bench_parse(pdf_path: str, workers_list: List[int], repeat: int = 1) -> List[Dict[str, Any]]:
+    """用不同进程数解析同一个PDF, 输出页/秒和相对单进程的加速比, 并校验合并结果与单进程一致"""
+    rows, baseline_rate, baseline_pages = [], None, None
+    for workers in sorted(set([1] + list(workers_list))):
+        elapsed = []
+        for _ in range(repeat):
+            image_dir = tempfile.mkdtemp(prefix="bench_parse_")
+            try:
+                start = time.perf_counter()
+                pages = parse_pdf_pages(pdf_path, workers=workers, image_dir=image_dir)
+                elapsed.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(image_dir, ignore_errors=True)
+        # 图片路径在不同临时目录下, 只比较文本、表格和图片xref
+        signature = [(p["text"], p["tables"], [i["xref"] for i in p["images"]]) for p in pages]
+        if baseline_pages is None:
+            baseline_pages = signature
+        seconds = float(np.median(elapsed))
+        rate = len(pages) / seconds
+        baseline_rate = baseline_rate or rate
+        rows.append({
+            "workers": workers,
+            "effective_workers": max(1, min(workers, len(pages) // MIN_PAGES_PER_WORKER)),
+            "pages": len(pages),
+            "seconds": round(seconds, 2),
+            "pages_per_sec": round(rate, 1),
+            "speedup": round(rate / baseline_rate, 2),
+            "identical": signature == baseline_pages,
+        })
+
+    print(f"\n📊 PDF解析扩展曲线: {os.path.basename(pdf_path)} (CPU核数 {os.cpu_count()})")
+    _print_table(rows, list(rows[0].keys()))
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 已向量化块的内存占用和bulk编码速度
+# ---------------------------------------------------------------------------
+
+def _traced(build):
+    """返回 (build()的结果, 构建过程中新增且仍存活的内存字节数)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def bench_chunk_memory(count: int = 10000, dims: int = 1024) -> List[Dict[str, Any]]:
+    """对比 dict+Python float列表 与 ChunkBatch 的内存和序列化耗时, 换算为每10万块
+
+    文本内容两种方式共享同一批字符串, 不计入对比
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((count, dims)).astype(np.float32)
+    chunks = [{"id": f"doc_chunk_{i}", "content": f"第{i}块的正文内容" * 20, "file_name": "bench.pdf",
+               "content_type": "text", "page_num": i // 10 + 1, "chunk_index": i % 10, "metadata": {}}
+              for i in range(count)]
+    scale = 100000 / count
+
+    legacy, legacy_bytes = _traced(lambda: [dict(chunk, vector=row) for chunk, row in zip(chunks, matrix.tolist())])
+    start = time.perf_counter()
+    for chunk in legacy:
+        # 原先每块调用一次es.index, 客户端对body做一次json序列化
+        json.dumps({"text": chunk["content"], "vector": chunk["vector"], "content_type": chunk["content_type"],
+                    "page_num": chunk["page_num"], "chunk_index": chunk["chunk_index"],
+                    "metadata": chunk["metadata"]}, ensure_ascii=False).encode("utf-8")
+    legacy_encode = time.perf_counter() - start
+    del legacy
+
+    batch, batch_bytes = _traced(lambda: ChunkBatch(chunks, matrix.copy()))
+    start = time.perf_counter()
+    for i in range(0, count, 500):
+        batch.bulk_body("bench", i, i + 500)
+    batch_encode = time.perf_counter() - start
+
+    rows = [
+        {"layout": "dict + list[float]", "mb_per_100k": round(legacy_bytes * scale / 1024 / 1024, 1),
+         "encode_s_per_100k": round(legacy_encode * scale, 2)},
+        {"layout": "ChunkBatch float32", "mb_per_100k": round(batch_bytes * scale / 1024 / 1024, 1),
+         "encode_s_per_100k": round(batch_encode * scale, 2)},
+    ]
+    print(f"\n📊 已向量化块的内存占用 (dims={dims}, 实测{count}块, 编码器: {'orjson' if orjson else 'json'})")
+    _print_table(rows, list(rows[0].keys()))
+    print(f"内存降低 {legacy_bytes / max(batch_bytes, 1):.1f}x, 编码加速 {legacy_encode / max(batch_encode, 1e-9):.1f}x")
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 重排序门控: 节省的rerank调用和引用变化
+# ---------------------------------------------------------------------------
+
+def bench_rerank_gate(index: str, queries_file: str, top_k: int = 10, cutoff: int = 5) -> Dict[str, Any]:
+    """每个问题分别做全部重排和门控重排, 对比送入步骤8的前cutoff个引用是否变化"""
+    queries = _load_queries(queries_file)
+    if not queries:
+        raise ValueError("需要通过 --queries-file 提供问题")
+
+    actions = {"skip": 0, "window": 0, "full": 0}
+    docs_full = docs_gated = 0
+    same_set = same_order = 0
+    jaccards, full_ms, gated_ms = [], [], []
+    for query in queries:
+        results = elastic_search(query, index)[:top_k]
+
+        start = time.perf_counter()
+        full = rerank(query, copy.deepcopy(results))
+        full_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        gated, decision = gated_rerank(query, copy.deepcopy(results), cutoff)
+        gated_ms.append((time.perf_counter() - start) * 1000)
+
+        actions[decision["action"]] += 1
+        docs_full += len(results)
+        docs_gated += decision["window"][1] - decision["window"][0]
+        cited_full = [r["id"] for r in full[:cutoff]]
+        cited_gated = [r["id"] for r in gated[:cutoff]]
+        union = set(cited_full) | set(cited_gated)
+        jaccards.append(len(set(cited_full) & set(cited_gated)) / len(union) if union else 1.0)
+        same_set += set(cited_full) == set(cited_gated)
+        same_order += cited_full == cited_gated
+
+    n = len(queries)
+    summary = {
+        "queries": n,
+        "skipped": actions["skip"],
+        "window_reranks": actions["window"],
+        "full_reranks": actions["full"],
+        "rerank_calls_saved": f"{actions['skip'] / n:.1%}",
+        "rerank_docs_saved": f"{1 - docs_gated / max(docs_full, 1):.1%}",
+        "citations_same_set": f"{same_set / n:.1%}",
+        "citations_same_order": f"{same_order / n:.1%}",
+        "citation_jaccard": round(float(np.mean(jaccards)), 4),
+        "rerank_p50_ms_full": round(_percentile(full_ms, 50), 1),
+        "rerank_p50_ms_gated": round(_percentile(gated_ms, 50), 1),
+    }
+    print(f"\n📊 重排序门控 ({index}, top_k={top_k}, 引用前{cutoff}个)")
+    _print_table([{"metric": k, "value": v} for k, v in summary.items()], ["metric", "value"])
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# 两阶段检索: 不同语料规模下与全量检索的延迟和召回率对比
+# ---------------------------------------------------------------------------
+
+def _synthetic_corpus(num_chunks: int, dims: int, chunks_per_page: int, pages_per_doc: int, rng):
+    """文档主题 → 页 → 块 三层带噪声的单位向量, 模拟同一页的块语义相近"""
+    num_pages = max(1, num_chunks // chunks_per_page)
+    num_docs = max(1, num_pages // pages_per_doc)
+
+    def unit(x):
+        return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+    docs = unit(rng.standard_normal((num_docs, dims)))
+    page_doc = np.arange(num_pages) % num_docs
+    pages = unit(docs[page_doc] + 0.8 * unit(rng.standard_normal((num_pages, dims))))
+    chunk_page = np.arange(num_chunks) % num_pages
+    chunks = unit(pages[chunk_page] + 0.9 * unit(rng.standard_normal((num_chunks, dims))))
+    return chunks, chunk_page, num_pages
+
+
+def bench_two_stage_synthetic(sizes: List[int], dims: int = 256, chunks_per_page: int = 8, pages_per_doc: int = 20,
+                              page_top_k: int = 20, num_queries: int = 50, k: int = 10) -> List[Dict[str, Any]]:
+    """NumPy上的精确检索, 对比全量块检索和 页向量top-k → 页内块检索 的延迟与recall@k
+
+    页向量与 page_index.PageCentroids 相同, 为页内块向量的归一化平均; 以全量检索的结果为ground truth
+    """
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in sizes:
+        chunks, chunk_page, num_pages = _synthetic_corpus(size, dims, chunks_per_page, pages_per_doc, rng)
+        sums = np.zeros((num_pages, dims), dtype=np.float64)
+        np.add.at(sums, chunk_page, chunks)
+        centroids = (sums / np.linalg.norm(sums, axis=1, keepdims=True)).astype(np.float32)
+        order = np.argsort(chunk_page, kind="stable")
+        bounds = np.searchsorted(chunk_page[order], np.arange(num_pages + 1))
+
+        picks = rng.integers(0, size, num_queries)
+        # 问题与某个块相关但不相同: 块向量加上同等模长的随机噪声
+        noise = rng.standard_normal((num_queries, dims)).astype(np.float32)
+        queries = chunks[picks] + noise / np.linalg.norm(noise, axis=1, keepdims=True)
+
+        flat_ms, two_ms, recalls, scanned = [], [], [], []
+        for q in queries:
+            start = time.perf_counter()
+            scores = chunks @ q
+            truth = np.argpartition(-scores, k)[:k]
+            flat_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            top_pages = np.argpartition(-(centroids @ q), min(page_top_k, num_pages - 1))[:page_top_k]
+            candidates = np.concatenate([order[bounds[p]:bounds[p + 1]] for p in top_pages])
+            local = chunks[candidates] @ q
+            found = candidates[np.argpartition(-local, min(k, len(candidates) - 1))[:k]]
+            two_ms.append((time.perf_counter() - start) * 1000)
+
+            recalls.append(len(set(truth.tolist()) & set(found.tolist())) / k)
+            scanned.append(num_pages + len(candidates))
+
+        rows.append({
+            "chunks": size,
+            "pages": num_pages,
+            "flat_p50_ms": round(_percentile(flat_ms, 50), 2),
+            "two_stage_p50_ms": round(_percentile(two_ms, 50), 2),
+            "speedup": f"{_percentile(flat_ms, 50) / max(_percentile(two_ms, 50), 1e-9):.1f}x",
+            "vectors_scored": f"{np.mean(scanned) / size:.1%}",
+            f"recall@{k}": round(float(np.mean(recalls)), 4),
+        })
+        del chunks, centroids
+
+    print(f"\n📊 两阶段检索 (合成语料, dims={dims}, 每页{chunks_per_page}块, page_top_k={page_top_k})")
+    _print_table(rows, list(rows[0].keys()))
+    return rows
+
+
+def bench_two_stage_es(index: str, queries_file: str, page_top_k_list: List[int], k: int = 10) -> List[Dict[str, Any]]:
+    """在真实索引上对比全量检索和不同page_top_k的两阶段检索: 延迟和前k个融合结果的重合率"""
+    queries = _load_queries(queries_file)
+    if not queries:
+        raise ValueError("需要通过 --queries-file 提供问题")
+
+    def run(two_stage, page_top_k=None):
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = elastic_search(query, index, use_cache=False, two_stage=two_stage, page_top_k=page_top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([h["id"] for h in hits[:k]])
+        return latencies, results
+
+    flat_ms, flat_results = run(False)
+    rows = [{"mode": "flat", "p50_ms": round(_percentile(flat_ms, 50), 1),
+             "p95_ms": round(_percentile(flat_ms, 95), 1), f"overlap@{k}": 1.0}]
+    for page_top_k in page_top_k_list:
+        ms, results = run(True, page_top_k)
+        overlap = [len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(flat_results, results)]
+        rows.append({"mode": f"two_stage(pages={page_top_k})", "p50_ms": round(_percentile(ms, 50), 1),
+                     "p95_ms": round(_percentile(ms, 95), 1), f"overlap@{k}": round(float(np.mean(overlap)), 4)})
+
+    print(f"\n📊 两阶段检索 ({index}, {len(queries)}个问题)")
+    _print_table(rows, list(rows[0].keys()))
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 文本与索引分离: 索引体积 / 响应大小 / 取回正文的开销
+# ---------------------------------------------------------------------------
+
+def bench_text_store(source_index: str, queries_file: Optional[str] = None, num_queries: int = 50, k: int = 10,
+                     keep_indices: bool = False) -> List[Dict[str, Any]]:
+    """把source_index的文档分别写入默认布局和文本分离布局的临时索引, 对比ES存储、本地正文存储、
+    BM25 top-k响应的大小 (含/不含vector) 和为top-k取回正文的耗时"""
+    es = get_es()
+    print(f"📥 读取 {source_index} 中的文档...")
+    docs = list(iter_es_docs(es, source_index))
+    if not docs:
+        raise ValueError(f"索引 {source_index} 中没有文档")
+
+    queries = _load_queries(queries_file)[:num_queries]
+    if not queries:
+        # 没有问题文件时, 用文档开头的片段作为关键词查询
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(docs), size=min(num_queries, len(docs)), replace=False)
+        queries = [(docs[i][2].get("text") or "")[:30] for i in sample]
+        queries = [q for q in queries if q.strip()]
+
+    def response_bytes(res):
+        return len(json.dumps(res.body, ensure_ascii=False).encode("utf-8"))
+
+    rows = []
+    vector_index_type = get_vector_index_type(es, source_index)
+    for layout in ("inline", "external"):
+        bench_index = f"{source_index}_bench_{layout}_text"
+        if es.indices.exists(index=bench_index):
+            delete_elastic_index(bench_index)
+        create_elastic_index(bench_index, vector_index_type, external_text=layout == "external")
+        text_store = get_text_store(bench_index) if layout == "external" else None
+        if text_store is not None:
+            text_store.put_many((doc_id, source.get("text"), source.get("metadata")) for doc_id, _, source in docs)
+
+        actions = ({"_index": bench_index, "_id": doc_id, "_source": {**source, "vector": vector}}
+                   for doc_id, vector, source in docs)
+        helpers.bulk(es.options(request_timeout=300), actions, chunk_size=500)
+        es.indices.refresh(index=bench_index)
+        es.options(request_timeout=600).indices.forcemerge(index=bench_index, max_num_segments=1)
+        store_bytes = es.indices.stats(index=bench_index, metric="store")["indices"][bench_index]["primaries"]["store"]["size_in_bytes"]
+
+        full_bytes, slim_bytes, search_ms, hydrate_ms = [], [], [], []
+        for query in queries:
+            match = {"match": {"text": query}}
+            full_bytes.append(response_bytes(es.search(index=bench_index, query=match, size=k)))
+            start = time.perf_counter()
+            res = es.search(index=bench_index, query=match, size=k, source_excludes=["vector"])
+            search_ms.append((time.perf_counter() - start) * 1000)
+            slim_bytes.append(response_bytes(res))
+            if text_store is not None:
+                hits = [{"id": hit["_id"], "metadata": hit["_source"].get("metadata")} for hit in res["hits"]["hits"]]
+                start = time.perf_counter()
+                text_store.hydrate(hits)
+                hydrate_ms.append((time.perf_counter() - start) * 1000)
+
+        rows.append({
+            "layout": layout,
+            "docs": len(docs),
+            "es_store_mb": round(store_bytes / 1024 / 1024, 2),
+            "text_store_mb": round(text_store.stats()["bytes"] / 1024 / 1024, 2) if text_store else 0,
+            f"resp_kb@{k}": round(np.mean(full_bytes) / 1024, 1),
+            f"resp_kb@{k}_no_vector": round(np.mean(slim_bytes) / 1024, 1),
+            "search_p50_ms": round(_percentile(search_ms, 50), 2),
+            "hydrate_p50_ms": round(_percentile(hydrate_ms, 50), 2),
+        })
+        if not keep_indices:
+            delete_elastic_index(bench_index)
+
+    print(f"\n📊 文本与索引分离 ({source_index}, {len(queries)}个BM25查询)")
+    _print_table(rows, list(rows[0].keys()))
+    print("注: resp_kb 为默认返回全部_source时的响应大小, no_vector 为检索实际使用的 source_excludes=[vector]")
+    return rows
+
+
+def _synthetic_embedding(overhead_ms: float, per_text_ms: float, dims: int = 1024):
+    """模拟单卡嵌入服务: 同一时间只处理一个请求, 耗时 = 固定开销 + 每条文本的耗时"""
+    gpu = threading.Lock()
+
+    def embed(texts, timeout=None):
+        with gpu:
+            time.sleep((overhead_ms + per_text_ms * len(texts)) / 1000)
+        return [np.zeros(dims, dtype=np.float32) for _ in texts]
+    return embed
+
+
+def bench_embed_batch(users_list: List[int], queries_per_user: int = 20, window_ms: float = 5.0,
+                      max_batch: int = 32, overhead_ms: float = 15.0, per_text_ms: float = 0.5,
+                      live: bool = False) -> List[Dict[str, Any]]:
+    """N个并发用户各自连续提问, 对比逐条调用嵌入服务与微批处理的吞吐、延迟和批大小分布"""
+    embed_fn = local_embedding if live else _synthetic_embedding(overhead_ms, per_text_ms)
+    rows = []
+    for users in users_list:
+        for mode in ("single", "batched"):
+            batcher = EmbeddingBatcher(embed_fn, window_ms, max_batch) if mode == "batched" else None
+            latencies = []
+            lock = threading.Lock()
+
+            def user(u):
+                for q in range(queries_per_user):
+                    # 每个问题不同, 不受查询向量缓存影响
+                    text = f"用户{u}的第{q}个问题"
+                    start = time.perf_counter()
+                    if batcher is not None:
+                        batcher.embed(text)
+                    else:
+                        embed_fn([text])
+                    with lock:
+                        latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=user, args=(u,)) for u in range(users)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+
+            row = {
+                "users": users,
+                "mode": mode,
+                "qps": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(_percentile(latencies, 50), 1),
+                "p95_ms": round(_percentile(latencies, 95), 1),
+            }
+            if batcher is not None:
+                stats = batcher.stats()
+                row.update({
+                    "mean_batch": round(stats["mean_batch_size"], 1),
+                    "queue_p50_ms": round(stats["queue_delay_ms"]["p50"], 1),
+                    "queue_p95_ms": round(stats["queue_delay_ms"]["p95"], 1),
+                    "batch_sizes": stats["batch_sizes"],
+                })
+            rows.append(row)
+
+    print(f"\n📊 查询向量微批处理 (窗口{window_ms}ms, 最大批{max_batch}, "
+          + ("真实嵌入服务" if live else f"模拟服务: 每次调用{overhead_ms}ms + 每条{per_text_ms}ms") + ")")
+    _print_table(rows, ["users", "mode", "qps", "p50_ms", "p95_ms", "mean_batch", "queue_p50_ms", "queue_p95_ms"])
+    print("\n批大小分布 {批大小: 批次数}:")
+    for row in rows:
+        if "batch_sizes" in row:
+            print(f"  {row['users']}个用户: {row['batch_sizes']}")
+    return rows
+
+
+def _synthetic_service(base_ms: float, slow_ms: float, slow_rate: float, seed: int = 0):
+    """模拟有偶发慢响应的服务: 每个请求独立地以 slow_rate 的概率耗时 slow_ms, 否则约为 base_ms"""
+    rng = np.random.default_rng(seed)
+    lock = threading.Lock()
+
+    def call(text):
+        with lock:
+            slow = rng.random() < slow_rate
+            jitter = rng.exponential(base_ms * 0.2)
+        time.sleep(((slow_ms if slow else base_ms) + jitter) / 1000)
+        return text
+    return call
+
+
+def bench_hedging(num_requests: int = 2000, concurrency: int = 8, percentiles: Optional[List[float]] = None,
+                  budget_ratio: float = 0.1, base_ms: float = 20.0, slow_ms: float = 300.0, slow_rate: float = 0.03,
+                  live: Optional[str] = None) -> List[Dict[str, Any]]:
+    """对比不对冲与不同对冲分位数下的p50/p95/p99延迟和额外请求比例
+
+    live: "embedding" 或 "rerank" 时改为请求真实服务, 否则使用模拟服务
+    """
+    percentiles = percentiles or [90, 95, 99]
+    if live == "embedding":
+        from embedding import _post_embedding
+        service = lambda text: _post_embedding([text])
+    elif live == "rerank":
+        from retrieve_documents import _post_rerank
+        service = lambda text: _post_rerank(text, [text, "无关文档"])
+    else:
+        service = _synthetic_service(base_ms, slow_ms, slow_rate)
+
+    rows = []
+    for pct in [None] + percentiles:
+        hedger = Hedger(f"bench-{pct}", percentile=pct or 95, budget_ratio=budget_ratio, enabled=pct is not None)
+        latencies = []
+        lock = threading.Lock()
+        counter = iter(range(num_requests))
+
+        def worker():
+            for i in counter:
+                start = time.perf_counter()
+                hedger.call(service, f"基准测试请求{i}")
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = hedger.stats()
+        rows.append({
+            "hedge_at": f"p{pct:g}" if pct else "off",
+            "p50_ms": round(_percentile(latencies, 50), 1),
+            "p95_ms": round(_percentile(latencies, 95), 1),
+            "p99_ms": round(_percentile(latencies, 99), 1),
+            "max_ms": round(max(latencies), 1),
+            "extra_load": f"{stats['extra_load']:.1%}" if pct else "0.0%",
+            "hedge_wins": stats["hedge_wins"] if pct else 0,
+            "budget_denied": stats["budget_denied"] if pct else 0,
+        })
+
+    source = f"真实服务 {live}" if live else f"模拟服务: {base_ms}ms, {slow_rate:.0%}的请求{slow_ms}ms"
+    print(f"\n📊 对冲请求 ({num_requests}个请求, 并发{concurrency}, 预算{budget_ratio:.0%}, {source})")
+    _print_table(rows, list(rows[0].keys()))
+    return rows
+
+
+def bench_image_filter(pdf_path: str, threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+    """给PDF中会送入VLM的每张图片打分, 输出各项特征、是否丢弃和打分耗时, 用于调整阈值"""
+    threshold = IMAGE_FILTER_THRESHOLD if threshold is None else threshold
+    image_dir = tempfile.mkdtemp(prefix="bench_images_")
+    try:
+        pages = parse_pdf_pages(pdf_path, tables=False, image_dir=image_dir)
+        rows = []
+        for page in pages:
+            for image in page["images"]:
+                if not image["path"]:
+                    continue
+                start = time.perf_counter()
+                features = image_features(image["path"])
+                score = image_score(features)
+                rows.append({
+                    "page": page["page_num"] + 1,
+                    "image": image["image_index"],
+                    "score": round(score, 3),
+                    **{name: round(value, 3) for name, value in features.items()},
+                    "ms": round((time.perf_counter() - start) * 1000, 1),
+                    "decision": "keep" if score >= threshold else "drop",
+                })
+    finally:
+        shutil.rmtree(image_dir, ignore_errors=True)
+    if not rows:
+        print(f"{pdf_path} 中没有会送入VLM的图片")
+        return rows
+    dropped = sum(r["decision"] == "drop" for r in rows)
+    print(f"\n📊 装饰性图片过滤 ({pdf_path}, 阈值{threshold})")
+    _print_table(rows, list(rows[0].keys()))
+    print(f"共{len(rows)}张, 丢弃{dropped}张 ({dropped / len(rows):.0%}), "
+          f"平均打分耗时 {np.mean([r['ms'] for r in rows]):.1f}ms")
+    return rows
+
+
+def bench_table_prefilter(pdf_paths: List[str], labels_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """每个PDF逐页对比: 全部调用find_tables 与 先预筛再只对候选页调用find_tables 的耗时,
+    以及被跳过的页上漏掉的表格
+
+    labels_path: 可选的人工标注 {"文件名": [有表格的页码(从1开始)]}, 额外统计被跳过的标注页;
+                 未标注的文件以全量find_tables的结果为准
+    """
+    labels = {}
+    if labels_path:
+        with open(labels_path, "r", encoding="utf-8") as f:
+            labels = {os.path.basename(name): set(pages) for name, pages in json.load(f).items()}
+
+    rows = []
+    for pdf_path in pdf_paths:
+        name = os.path.basename(pdf_path)
+        full_seconds = prefilter_seconds = candidate_seconds = 0.0
+        reasons, skipped, missed = Counter(), [], []
+        tables_found = 0
+        with fitz.open(pdf_path) as pdf_document:
+            page_count = pdf_document.page_count
+            for page_num in range(page_count):
+                page = pdf_document.load_page(page_num)
+                start = time.perf_counter()
+                candidate, reason = table_candidate(page)
+                prefilter_seconds += time.perf_counter() - start
+
+                start = time.perf_counter()
+                try:
+                    table_count = len(page.find_tables().tables)
+                except Exception:
+                    table_count = 0
+                elapsed = time.perf_counter() - start
+                full_seconds += elapsed
+                tables_found += table_count
+
+                if candidate:
+                    reasons[reason] += 1
+                    candidate_seconds += elapsed
+                else:
+                    skipped.append(page_num + 1)
+                    if table_count:
+                        missed.append((page_num + 1, table_count))
+
+        row = {
+            "file": name,
+            "pages": page_count,
+            "rules": reasons["rules"],
+            "aligned_text": reasons["aligned_text"],
+            "skipped": len(skipped),
+            "skip_rate": f"{len(skipped) / max(page_count, 1):.0%}",
+            "full_s": round(full_seconds, 2),
+            "prefilter_s": round(prefilter_seconds + candidate_seconds, 2),
+            "speedup": round(full_seconds / max(prefilter_seconds + candidate_seconds, 1e-9), 1),
+            "tables": tables_found,
+            "missed_tables": sum(count for _, count in missed),
+        }
+        if name in labels:
+            row["labelled_pages"] = len(labels[name])
+            row["missed_labelled"] = len(labels[name] & set(skipped))
+        rows.append(row)
+        if missed:
+            print(f"⚠️ {name} 被跳过但find_tables找到表格的页: {', '.join(f'{p}({n})' for p, n in missed)}")
+        if name in labels and labels[name] & set(skipped):
+            print(f"⚠️ {name} 被跳过的标注页: {sorted(labels[name] & set(skipped))}")
+
+    print("\n📊 表格候选页预筛")
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    _print_table(rows, columns)
+    return rows
+
+
+def _parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """解析 -X importtime 的输出, 每个模块: {"module", "self_us", "cumulative_us", "depth"}"""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return records
+
+
+def bench_import_time(modules: List[str], repeat: int = 3, top: int = 10) -> List[Dict[str, Any]]:
+    """在新的解释器中 import 每个模块 (python -X importtime), 输出总启动时间、导入耗时,
+    按顶层包汇总的导入耗时以及该模块直接导入的依赖中最慢的几个
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=here,
+                              capture_output=True, text=True)
+        wall_ms = (time.perf_counter() - start) * 1000
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        return wall_ms, _parse_importtime(proc.stderr)
+
+    interpreter_ms = float(np.median([run("pass")[0] for _ in range(repeat)]))
+    rows = []
+    for module in modules:
+        runs = [run(f"import {module}") for _ in range(repeat)]
+        wall_ms = float(np.median([wall for wall, _ in runs]))
+        records = runs[-1][1]
+        target = next((r for r in records if r["module"] == module), None)
+        import_ms = target["cumulative_us"] / 1000 if target else 0.0
+        rows.append({
+            "module": module,
+            "wall_ms": round(wall_ms, 1),
+            "interpreter_ms": round(interpreter_ms, 1),
+            "import_ms": round(import_ms, 1),
+            "modules_loaded": len(records),
+        })
+
+        by_package = Counter()
+        for r in records:
+            by_package[r["module"].split(".")[0]] += r["self_us"]
+        print(f"\n📦 {module}: 按顶层包汇总的导入耗时 (前{top})")
+        _print_table([{"package": name, "ms": round(us / 1000, 1)} for name, us in by_package.most_common(top)],
+                     ["package", "ms"])
+
+        if target is not None:
+            # -X importtime 先输出子模块再输出父模块, 紧挨在目标模块之前、深度加一的记录是它直接导入的模块
+            index = records.index(target)
+            start = max((i + 1 for i, r in enumerate(records[:index]) if r["depth"] <= target["depth"]), default=0)
+            direct = [r for r in records[start:index] if r["depth"] == target["depth"] + 1]
+            direct.sort(key=lambda r: r["cumulative_us"], reverse=True)
+            print(f"📦 {module}: 直接导入中最慢的 (前{top}, 含各自的依赖)")
+            _print_table([{"import": r["module"], "cumulative_ms": round(r["cumulative_us"] / 1000, 1)}
+                          for r in direct[:top]], ["import", "cumulative_ms"])
+
+    print(f"\n📊 导入耗时 (新解释器, {repeat}次取中位数)")
+    _print_table(rows, list(rows[0].keys()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG流水线性能基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("quantization", help="对比不同向量量化布局的内存、召回率和延迟")
+    p.add_argument("--source-index", required=True, help="已加载文档的索引, 作为向量来源")
+    p.add_argument("--modes", nargs="+", default=list(VECTOR_INDEX_TYPES), choices=VECTOR_INDEX_TYPES)
+    p.add_argument("--queries-file", type=str, help="每行一个问题; 不提供时从库中抽样向量作为查询")
+    p.add_argument("--num-queries", type=int, default=100)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--rescore-oversample", type=float, default=0)
+    p.add_argument("--keep-indices", action="store_true", help="保留临时基准索引")
+
+    p = sub.add_parser("parse", help="对比不同进程数解析单个PDF的速度")
+    p.add_argument("--pdf", required=True, help="用于测试的PDF, 页数越多越能体现扩展性")
+    p.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32])
+    p.add_argument("--repeat", type=int, default=1, help="每个进程数重复次数, 取中位数")
+
+    p = sub.add_parser("chunk-memory", help="对比已向量化块两种存储方式的内存和bulk编码耗时")
+    p.add_argument("--count", type=int, default=10000, help="实测块数, 结果换算为每10万块")
+    p.add_argument("--dims", type=int, default=1024)
+
+    p = sub.add_parser("rerank-gate", help="统计重排序门控节省的rerank调用和引用变化")
+    p.add_argument("--index", required=True)
+    p.add_argument("--queries-file", required=True, help="每行一个问题")
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--cutoff", type=int, default=5, help="答案使用的引用数, 与步骤8一致")
+
+    p = sub.add_parser("two-stage", help="对比两阶段检索与全量检索在不同语料规模下的延迟和召回率")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000], help="合成语料的块数")
+    p.add_argument("--dims", type=int, default=256)
+    p.add_argument("--chunks-per-page", type=int, default=8)
+    p.add_argument("--page-top-k", type=int, nargs="+", default=[10, 20, 50])
+    p.add_argument("--index", default=None, help="指定时改为在该ES索引上对比 (需要页索引)")
+    p.add_argument("--queries-file", default=None, help="每行一个问题, 与 --index 一起使用")
+
+    p = sub.add_parser("text-store", help="对比正文存于ES _source与存于本地TextStore的索引体积和响应大小")
+    p.add_argument("--source-index", required=True)
+    p.add_argument("--queries-file", default=None, help="每行一个问题, 默认使用文档开头的片段")
+    p.add_argument("--num-queries", type=int, default=50)
+    p.add_argument("--keep-indices", action="store_true")
+
+    p = sub.add_parser("embed-batch", help="对比并发查询逐条嵌入与微批嵌入的吞吐和延迟")
+    p.add_argument("--users", type=int, nargs="+", default=[1, 8, 32, 64], help="并发用户数")
+    p.add_argument("--queries-per-user", type=int, default=20)
+    p.add_argument("--window-ms", type=float, default=5.0)
+    p.add_argument("--max-batch", type=int, default=32)
+    p.add_argument("--overhead-ms", type=float, default=15.0, help="模拟服务每次调用的固定开销")
+    p.add_argument("--per-text-ms", type=float, default=0.5, help="模拟服务每条文本的耗时")
+    p.add_argument("--live", action="store_true", help="使用真实嵌入服务 (EMBEDDING_URL) 代替模拟服务")
+
+    p = sub.add_parser("hedging", help="对比不对冲与不同分位数对冲下的尾延迟和额外负载")
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--percentiles", type=float, nargs="+", default=[90, 95, 99], help="对冲延迟使用的分位数")
+    p.add_argument("--budget-ratio", type=float, default=0.1, help="对冲请求最多占正常请求的比例")
+    p.add_argument("--base-ms", type=float, default=20.0, help="模拟服务的正常延迟")
+    p.add_argument("--slow-ms", type=float, default=300.0, help="模拟服务慢响应的延迟")
+    p.add_argument("--slow-rate", type=float, default=0.03, help="模拟服务慢响应的比例")
+    p.add_argument("--live", choices=["embedding", "rerank"], default=None, help="改为请求真实服务")
+
+    p = sub.add_parser("image-filter", help="给PDF中的图片打分, 查看装饰性图片过滤会丢弃哪些图片")
+    p.add_argument("--pdf", required=True)
+    p.add_argument("--threshold", type=float, default=None, help="默认读取 IMAGE_FILTER_THRESHOLD")
+
+    p = sub.add_parser("table-prefilter", help="统计表格预筛跳过的页、节省的find_tables耗时和漏掉的表格")
+    p.add_argument("--pdf", nargs="+", required=True)
+    p.add_argument("--labels", default=None, help='人工标注JSON: {"文件名": [有表格的页码]}')
+
+    p = sub.add_parser("import-time", help="用 -X importtime 统计各模块在新解释器中的导入耗时")
+    p.add_argument("--modules", nargs="+", default=["pipeline"])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--top", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == "quantization":
+        bench_quantization(args.source_index, args.modes, args.queries_file, args.num_queries,
+                           args.k, args.rescore_oversample, args.keep_indices)
+    elif args.command == "parse":
+        bench_parse(args.pdf, args.workers, args.repeat)
+    elif args.command == "chunk-memory":
+        bench_chunk_memory(args.count, args.dims)
+    elif args.command == "rerank-gate":
+        bench_rerank_gate(args.index, args.queries_file, args.top_k, args.cutoff)
+    elif args.command == "embed-batch":
+        bench_embed_batch(args.users, args.queries_per_user, args.window_ms, args.max_batch,
+                          args.overhead_ms, args.per_text_ms, args.live)
+    elif args.command == "hedging":
+        bench_hedging(args.requests, args.concurrency, args.percentiles, args.budget_ratio,
+                      args.base_ms, args.slow_ms, args.slow_rate, args.live)
+    elif args.command == "import-time":
+        bench_import_time(args.modules, args.repeat, args.top)
+    elif args.command == "table-prefilter":
+        bench_table_prefilter(args.pdf, args.labels)
+    elif args.command == "image-filter":
+        bench_image_filter(args.pdf, args.threshold)
+    elif args.command == "text-store":
+        bench_text_store(args.source_index, args.queries_file, args.num_queries, keep_indices=args.keep_indices)
+    elif args.command == "two-stage":
+        if args.index:
+            bench_two_stage_es(args.index, args.queries_file, args.page_top_k)
+        else:
+            for page_top_k in args.page_top_k:
+                bench_two_stage_synthetic(args.sizes, args.dims, args.chunks_per_page, page_top_k=page_top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+进程内缓存工具
+- LRUCache: 有界LRU缓存, 用于查询向量和检索结果
+- SemanticAnswerCache: 按查询向量相似度命中的答案缓存
+- normalize_query: 统一缓存键中的查询文本
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """全角转半角、统一大小写、合并空白并去掉结尾标点, 使措辞相同的问题命中同一缓存"""
+    text = unicodedata.normalize("NFKC", str(text or "")).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?？!！.。 ")
+
+
+class LRUCache:
+    """线程安全的有界LRU缓存, maxsize<=0 时不缓存"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SemanticAnswerCache:
+    """语义答案缓存: 新问题与已回答问题的向量余弦相似度超过阈值时直接返回缓存的答案和引用
+
+    条目按 (scope, generation) 隔离, scope一般为索引名, 索引写入后版本号变化, 旧答案不再命中
+    """
+
+    def __init__(self, threshold=0.95, ttl=86400, maxsize=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = []
+        self._matrix = None
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _evict(self, now):
+        """清理过期和超出容量的条目, 调用方持有锁"""
+        alive = [e for e in self._entries if now - e["created"] <= e["ttl"]]
+        alive = alive[-self.maxsize:] if self.maxsize > 0 else []
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._matrix = None
+
+    def lookup(self, vector, scope, generation):
+        """返回 (条目, 相似度)，未命中时条目为None"""
+        # 复制后再归一化: 查询向量来自嵌入缓存, 原地修改会改动缓存中的向量
+        q = np.array(vector, dtype=np.float32)
+        q /= np.linalg.norm(q) + 1e-12
+        with self._lock:
+            self.lookups += 1
+            self._evict(time.time())
+            if not self._entries:
+                return None, 0.0
+            if self._matrix is None:
+                self._matrix = np.stack([e["vector"] for e in self._entries])
+            scores = self._matrix @ q
+            # 其他索引或旧版本的条目不参与匹配
+            for i, e in enumerate(self._entries):
+                if e["scope"] != scope or e["generation"] != generation:
+                    scores[i] = -1.0
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None, similarity
+            self.hits += 1
+            return self._entries[best], similarity
+
+    def store(self, vector, scope, generation, query, answer, citations, ttl=None):
+        """ttl: 该条目的有效期(秒), 默认为缓存的 ttl; 依赖时效性数据 (如网络搜索结果) 的答案使用更短的有效期"""
+        v = np.array(vector, dtype=np.float32)
+        v /= np.linalg.norm(v) + 1e-12
+        with self._lock:
+            # 同一scope的旧版本条目已经不可能命中, 顺便丢弃
+            self._entries = [e for e in self._entries
+                             if e["scope"] != scope or e["generation"] == generation]
+            self._entries.append({
+                "vector": v,
+                "scope": scope,
+                "generation": generation,
+                "query": query,
+                "answer": answer,
+                "citations": citations,
+                "created": time.time(),
+                "ttl": self.ttl if ttl is None else min(ttl, self.ttl),
+            })
+            self._matrix = None
+            self._evict(time.time())
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+        }
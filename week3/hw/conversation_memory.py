@@ -0,0 +1,163 @@
+"""
+滚动压缩的对话记忆, 用于指代消解的历史上下文
+- 最近几轮对话保留原文
+- 更早的对话在后台线程中压缩为实体和话题摘要, 不阻塞当前问答
+- 渲染结果受token预算硬性限制, 并统计相对原始历史节省的token数
+"""
+
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from document_process import num_tokens_from_string
+from retrieve_documents import get_keyword, summarize_conversation
+
+MAX_ENTITIES = 20
+MAX_TOPICS = 10
+# 原先的做法是把最近10轮(20条)原文全部放进prompt, 作为节省token数的对比基准
+RAW_HISTORY_TURNS = 10
+
+
+def _truncate_to_tokens(text, budget):
+    """按token预算截断文本"""
+    if budget <= 0:
+        return ""
+    if num_tokens_from_string(text) <= budget:
+        return text
+    end = len(text)
+    while True:
+        end = int(end * 0.8)
+        if end == 0:
+            return ""
+        candidate = text[:end] + "..."
+        if num_tokens_from_string(candidate) <= budget:
+            return candidate
+
+
+class ConversationMemory:
+    def __init__(self, recent_turns=2, token_budget=800):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.turns = []            # 保留原文的最近几轮 (user, assistant)
+        self.pending = []          # 已移出原文窗口、等待后台压缩的轮次
+        self.summary = {"entities": [], "topics": []}
+        self._raw_turn_tokens = deque(maxlen=RAW_HISTORY_TURNS)
+        self.tokens_saved = 0      # 累计节省的token数
+        self.last_tokens = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+        self._compressing = False
+
+    def __bool__(self):
+        return bool(self.turns or self.pending or self.summary["entities"] or self.summary["topics"])
+
+    def add_turn(self, user, assistant):
+        """记录一轮对话, 溢出原文窗口的轮次交给后台压缩"""
+        with self._lock:
+            self._raw_turn_tokens.append(num_tokens_from_string(f"'user': {user}\n'assistant': {assistant}\n"))
+            self.turns.append((user, assistant))
+            if len(self.turns) > self.recent_turns:
+                overflow = len(self.turns) - self.recent_turns
+                self.pending.extend(self.turns[:overflow])
+                self.turns = self.turns[overflow:]
+        self._schedule_compression()
+
+    def _schedule_compression(self):
+        with self._lock:
+            if not self.pending or self._compressing:
+                return
+            self._compressing = True
+        self._executor.submit(self._compress_pending)
+
+    def _compress_pending(self):
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self._compressing = False
+                    return
+                batch = list(self.pending)
+                previous = {"entities": list(self.summary["entities"]), "topics": list(self.summary["topics"])}
+            try:
+                summary = summarize_conversation(previous, batch)
+            except Exception as e:
+                print(f"⚠️ 对话压缩失败, 使用关键词摘要: {e}")
+                summary = self._keyword_summary(previous, batch)
+            with self._lock:
+                self.summary = {
+                    "entities": list(dict.fromkeys(summary.get("entities", [])))[:MAX_ENTITIES],
+                    "topics": list(dict.fromkeys(summary.get("topics", [])))[:MAX_TOPICS],
+                }
+                self.pending = self.pending[len(batch):]
+
+    @staticmethod
+    def _keyword_summary(previous, turns):
+        """不调用模型的兜底摘要: 用户问题中的高频关键词"""
+        counter = Counter()
+        for user, _ in turns:
+            counter.update(w for w in get_keyword(user) if len(w) > 1)
+        keywords = [w for w, _ in counter.most_common(MAX_ENTITIES)]
+        return {
+            "entities": keywords + previous["entities"],
+            "topics": [user[:20] for user, _ in reversed(turns)] + previous["topics"],
+        }
+
+    def render(self):
+        """生成指代消解使用的历史文本, 不等待后台压缩"""
+        with self._lock:
+            turns = list(self.turns)
+            summary = {"entities": list(self.summary["entities"]), "topics": list(self.summary["topics"])}
+            pending = list(self.pending)
+        if pending:
+            # 后台压缩尚未完成的轮次先用关键词摘要顶上
+            summary = self._keyword_summary(summary, pending)
+
+        summary_lines = []
+        if summary["entities"]:
+            summary_lines.append("提到过的对象: " + "、".join(summary["entities"][:MAX_ENTITIES]))
+        if summary["topics"]:
+            summary_lines.append("讨论过的话题: " + "、".join(summary["topics"][:MAX_TOPICS]))
+        summary_text = "[更早的对话摘要]\n" + "\n".join(summary_lines) if summary_lines else ""
+
+        # 摘要最多占预算的1/4, 其余由原文轮次从新到旧平分; 每轮的份额先给用户问题 (超出时截断),
+        # 剩余的给助手回答。块之间和问答之间的换行各按1个token计入预算
+        blocks = []
+        if summary_text:
+            summary_text = _truncate_to_tokens(summary_text, self.token_budget // 4)
+        budget = self.token_budget - num_tokens_from_string(summary_text) - 1 if summary_text else self.token_budget
+        for i, (user, assistant) in enumerate(reversed(turns)):
+            share = budget // (len(turns) - i) - 1
+            user_text = _truncate_to_tokens(f"'user': {user}", share)
+            answer_text = _truncate_to_tokens(f"'assistant': {assistant}",
+                                              share - num_tokens_from_string(user_text) - 1)
+            block = "\n".join(t for t in (user_text, answer_text) if t)
+            if not block:
+                break
+            budget -= num_tokens_from_string(block) + 1
+            blocks.insert(0, block)
+        if summary_text:
+            blocks.insert(0, summary_text)
+
+        rendered = "\n".join(blocks)
+        # 拼接处的分词可能与单独计数不同, 仍超出预算时从最早的块开始丢弃
+        while len(blocks) > 1 and num_tokens_from_string(rendered) > self.token_budget:
+            blocks.pop(0)
+            rendered = "\n".join(blocks)
+        rendered = _truncate_to_tokens(rendered, self.token_budget)
+        self.last_tokens = num_tokens_from_string(rendered)
+        self.tokens_saved += max(0, self.raw_tokens - self.last_tokens)
+        return rendered
+
+    @property
+    def raw_tokens(self):
+        """按原先保留最近10轮原文的方式需要的token数"""
+        return sum(self._raw_turn_tokens)
+
+    def stats(self):
+        return {
+            "recent_turns": len(self.turns),
+            "summarized_entities": len(self.summary["entities"]),
+            "summarized_topics": len(self.summary["topics"]),
+            "raw_tokens": self.raw_tokens,
+            "rendered_tokens": self.last_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
@@ -0,0 +1,69 @@
+"""
+单次查询的时间预算
+问题进入后创建一个 Deadline, 依次传给指代消解、步骤6-8: 每个依赖调用的超时取剩余预算,
+可选阶段 (指代消解、RAG Fusion改写、重排序、网络搜索) 在剩余时间不足时跳过或提前结束,
+生成答案始终预留 reserve 秒。被降级的阶段记录在 degraded 中, 随回答一起返回。
+"""
+
+import math
+import time
+
+# 可选阶段开始前至少需要的剩余时间 (秒, 不含为生成答案预留的时间), 不足时跳过该阶段
+STAGE_MIN_SECONDS = {
+    "coreference": 2.0,
+    "rag_fusion": 2.0,
+    "rerank": 0.5,
+    "web_search": 1.5,
+}
+# 传给依赖调用的最小超时, 避免传入0或负数
+MIN_TIMEOUT = 0.05
+
+
+class Deadline:
+    def __init__(self, budget=None, reserve=0.0):
+        """budget: 总预算(秒), None或<=0表示不限时; reserve: 为生成答案预留的时间(秒)"""
+        self.budget = budget if budget and budget > 0 else None
+        # 预算很紧时预留不超过一半, 前面的必需阶段 (检索) 仍有时间
+        self.reserve = min(reserve, self.budget / 2) if self.budget else 0.0
+        self.started = time.monotonic()
+        self.degraded = []
+
+    @property
+    def enabled(self):
+        return self.budget is not None
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """距离截止时间的秒数, 不限时为inf"""
+        if self.budget is None:
+            return math.inf
+        return self.budget - self.elapsed()
+
+    def available(self):
+        """扣除生成答案的预留之后, 前面的阶段还能使用的时间"""
+        return self.remaining() - self.reserve
+
+    def allows(self, stage):
+        """可选阶段是否还有足够的时间执行"""
+        return self.available() >= STAGE_MIN_SECONDS.get(stage, 0.0)
+
+    def timeout(self, cap=None, reserve=True):
+        """依赖调用的超时(秒): 剩余预算 (默认扣除生成答案的预留) 与 cap 的较小值; 不限时返回cap"""
+        left = self.available() if reserve else self.remaining()
+        if math.isinf(left):
+            return cap
+        left = max(left, MIN_TIMEOUT)
+        return min(left, cap) if cap else left
+
+    def degrade(self, stage, reason):
+        self.degraded.append({"stage": stage, "reason": reason, "at_ms": round(self.elapsed() * 1000, 1)})
+        print(f"⏳ {stage} 已降级: {reason}")
+
+    def report(self):
+        return {
+            "budget": self.budget,
+            "elapsed_ms": round(self.elapsed() * 1000, 1),
+            "degraded": list(self.degraded),
+        }
@@ -0,0 +1,264 @@
+"""
+近似重复文本块检测 (MinHash + LSH)
+合同和法规中的大段模板条款会在不同文件、不同页面反复出现, 每一份都会被向量化、索引, 检索时又作为重复结果返回。
+在步骤3切分之后、步骤4向量化之前, 把近似重复的块映射到同一个规范块: 只为规范块生成向量和索引条目,
+其余副本的出处 (文件名, 页码) 记录在规范块的 metadata["duplicates"] 中, 生成答案时仍可引用。
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _shingles(text, size):
+    """按字符切分shingle (中文没有空格分词), 忽略空白差异"""
+    text = re.sub(r"\s+", "", text).lower()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _provenance(chunk):
+    return {"file_name": chunk.get("file_name"), "page_num": chunk.get("page_num")}
+
+
+class MinHashDeduper:
+    """MinHash签名 + 分段LSH查找候选, 再用签名估计的Jaccard相似度确认
+
+    规范块在整个流水线实例内共享, 同一次加载中后面的文件也会与前面文件的块去重。
+    dedupe() 的结果在 commit() 之前只对当前批次生效, 向量化或索引失败时不会留下未入库的规范块。
+    """
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=32, shingle_size=5, min_length=50, seed=1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_length = min_length
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._signatures = {}      # 规范块id -> MinHash签名
+        self._buckets = {}         # (段号, 段内签名) -> [规范块id]
+        self._duplicates = {}      # 规范块id -> 副本出处列表
+        self._staged = None
+
+    def signature(self, text):
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # 与datasketch相同的哈希族: (a*h + b) mod p, 取低32位
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def _find(self, signature, buckets, signatures, exclude=()):
+        """返回估计相似度最高且超过阈值的规范块id, exclude 中的规范块不参与匹配"""
+        best_id, best_score = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature):
+            for source in (self._buckets, buckets):
+                for candidate in source.get(key, ()):
+                    if candidate in seen or candidate in exclude:
+                        continue
+                    seen.add(candidate)
+                    other = signatures.get(candidate)
+                    if other is None:
+                        other = self._signatures[candidate]
+                    score = float(np.mean(signature == other))
+                    if score >= best_score:
+                        best_id, best_score = candidate, score
+        return best_id
+
+    def dedupe(self, chunks, replaced_ids=(), replaced_file=None):
+        """去掉近似重复的块
+
+        replaced_ids: 同一文件旧版本的块id (文件修改后重新加载); 新版本的id不同, 这些块即将被删除,
+                      不能作为规范块, 否则新版本中未改动的块会被当作旧版本的副本丢掉
+        replaced_file: 该文件的文件名, 其他规范块上记录的该文件的旧出处先去掉, 再按新版本重新记录
+
+        Returns:
+            (保留的块列表, 需要更新出处的已入库规范块 {id: duplicates}, 统计)
+        """
+        buckets, signatures = {}, {}
+        kept, dropped = [], 0
+        batch_canonicals = {}          # 本批次新的规范块id -> 块
+        updates = {}                   # 之前已入库的规范块id -> 新的副本出处列表
+        # 文件内容未变时新旧id相同, 这些块按原id覆盖写入, 仍可匹配
+        batch_ids = {chunk["id"] for chunk in chunks}
+        exclude = set(replaced_ids) - batch_ids
+        if replaced_file is not None:
+            for canonical_id, duplicates in self._duplicates.items():
+                if canonical_id in exclude or canonical_id in batch_ids:
+                    continue
+                remaining = [d for d in duplicates if d.get("file_name") != replaced_file]
+                if len(remaining) != len(duplicates):
+                    updates[canonical_id] = remaining
+
+        for chunk in chunks:
+            text = chunk.get("content", "")
+            signature = self.signature(text) if len(text) >= self.min_length else None
+            if signature is None:
+                kept.append(chunk)
+                continue
+
+            canonical_id = self._find(signature, buckets, signatures, exclude)
+            if canonical_id == chunk["id"]:
+                # 同一文件重新加载: 按原id覆盖写入, 保留其他文件的副本出处
+                duplicates = [d for d in self._duplicates.get(canonical_id, [])
+                              if d.get("file_name") != replaced_file]
+                if duplicates:
+                    chunk["metadata"] = dict(chunk.get("metadata") or {}, duplicates=duplicates)
+                batch_canonicals[canonical_id] = chunk
+                kept.append(chunk)
+                continue
+            if canonical_id is None:
+                signatures[chunk["id"]] = signature
+                for key in self._band_keys(signature):
+                    buckets.setdefault(key, []).append(chunk["id"])
+                batch_canonicals[chunk["id"]] = chunk
+                kept.append(chunk)
+                continue
+
+            dropped += 1
+            provenance = _provenance(chunk)
+            if canonical_id in batch_canonicals:
+                canonical = batch_canonicals[canonical_id]
+                # 同一页切出的多个块共享metadata字典, 复制后再写入
+                metadata = dict(canonical.get("metadata") or {})
+                duplicates = list(metadata.get("duplicates", []))
+                if provenance not in duplicates:
+                    duplicates.append(provenance)
+                metadata["duplicates"] = duplicates
+                canonical["metadata"] = metadata
+            else:
+                duplicates = updates.setdefault(canonical_id, list(self._duplicates.get(canonical_id, [])))
+                if provenance not in duplicates:
+                    duplicates.append(provenance)
+
+        self._staged = (buckets, signatures, batch_canonicals, updates)
+        stats = {
+            "input_chunks": len(chunks),
+            "kept_chunks": len(kept),
+            "embeddings_saved": dropped,
+            "index_entries_saved": dropped,
+            "provenance_updates": len(updates),
+        }
+        return kept, updates, stats
+
+    def commit(self, indexed_ids=None):
+        """当前批次已成功入库后调用, 其规范块参与之后批次的去重
+
+        indexed_ids: 实际写入成功的块id, 给出时写入失败的块不登记为规范块 (否则之后的副本会因它被丢弃)
+        """
+        if self._staged is None:
+            return
+        buckets, signatures, batch_canonicals, updates = self._staged
+        if indexed_ids is not None:
+            indexed_ids = set(indexed_ids)
+            signatures = {chunk_id: s for chunk_id, s in signatures.items() if chunk_id in indexed_ids}
+            buckets = {key: [chunk_id for chunk_id in ids if chunk_id in indexed_ids] for key, ids in buckets.items()}
+            batch_canonicals = {chunk_id: chunk for chunk_id, chunk in batch_canonicals.items()
+                                if chunk_id in indexed_ids}
+        self._signatures.update(signatures)
+        for key, ids in buckets.items():
+            self._buckets.setdefault(key, []).extend(ids)
+        for chunk_id, chunk in batch_canonicals.items():
+            duplicates = (chunk.get("metadata") or {}).get("duplicates")
+            if duplicates:
+                self._duplicates[chunk_id] = list(duplicates)
+            else:
+                self._duplicates.pop(chunk_id, None)
+        for chunk_id, duplicates in updates.items():
+            if duplicates:
+                self._duplicates[chunk_id] = duplicates
+            else:
+                self._duplicates.pop(chunk_id, None)
+        self._staged = None
+
+    def repoint(self, chunk_ids, file_name):
+        """file_name 的这些块即将被删除: 记录了其他文件副本的规范块不能删除 (副本没有入库),
+        改为归属第一个副本所在的文件, 其余副本仍记录在该块上
+
+        Returns:
+            {块id: {"file_name", "page_num", "duplicates"}}, 不在其中的块可以直接删除
+        """
+        repointed = {}
+        for chunk_id in chunk_ids:
+            remaining = [d for d in self._duplicates.get(chunk_id, []) if d.get("file_name") != file_name]
+            if not remaining:
+                continue
+            owner, rest = remaining[0], remaining[1:]
+            if rest:
+                self._duplicates[chunk_id] = rest
+            else:
+                self._duplicates.pop(chunk_id, None)
+            repointed[chunk_id] = {"file_name": owner.get("file_name"), "page_num": owner.get("page_num"),
+                                   "duplicates": rest}
+        return repointed
+
+    def remove_provenance(self, file_name, skip=()):
+        """文件被删除后, 从其他规范块上去掉该文件的副本出处, 返回需要更新的 {块id: duplicates}"""
+        skip = set(skip)
+        updates = {}
+        for chunk_id, duplicates in list(self._duplicates.items()):
+            if chunk_id in skip:
+                continue
+            remaining = [d for d in duplicates if d.get("file_name") != file_name]
+            if len(remaining) == len(duplicates):
+                continue
+            updates[chunk_id] = remaining
+            if remaining:
+                self._duplicates[chunk_id] = remaining
+            else:
+                del self._duplicates[chunk_id]
+        return updates
+
+    def restore(self, docs):
+        """从索引中已有的块重建规范块状态 (签名、LSH分桶、副本出处), 进程重启后调用
+
+        docs: 可迭代的 (块id, 正文, 副本出处列表); 索引中只有规范块, 每个块都按规范块登记
+        """
+        self._signatures, self._buckets, self._duplicates, self._staged = {}, {}, {}, None
+        for chunk_id, text, duplicates in docs:
+            if duplicates:
+                self._duplicates[chunk_id] = list(duplicates)
+            text = text or ""
+            signature = self.signature(text) if len(text) >= self.min_length else None
+            if signature is None:
+                continue
+            self._signatures[chunk_id] = signature
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, []).append(chunk_id)
+        return len(self._signatures)
+
+    def forget(self, chunk_ids):
+        """块从索引中删除后, 不再作为规范块参与去重"""
+        for chunk_id in chunk_ids:
+            signature = self._signatures.pop(chunk_id, None)
+            self._duplicates.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket and chunk_id in bucket:
+                    bucket.remove(chunk_id)
+
+    def stats(self):
+        return {
+            "canonical_chunks": len(self._signatures),
+            "chunks_with_duplicates": len(self._duplicates),
+            "threshold": self.threshold,
+        }
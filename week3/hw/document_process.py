@@ -1,11 +1,13 @@
 from config import get_es
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from embedding import local_embedding
+from es_functions import bump_index_generation
 import time
-import tiktoken
 
 def process_pdf(es_index, file_path):
+    # langchain只在这里用到, 导入较慢, 不在模块加载时导入
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     es = get_es()
     loader = PyMuPDFLoader(file_path) #如果报错则使用PyMuPDFLoader处理pdf文件
     pages = loader.load()
@@ -44,8 +46,12 @@ def process_pdf(es_index, file_path):
                         time.sleep(1)
 
             batch = []
+
+    # 更新索引版本号, 使检索缓存失效
+    bump_index_generation(es, es_index)
             
 def num_tokens_from_string(string):   
+    import tiktoken
     encoding = tiktoken.get_encoding('cl100k_base')
     num_tokens = len(encoding.encode(string))
     return num_tokens
@@ -1,19 +1,58 @@
-from config import EMBEDDING_URL
+from config import EMBEDDING_URL, QUERY_EMBEDDING_CACHE_SIZE, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH
+from config import HEDGE_MAX_EMBEDDING_BATCH, EMBEDDING_BATCH_TIMEOUT, EMBEDDING_REQUEST_TIMEOUT
+from cache import LRUCache, normalize_query
+from embedding_batcher import EmbeddingBatcher
+from hedging import hedged
 import requests
 import time
 import traceback
 
-def local_embedding(inputs):
-    """Get embeddings from the embedding service"""
-    
+_query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+def local_embedding(inputs, timeout=None):
+    """Get embeddings from the embedding service
+
+    查询等小批量请求做对冲, 入库时的大批量请求直接发送
+    timeout: HTTP请求超时(秒), 默认 EMBEDDING_REQUEST_TIMEOUT
+    """
+    if len(inputs) <= HEDGE_MAX_EMBEDDING_BATCH:
+        return hedged("embedding", _post_embedding, inputs, timeout)
+    return _post_embedding(inputs, timeout)
+
+def _post_embedding(inputs, timeout=None):
     headers = {"Content-Type": "application/json"}
     data = {"texts": inputs}
     
-    response = requests.post(EMBEDDING_URL, headers=headers, json=data)
+    if timeout is None:
+        timeout = EMBEDDING_REQUEST_TIMEOUT or None
+    response = requests.post(EMBEDDING_URL, headers=headers, json=data, timeout=timeout)
     
     result = response.json()
     return result['data']['text_vectors']
 
+# 并发查询的向量请求合并为批量调用, 窗口为0时每个问题单独调用
+_query_batcher = EmbeddingBatcher(local_embedding, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH,
+                                  EMBEDDING_BATCH_TIMEOUT or None) if EMBEDDING_BATCH_WINDOW_MS > 0 else None
+
+def embed_query(text, timeout=None):
+    """单条查询向量, 相同(归一化后)的问题直接复用缓存
+
+    timeout: 最多等待的秒数 (查询的剩余时间预算), 超时抛出异常
+    """
+    key = (EMBEDDING_URL, normalize_query(text))
+    vector = _query_embedding_cache.get(key)
+    if vector is None:
+        if _query_batcher is not None:
+            vector = _query_batcher.embed(text, timeout)
+        else:
+            vector = local_embedding([text], timeout)[0]
+        _query_embedding_cache.put(key, vector)
+    return vector
+
+def query_batcher_stats():
+    """查询向量微批处理的统计, 未启用时返回None"""
+    return _query_batcher.stats() if _query_batcher is not None else None
+
 def openai_embedding(inputs):
     pass
 
@@ -0,0 +1,142 @@
+"""
+查询向量的微批处理
+多个用户同时提问时, 每个问题单独调用一次 local_embedding([text]), 嵌入服务的GPU处理大量只有1条文本的小请求。
+EmbeddingBatcher 在后台线程中收集并发的单条请求: 第一条请求到达后最多再等待 window_ms 毫秒
+(或凑满 max_batch 条), 合并成一次批量调用, 再把向量分发回各个等待的调用方。
+上一批仍在嵌入服务中处理时, 新到达的请求继续排队, 下一批自然更大。
+批量调用有超时: 嵌入服务卡住时该批的调用方收到 TimeoutError, 后续批次不会一直排在它后面;
+调用方自己的等待超时后, 仍在排队的请求随之撤回。
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import numpy as np
+
+# 统计排队延迟时保留的最近请求数
+DELAY_SAMPLES = 10000
+# 执行批量调用的线程数: 超时的调用仍占用一个线程直到返回, 多留几个线程给后续批次
+CALL_WORKERS = 4
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, window_ms=5.0, max_batch=32, batch_timeout=None):
+        """embed_fn: 接收文本列表和 timeout 参数(秒)、返回同样顺序的向量列表, 如 local_embedding
+        batch_timeout: 单次批量调用的超时(秒), None 为不限; 批内所有调用方都设置了超时时, 不超过其中最晚的截止时间
+        """
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=CALL_WORKERS, thread_name_prefix="embedding-call")
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.batch_sizes = Counter()
+        self._delays_ms = deque(maxlen=DELAY_SAMPLES)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def embed(self, text, timeout=None):
+        """提交一条文本, 阻塞到所在批次返回; 批量调用失败时抛出同样的异常
+
+        timeout: 最多等待的秒数, 超时抛出 TimeoutError, 仍在排队的请求不再参与批量调用
+        """
+        self._ensure_started()
+        future = Future()
+        submitted = time.perf_counter()
+        self._queue.put((text, future, submitted, submitted + timeout if timeout is not None else None))
+        try:
+            return future.result(timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise
+
+    def _collect(self):
+        """取出一批请求: 阻塞等待第一条, 之后在窗口内继续收集, 凑满 max_batch 条立即发出"""
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _call_timeout(self, batch, now):
+        """本批调用的超时: 不超过 batch_timeout, 也不超过批内最晚的调用方截止时间 (之后没有人等待结果)"""
+        timeout = self.batch_timeout
+        expires = [expires for *_, expires in batch]
+        if all(expires is not None for expires in expires):
+            remaining = max(max(expires) - now, 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def _run(self):
+        while True:
+            # 调用方已超时撤回的请求不再嵌入
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            dispatched = time.perf_counter()
+            # 同一批中相同的文本只嵌入一次
+            texts = list(dict.fromkeys(text for text, *_ in batch))
+            with self._stats_lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self._delays_ms.extend((dispatched - submitted) * 1000 for _, _, submitted, _ in batch)
+            timeout = self._call_timeout(batch, dispatched)
+            try:
+                # 在单独的线程中调用, 嵌入服务卡住时本线程按超时放弃该批, 继续处理后续请求
+                vectors = self._executor.submit(self.embed_fn, texts, timeout=timeout).result(timeout)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} vectors, got {len(vectors)}")
+                by_text = dict(zip(texts, vectors))
+                for text, future, *_ in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                if isinstance(e, FuturesTimeoutError):
+                    e = TimeoutError(f"Embedding batch of {len(texts)} texts timed out after {timeout:.2f}s")
+                with self._stats_lock:
+                    self.errors += 1
+                    self.timeouts += isinstance(e, TimeoutError)
+                for _, future, *_ in batch:
+                    future.set_exception(e)
+
+    def stats(self):
+        """批大小分布 {批大小: 批次数} 和排队带来的额外延迟 (毫秒)"""
+        with self._stats_lock:
+            delays = np.asarray(self._delays_ms) if self._delays_ms else np.zeros(1)
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "queue_delay_ms": {
+                    "mean": float(delays.mean()),
+                    "p50": float(np.percentile(delays, 50)),
+                    "p95": float(np.percentile(delays, 95)),
+                    "max": float(delays.max()),
+                },
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+            }
@@ -1,7 +1,19 @@
-from config import get_es
+import re
+import uuid
+from config import get_es, VECTOR_INDEX_TYPE
+from page_index import delete_page_index
+from text_store import EXTERNAL_TEXT_FIELDS, drop_text_store
 
-def create_elastic_index(index_name):
+# 支持的向量索引布局, 内存占用依次降低:
+# hnsw: float32原始向量; int8_hnsw: 每维1字节; int4_hnsw: 每维半字节; bbq_hnsw: 每维1比特
+VECTOR_INDEX_TYPES = ("hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw")
+
+def create_elastic_index(index_name, vector_index_type=None, external_text=False):
+    """external_text: 正文等大字段仍建立倒排索引, 但不存入_source, 由本地 TextStore 保存"""
     es=get_es()
+    vector_index_type = vector_index_type or VECTOR_INDEX_TYPE
+    if vector_index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f'Unsupported vector index type: {vector_index_type}, choose from {VECTOR_INDEX_TYPES}')
     mappings = {
                 "properties": {
                     "text": {
@@ -11,40 +23,186 @@ def create_elastic_index(index_name):
                         "type": "dense_vector",
                         "dims": 1024,
                         "index": True,
-                        "similarity": "cosine"
+                        "similarity": "cosine",
+                        # 量化布局仍保留原始float向量, 可用于全精度重打分
+                        "index_options": {"type": vector_index_type}
                         },
-                    # metadata filtering
+                    # metadata filtering: 过滤字段使用keyword/integer, 可以在kNN和BM25打分之前过滤
                     "file_name": {
-                        "type": "text"
+                        "type": "keyword"
+                    },
+                    "content_type": {
+                        "type": "keyword"
+                    },
+                    "page_num": {
+                        "type": "integer"
+                    },
+                    "chunk_index": {
+                        "type": "integer"
                     },
                     "page": {
                         "type": "integer"
                     },
+                    # 两阶段检索: 第二阶段按页过滤
+                    "page_key": {
+                        "type": "keyword"
+                    },
                     "chapter": {
                         "type": "text"
                     },
                     "doc_type": {
-                        "type": "text"
+                        "type": "keyword"
                     },
                     "language": {
-                        "type": "text"
+                        "type": "keyword"
                     },
                     "file_id": {
                          "type": "long"
                     },  
+                    # 页上下文、表格原文、副本出处等只随_source返回, 不建立索引
+                    "metadata": {
+                        "type": "object",
+                        "dynamic": False,
+                        "properties": {
+                            "image_index": {"type": "integer"},
+                            "table_index": {"type": "integer"}
+                        }
+                    },
 
                     }
                 }
+    if external_text:
+        mappings["_source"] = {"excludes": EXTERNAL_TEXT_FIELDS}
     #创建elastic
     try:
         es.indices.create(index=index_name, mappings=mappings)
-        print('[Create Vector DB]' + index_name + ' created')
+        print('[Create Vector DB]' + index_name + ' created (' + vector_index_type +
+              (', external text' if external_text else '') + ')')
     except Exception as e:
         print(f'Create Vector DB Exception: {e}')
 
+_vector_index_type_cache = {}
+
+def get_vector_index_type(es, index_name):
+    """读取索引mapping中vector字段的布局, 旧索引没有index_options时视为hnsw"""
+    if index_name in _vector_index_type_cache:
+        return _vector_index_type_cache[index_name]
+    mapping = es.indices.get_mapping(index=index_name)
+    # index_name 可能是别名, 取第一个实际索引的mapping
+    properties = next(iter(mapping.values()))['mappings'].get('properties', {})
+    vector_field = properties.get('vector', {})
+    index_type = vector_field.get('index_options', {}).get('type', 'hnsw')
+    _vector_index_type_cache[index_name] = index_type
+    return index_type
+
+_external_text_cache = {}
+
+def is_external_text(es, index_name):
+    """索引是否为文本分离布局 (正文不在_source中, 需要从 TextStore 取回)"""
+    if index_name in _external_text_cache:
+        return _external_text_cache[index_name]
+    mapping = es.indices.get_mapping(index=index_name)
+    excludes = next(iter(mapping.values()))['mappings'].get('_source', {}).get('excludes', [])
+    _external_text_cache[index_name] = 'text' in excludes
+    return _external_text_cache[index_name]
+
+def get_index_generation(es, index_name):
+    """索引的数据版本号, 每次写入后都会变化, 用作检索缓存键的一部分"""
+    return _mapping_generation(es.indices.get_mapping(index=index_name))
+
+def _mapping_generation(mapping):
+    # 带上实际索引名: 别名切换到新版本后, 即使新版本尚未写入过版本号, 缓存也会失效
+    return '|'.join(sorted(f"{name}:{m['mappings'].get('_meta', {}).get('generation', '0')}"
+                           for name, m in mapping.items()))
+
+def bump_index_generation(es, index_name):
+    """写入完成后更新版本号, 使所有进程中基于旧数据的缓存失效
+
+    先刷新索引再更新版本号: 否则版本号变化后、刷新之前的查询会读到旧数据并按新版本号写入缓存
+    """
+    es.indices.refresh(index=index_name)
+    generation = uuid.uuid4().hex
+    es.indices.put_mapping(index=index_name, meta={'generation': generation})
+    return generation
+
+def resolve_index(es, index_name):
+    """别名解析为它指向的实际索引; 不是别名或指向多个索引时原样返回
+
+    页索引、TextStore和mapping缓存都以实际索引名为键, 别名切换后自动使用新版本的数据
+    """
+    return resolve_index_generation(es, index_name)[0]
+
+def resolve_index_generation(es, index_name):
+    """一次get_mapping同时返回 (实际索引名, 数据版本号), 检索时省去一次往返"""
+    mapping = es.indices.get_mapping(index=index_name)
+    targets = list(mapping.keys())
+    return (targets[0] if len(targets) == 1 else index_name), _mapping_generation(mapping)
+
+# 蓝绿重建: 别名 <alias> 指向 <alias>_v<N>, 新版本构建并检查通过后原子切换
+
+def versioned_index_name(alias, version):
+    return f'{alias}_v{version}'
+
+def list_index_versions(es, alias):
+    """返回别名的所有版本 [(版本号, 索引名)], 按版本号升序"""
+    pattern = re.compile(re.escape(alias) + r'_v(\d+)$')
+    indices = es.indices.get(index=f'{alias}_v*', allow_no_indices=True, expand_wildcards='open')
+    return sorted((int(m.group(1)), name) for name in indices if (m := pattern.match(name)))
+
+def get_alias_targets(es, alias):
+    """别名当前指向的实际索引, 别名不存在时为空列表"""
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return sorted(es.indices.get_alias(name=alias).keys())
+
+def next_index_version(es, alias):
+    versions = list_index_versions(es, alias)
+    return versioned_index_name(alias, versions[-1][0] + 1 if versions else 1)
+
+def swap_alias(es, alias, new_index):
+    """一次update_aliases请求把别名从旧版本移到新版本, 查询不会看到中间状态
+
+    与别名同名的旧实际索引 (没有使用别名时建立的索引) 在同一请求中删除, 由别名接替这个名字
+    """
+    actions = [{'remove': {'index': old, 'alias': alias}}
+               for old in get_alias_targets(es, alias) if old != new_index]
+    legacy = not es.indices.exists_alias(name=alias) and es.indices.exists(index=alias)
+    if legacy:
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': new_index, 'alias': alias, 'is_write_index': True}})
+    es.indices.update_aliases(actions=actions)
+    _vector_index_type_cache.pop(alias, None)
+    _external_text_cache.pop(alias, None)
+    if legacy:
+        drop_text_store(alias)
+        delete_page_index(es, alias)
+    print(f'[Swap Alias]{alias} -> {new_index}')
+    return actions
+
+def gc_index_versions(es, alias, keep=1):
+    """删除别名未指向的旧版本, 保留最近的 keep 个用于回滚; 返回被删除的索引"""
+    current = set(get_alias_targets(es, alias))
+    previous = [name for _, name in list_index_versions(es, alias) if name not in current]
+    stale = previous[:-keep] if keep > 0 else previous
+    for name in stale:
+        delete_elastic_index(name)
+    return stale
+
 def delete_elastic_index(index_name):
     es=get_es()
+    if es.indices.exists_alias(name=index_name):
+        # 别名不能直接删除索引, 删除它的所有版本
+        for _, name in list_index_versions(es, index_name):
+            delete_elastic_index(name)
+        for name in get_alias_targets(es, index_name):
+            delete_elastic_index(name)
+        return
     es.indices.delete(index=index_name)
+    _vector_index_type_cache.pop(index_name, None)
+    _external_text_cache.pop(index_name, None)
+    drop_text_store(index_name)
+    # 伴生的页索引一起删除
+    delete_page_index(es, index_name)
     print('[Delete Vector DB]' + index_name + ' deleted')
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""
+对冲请求 (hedged requests)
+嵌入、rerank和LLM服务的尾延迟主要来自偶发的慢响应, 而不是平均负载。
+请求发出后如果超过该服务近期延迟的某个分位数 (默认p95) 仍未返回, 再发一个相同的请求, 先返回的结果生效,
+另一个被取消: 尚未开始的直接取消, 已经在途的HTTP请求无法从线程中中断, 其结果被丢弃。
+额外请求受预算限制: 每个正常请求积累 budget_ratio 个令牌, 对冲一次消耗一个, 最多积累 burst 个,
+服务整体变慢时对冲不会把负载放大一倍。
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from config import HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_BUDGET_RATIO, HEDGE_MIN_SAMPLES
+
+# 计算延迟分位数时保留的最近请求数
+LATENCY_WINDOW = 1000
+# 对冲预算最多积累的令牌数
+HEDGE_BURST = 5
+
+
+class LatencyTracker:
+    """最近 window 个请求的延迟, 样本不足 min_samples 时不给出对冲延迟"""
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return float(np.percentile(np.asarray(self._latencies), pct))
+
+
+class HedgeBudget:
+    """令牌桶: 每个请求增加 ratio 个令牌, 每次对冲消耗1个"""
+
+    def __init__(self, ratio=HEDGE_BUDGET_RATIO, burst=HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    def __init__(self, name, percentile=HEDGE_PERCENTILE, budget_ratio=HEDGE_BUDGET_RATIO,
+                 min_samples=HEDGE_MIN_SAMPLES, max_workers=64, enabled=HEDGE_ENABLED):
+        self.name = name
+        self.percentile = percentile
+        self.enabled = enabled
+        self.tracker = LatencyTracker(min_samples=min_samples)
+        self.budget = HedgeBudget(budget_ratio)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def _timed(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # 每个请求 (包括对冲请求和失败、超时的请求) 的实际耗时都计入延迟分布,
+            # 只记录成功请求会让分位数偏低, 服务频繁超时时对冲反而来得更早
+            self.tracker.record(time.perf_counter() - start)
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def call(self, fn, *args, **kwargs):
+        """执行 fn(*args, **kwargs); 超过对冲延迟未返回时再发一次, 返回先成功的结果"""
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        self._count(calls=1)
+        self.budget.deposit()
+        primary = self._pool.submit(self._timed, fn, args, kwargs)
+        delay = self.tracker.percentile(self.percentile)
+        if delay is None or wait([primary], timeout=delay).done:
+            return primary.result()
+        if not self.budget.try_spend():
+            self._count(budget_denied=1)
+            return primary.result()
+
+        self._count(hedged=1)
+        hedge = self._pool.submit(self._timed, fn, args, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        self._count(hedge_wins=1)
+                    return future.result()
+                error = future.exception()
+        # 两个请求都失败时抛出最后一个异常
+        raise error
+
+    def stats(self):
+        delay = self.tracker.percentile(self.percentile)
+        with self._stats_lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "extra_load": self.hedged / self.calls if self.calls else 0.0,
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+            }
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name):
+    """每个下游服务 (embedding / rerank / llm:<模型>) 一个对冲器, 各自统计延迟分布和预算"""
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = Hedger(name)
+        return _hedgers[name]
+
+
+def hedged(name, fn, *args, **kwargs):
+    return get_hedger(name).call(fn, *args, **kwargs)
+
+
+def hedging_stats():
+    with _hedgers_lock:
+        return {name: hedger.stats() for name, hedger in _hedgers.items()}
@@ -0,0 +1,120 @@
+"""
+装饰性图片过滤
+PDF中的背景图、渐变、空白扫描页和页面边框照片在送入VLM摘要之前用CPU打分, 低于阈值的直接丢弃,
+不产生任何远程调用。图片先缩小到最长边 ANALYSIS_SIZE 像素再计算以下特征:
+- entropy: 灰度直方图的香农熵 (比特), 纯色图接近0
+- color_std: RGB三个通道标准差的平均值, 反映颜色变化
+- edge_density: 去掉四周 BORDER_MARGIN 边距后, 相邻像素灰度差超过 EDGE_THRESHOLD 的像素比例;
+  渐变、纯色背景和只有页面边框的图接近0, 图表、文字和照片较高
+- uniform_fraction: 与出现最多的灰度相差不超过 UNIFORM_TOLERANCE 的像素比例, 空白扫描页接近1
+"""
+
+import os
+import threading
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from config import IMAGE_FILTER_THRESHOLD
+
+ANALYSIS_SIZE = 512
+EDGE_THRESHOLD = 24
+BORDER_MARGIN = 0.08
+UNIFORM_TOLERANCE = 8
+# 超过该比例的像素都接近同一灰度时直接视为空白图
+BLANK_UNIFORM_FRACTION = 0.98
+# 各特征归一化到 [0, 1] 的上限和加权; 边缘密度最能区分有信息的图片和装饰图
+FEATURE_SCALES = {"entropy": 5.0, "color_std": 40.0, "edge_density": 0.02}
+FEATURE_WEIGHTS = {"entropy": 0.15, "color_std": 0.1, "edge_density": 0.6, "non_uniform": 0.15}
+# 统计中保留的最近被丢弃的图片数
+RECENT_DROPPED = 50
+
+
+def image_features(image):
+    """image: 图片路径或PIL.Image, 返回各项特征"""
+    if not isinstance(image, Image.Image):
+        with Image.open(image) as opened:
+            opened.load()
+            image = opened.copy()
+    image = image.convert("RGB")
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    rgb = np.asarray(image, dtype=np.float32)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    p = histogram[histogram > 0] / histogram.sum()
+    entropy = float(-(p * np.log2(p)).sum()) + 0.0
+
+    height, width = gray.shape
+    top, left = int(height * BORDER_MARGIN), int(width * BORDER_MARGIN)
+    inner = gray[top:height - top, left:width - left]
+    dx = np.abs(np.diff(inner, axis=1))[:-1, :]
+    dy = np.abs(np.diff(inner, axis=0))[:, :-1]
+    edges = np.maximum(dx, dy) > EDGE_THRESHOLD if dx.size and dy.size else np.zeros(1, dtype=bool)
+
+    mode = int(np.argmax(histogram))
+    return {
+        "entropy": entropy,
+        "color_std": float(rgb.reshape(-1, 3).std(axis=0).mean()),
+        "edge_density": float(edges.mean()),
+        "uniform_fraction": float((np.abs(gray - mode) <= UNIFORM_TOLERANCE).mean()),
+    }
+
+
+def image_score(features):
+    """0-1之间的信息量分数, 越高越可能是有内容的图片"""
+    if features["uniform_fraction"] >= BLANK_UNIFORM_FRACTION:
+        return 0.0
+    normalized = {name: min(features[name] / scale, 1.0) for name, scale in FEATURE_SCALES.items()}
+    normalized["non_uniform"] = 1.0 - features["uniform_fraction"]
+    return float(sum(FEATURE_WEIGHTS[name] * value for name, value in normalized.items()))
+
+
+class ImageFilterStats:
+    def __init__(self):
+        self.checked = 0
+        self.dropped = 0
+        self.recent = deque(maxlen=RECENT_DROPPED)
+        self._lock = threading.Lock()
+
+    def record(self, path, score, kept):
+        with self._lock:
+            self.checked += 1
+            if not kept:
+                self.dropped += 1
+                self.recent.appendleft({"image": os.path.basename(str(path)), "score": round(score, 3)})
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "dropped": self.dropped,
+                "kept": self.checked - self.dropped,
+                "drop_rate": self.dropped / self.checked if self.checked else 0.0,
+                "recent_dropped": list(self.recent),
+            }
+
+
+_stats = ImageFilterStats()
+
+
+def filter_meaningful_images(image_path, threshold=None):
+    """extract_images_from_pdf 的过滤钩子: 返回False的图片不送入VLM
+
+    threshold: 分数阈值, 默认读取 IMAGE_FILTER_THRESHOLD, <=0 表示保留全部图片; 图片无法读取时保留
+    """
+    threshold = IMAGE_FILTER_THRESHOLD if threshold is None else threshold
+    if threshold <= 0:
+        return True
+    try:
+        score = image_score(image_features(image_path))
+    except Exception:
+        return True
+    kept = score >= threshold
+    _stats.record(image_path, score, kept)
+    return kept
+
+
+def image_filter_stats():
+    return _stats.snapshot()
@@ -1,14 +1,19 @@
-from openai import OpenAI
 import logging
 import time
 import traceback
 import base64
 import mimetypes
 import os
-import fitz
 import json
-from config import IMAGE_MODEL_URL, OPENAI_API_KEY
+from config import IMAGE_MODEL_URL, OPENAI_API_KEY, TABLE_PREFILTER
+from artifact_cache import file_sha256
+from page_parser import parse_pdf_pages
+# 内置的装饰性图片过滤; 可以替换为自定义函数: image_table.filter_meaningful_images = my_filter
+from image_filter import filter_meaningful_images
 
+# 提取缓存的版本号: 修改下面的prompt或模型时同步修改, 旧的缓存结果即失效
+IMAGE_PROMPT_VERSION = "internvl-internlm2:v1|gpt-5:v1"
+TABLE_PROMPT_VERSION = "gpt-5:v1"
 
 
 def _truncate(text: str, max_len: int = 1500) -> str:
@@ -50,6 +55,7 @@ def context_augmentation(page_context,image_description):
 {page_context}
 ```
 '''
+    from openai import OpenAI
     client = OpenAI(api_key=OPENAI_API_KEY)
     response = client.chat.completions.create(
         model="gpt-5",
@@ -71,6 +77,7 @@ def summarize_image(image_path, base_url = IMAGE_MODEL_URL):
             # print("prompt:\n",flush=True)
             # print(text+'\n',flush=True)
             # print(image_link)
+            from openai import OpenAI
             client = OpenAI(api_key=OPENAI_API_KEY or 'YOUR_API_KEY', base_url=base_url)
 
             # Read local image and convert to Base64 data URL
@@ -103,6 +110,7 @@ def summarize_image(image_path, base_url = IMAGE_MODEL_URL):
 
 def table_context_augmentation(page_context: str, table_md: str):
     """Augment the table description using page context to clarify meaning and usage."""
+    from openai import OpenAI
     client = OpenAI(api_key=OPENAI_API_KEY)
     prompt = f"""
 目标：请根据输入的表格和上下文信息以及来源文件信息，生成针对于该表格的一段简短的语言描述
@@ -134,18 +142,40 @@ def table_context_augmentation(page_context: str, table_md: str):
     )
     return response.choices[0].message.content
 
-def extract_tables_from_pdf(pdf_path: str):
-    pdf_document = fitz.open(pdf_path)
+def cached_parse_options(cache, file_hash):
+    """已缓存的表格页和图片xref, 解析阶段直接跳过find_tables和图片导出"""
+    if cache is None:
+        return {}
+    return {
+        "skip_table_pages": {page for page, _ in cache.cached_keys(file_hash, "table_count", TABLE_PROMPT_VERSION)},
+        "cached_xrefs": {int(xref) for _, xref in cache.cached_keys(file_hash, "image", IMAGE_PROMPT_VERSION)},
+    }
+
+def extract_tables_from_pdf(pdf_path: str, cache=None, pages=None, file_hash=None):
+    """cache: 可选的 ArtifactCache, 命中时跳过find_tables和LLM调用
+    pages: parse_pdf_pages 的解析结果, 未提供时在当前进程解析
+    """
+    if cache is not None and file_hash is None:
+        file_hash = file_sha256(pdf_path)
+    if pages is None:
+        pages = parse_pdf_pages(pdf_path, images=False, table_prefilter=TABLE_PREFILTER,
+                                **cached_parse_options(cache, file_hash))
     results = []
-    for page_num in range(pdf_document.page_count):
+    for page in pages:
+        page_num = page["page_num"]
         try:
-            page = pdf_document.load_page(page_num)
-            page_text = page.get_text("text")
-            page_tables = page.find_tables()
+            if cache is not None:
+                cached_tables = _cached_page_tables(cache, file_hash, page_num)
+                if cached_tables is not None:
+                    results.extend(cached_tables)
+                    continue
 
-            for table_index, table in enumerate(page_tables):
+            page_text = page["text"]
+            page_tables = page["tables"] or []
+            page_complete = True
+
+            for table_index, md in enumerate(page_tables):
                 try:
-                    md = table.to_markdown()
                     augmented = table_context_augmentation(page_text, md)
                     item = {
                         "page_num": page_num,
@@ -155,6 +185,8 @@ def extract_tables_from_pdf(pdf_path: str):
                         "context_augmented_table": augmented
                     }
                     results.append(item)
+                    if cache is not None:
+                        cache.put(file_hash, page_num, "table", table_index + 1, TABLE_PROMPT_VERSION, item)
 
                     # Markdown-styled pretty print for readability
                     md_output = (
@@ -169,109 +201,96 @@ def extract_tables_from_pdf(pdf_path: str):
                     )
                     print(md_output)
                 except Exception:
-                    pass
+                    page_complete = False
+
+            # 整页的表格都处理成功后才记录表格数量, 之后可以完全跳过这一页;
+            # 被预筛跳过的页不记录, 关闭预筛后仍会重新检测
+            if cache is not None and page_complete and page["tables"] is not None \
+                    and not page.get("table_prefiltered"):
+                cache.put(file_hash, page_num, "table_count", "all", TABLE_PROMPT_VERSION, len(page_tables))
         except Exception:
             pass
 
-    pdf_document.close()
     return results
-def extract_images_from_pdf(pdf_path):
-    pdf_document = fitz.open(pdf_path)
-    logging.info(f"Opened PDF document: {pdf_path}")
 
-    image_dir = f'pdf_images/'
-    os.makedirs(image_dir, exist_ok=True)
-    logging.info(f"Image directory created: {image_dir}")
-    
-    unique_xrefs = set()
-    for p in range(pdf_document.page_count):
-        page_images = pdf_document.get_page_images(p)
-        for item in page_images:
-            xref = item[0]
-            unique_xrefs.add(xref)
-    total_images = len(unique_xrefs)
-    
-    if total_images == 0:
-        pdf_document.close()
-        return []
+def _cached_page_tables(cache, file_hash, page_num):
+    """返回该页全部表格的缓存结果, 任何一个缺失时返回None"""
+    table_count = cache.get(file_hash, page_num, "table_count", "all", TABLE_PROMPT_VERSION)
+    if table_count is None:
+        return None
+    items = []
+    for table_index in range(1, table_count + 1):
+        item = cache.get(file_hash, page_num, "table", table_index, TABLE_PROMPT_VERSION)
+        if item is None:
+            return None
+        items.append(item)
+    return items
+
+def extract_images_from_pdf(pdf_path, cache=None, pages=None, file_hash=None):
+    """cache: 可选的 ArtifactCache, 按图片xref缓存VLM摘要和上下文增强结果
+    pages: parse_pdf_pages 的解析结果, 未提供时在当前进程解析
+    """
+    if cache is not None and file_hash is None:
+        file_hash = file_sha256(pdf_path)
+    if pages is None:
+        pages = parse_pdf_pages(pdf_path, tables=False, **cached_parse_options(cache, file_hash))
+    logging.info(f"Parsed PDF document: {pdf_path}")
 
     results = []
-    processed_xrefs = set()
-
-    for page_num in range(pdf_document.page_count):
-        try:
-            page = pdf_document.load_page(page_num)
-            page_width = page.rect.width
-
-            # Extract page text, 作为图片上下文
-            page_text = page.get_text("dict", sort=True)
-            page_context = ""
-            for block in page_text['blocks']:
-                if 'lines' in block:
-                    for line in block['lines']:
-                        for span in line['spans']:
-                            page_context += span['text'] + " "
-            
-            page_images = pdf_document.get_page_images(page_num)
-            for img_index, item in enumerate(page_images):
-                try:
-                    xref = item[0]
-                    if xref in processed_xrefs:
-                        continue
-                    processed_xrefs.add(xref)
-
-                    image_width = item[2]
-                    image_height = item[3]
-                    
-                    # Skip small images
-                    if image_width < page_width / 3 or image_width < 200 or image_height < 100:
-                        continue
-                    
-                    pix = fitz.Pixmap(pdf_document, xref)
-                    if pix.colorspace and pix.colorspace.name == 'DeviceCMYK':
-                        pix = fitz.Pixmap(fitz.csRGB, pix)
-
-                    image_save_path = f'{image_dir}/img_{page_num + 1}_{img_index + 1}.png'
-                    pix.save(image_save_path)
-                    del pix
-
-                    # Optional filter if available
-                    do_filter = globals().get("filter_meaningful_images")
-                    if callable(do_filter):
-                        if not do_filter(image_save_path):
-                            os.remove(image_save_path)
-                            continue
-
-                    # Summarize single image
-                    summary = summarize_image(image_save_path)
-                    context_augmented_summary = context_augmentation(page_context,summary)
-                    results.append({
-                        "page_num": page_num,
-                        "image_index": img_index + 1,
-                        "summary": summary,
-                        "image_path": image_save_path,
-                        "page_context": page_context.strip(),
-                        "context_augmented_summary": context_augmented_summary
-                    })
-
-                    # Pretty print the latest result for readability
-                    print("\n" + "=" * 60)
-                    print(json.dumps(results[-1], ensure_ascii=False, indent=2))
-                    # Remove local copy after summarization
-                    try:
+    filtered = 0
+    for page in pages:
+        page_num = page["page_num"]
+        page_context = page.get("image_context", "")
+        for image in page["images"]:
+            img_index = image["image_index"] - 1
+            try:
+                image_save_path = image["path"]
+                if image_save_path is None:
+                    # 解析阶段已知有缓存的图片没有导出文件
+                    cached = cache.get(file_hash, page_num, "image", image["xref"], IMAGE_PROMPT_VERSION) \
+                        if cache is not None else None
+                    if cached is not None:
+                        results.append(cached)
+                    continue
+
+                # Optional filter if available
+                do_filter = globals().get("filter_meaningful_images")
+                if callable(do_filter):
+                    if not do_filter(image_save_path):
                         os.remove(image_save_path)
-                    except Exception:
-                        pass
+                        filtered += 1
+                        continue
 
-                except Exception as e:
-                    logging.error(f"Error processing image {img_index + 1} on page {page_num + 1}: {e}")
-                    logging.error(traceback.format_exc())
+                # Summarize single image
+                summary = summarize_image(image_save_path)
+                context_augmented_summary = context_augmentation(page_context,summary)
+                results.append({
+                    "page_num": page_num,
+                    "image_index": img_index + 1,
+                    "summary": summary,
+                    "image_path": image_save_path,
+                    "page_context": page_context.strip(),
+                    "context_augmented_summary": context_augmented_summary
+                })
+                # VLM重试全部失败时summary为None, 不缓存
+                if cache is not None and summary is not None:
+                    cache.put(file_hash, page_num, "image", image["xref"], IMAGE_PROMPT_VERSION, results[-1])
+
+                # Pretty print the latest result for readability
+                print("\n" + "=" * 60)
+                print(json.dumps(results[-1], ensure_ascii=False, indent=2))
+                # Remove local copy after summarization
+                try:
+                    os.remove(image_save_path)
+                except Exception:
+                    pass
 
-        except Exception as e:
-            logging.error(f"Error processing page {page_num + 1}: {e}")
-            logging.error(traceback.format_exc())
+            except Exception as e:
+                logging.error(f"Error processing image {img_index + 1} on page {page_num + 1}: {e}")
+                logging.error(traceback.format_exc())
 
-    pdf_document.close()
+    if filtered:
+        print(f"  🖼️ 过滤装饰性图片 {filtered} 张 (未调用VLM)")
     return results
 
 if __name__ == "__main__":
@@ -0,0 +1,408 @@
+"""
+本地嵌入式检索后端, 无需Elasticsearch集群
+- 向量: 追加写入的float32/int8矩阵文件, 通过np.memmap按需加载, 打开索引只读取manifest
+- 向量检索: NumPy精确检索, 数据量大时自动切换为IVF近似检索
+- 关键词检索: 基于jieba分词的进程内BM25
+- 融合: 与elastic_search相同的RRF, 返回相同结构的结果
+"""
+
+import copy
+import json
+import math
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from cache import LRUCache, normalize_query
+from chunk_store import ChunkBatch
+from config import SEARCH_RESULT_CACHE_SIZE
+from embedding import embed_query
+from retrieve_documents import get_keyword, hybrid_search_rrf, match_filters, filters_key
+
+# 向量数超过该值时使用IVF近似检索
+IVF_MIN_VECTORS = 20000
+# 向量数增长到上次训练时的该倍数后, 下一次写入时重新训练IVF (簇数随向量数增长)
+IVF_RETRAIN_GROWTH = 2
+# 分块计算相似度, 避免一次性把memmap全部读入内存
+_SCORE_BLOCK = 65536
+
+
+def _kmeans(data, nlist, iters=10, seed=0):
+    """球面k-means (向量已归一化, 用内积做距离)"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=nlist, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = data[assign == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) + 1e-12)
+    return centroids
+
+
+class LocalVectorIndex:
+    """目录结构:
+        manifest.json   维度、存储类型、向量数量、IVF状态
+        vectors.bin     行优先的float32或int8向量 (已归一化)
+        scales.f32      int8存储时每个向量的缩放系数
+        docs.jsonl      每行一个文档, 包含文本、元数据和BM25分词结果
+        ivf_centroids.npy / ivf_assign.i32  IVF聚类中心和每个向量所属的簇
+    """
+
+    def __init__(self, index_dir, dtype="float32", nprobe=8):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported local vector dtype: {dtype}")
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        os.makedirs(index_dir, exist_ok=True)
+
+        manifest_path = self._path("manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"dims": None, "dtype": dtype, "count": 0, "docs_bytes": 0,
+                             "generation": "0", "ivf_nlist": 0, "ivf_trained_count": 0}
+        self.dtype = self.manifest["dtype"]
+
+        self._vectors = None
+        self._scales = None
+        self._ivf = None           # (聚类中心, 每个向量所属的簇), 一起替换, 检索时不会拿到不匹配的一对
+        self._docs = None
+        self._alive = None
+        self._bm25 = None
+        # 写入和IVF训练互斥; 检索不加锁, 只读取替换后的 memmap / _ivf
+        self._write_lock = threading.RLock()
+        self._open_vectors()
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _write_manifest(self):
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self._path("manifest.json"))
+
+    def _open_vectors(self):
+        count, dims = self.manifest["count"], self.manifest["dims"]
+        if not count:
+            return
+        self._vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r", shape=(count, dims))
+        if self.dtype == "int8":
+            self._scales = np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r", shape=(count,))
+        if self.manifest["ivf_nlist"]:
+            self._ivf = (np.load(self._path("ivf_centroids.npy")),
+                         np.memmap(self._path("ivf_assign.i32"), dtype=np.int32, mode="r", shape=(count,)))
+
+    def count(self):
+        return self.manifest["count"]
+
+    def generation(self):
+        """数据版本号, 每次追加后变化"""
+        return self.manifest.get("generation", "0")
+
+    def _truncate_uncommitted(self):
+        """manifest是提交点: 截掉上次追加中断后残留在各文件尾部的数据"""
+        count, dims = self.manifest["count"], self.manifest["dims"] or 0
+        sizes = {
+            "vectors.bin": count * dims * np.dtype(self.dtype).itemsize,
+            "scales.f32": count * 4,
+            "ivf_assign.i32": count * 4,
+            "docs.jsonl": self.manifest["docs_bytes"],
+        }
+        for name, size in sizes.items():
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+
+    def add(self, chunks):
+        """增量追加已向量化的块 (ChunkBatch 或带vector字段的dict列表), 与step5写入ES的字段一致
+
+        向量数超过 IVF_MIN_VECTORS 后在写入时训练IVF, 之后向量数每增长到训练时的 IVF_RETRAIN_GROWTH 倍重新训练
+        """
+        if not len(chunks):
+            return 0
+        with self._write_lock:
+            added = self._append(chunks)
+            count, trained = self.count(), self.manifest.get("ivf_trained_count", 0)
+            if count >= IVF_MIN_VECTORS and (not self.manifest["ivf_nlist"]
+                                             or count >= trained * IVF_RETRAIN_GROWTH):
+                self.build_ivf()
+        return added
+
+    def _append(self, chunks):
+        batch = ChunkBatch.from_dicts(chunks)
+        matrix = batch.vectors / (np.linalg.norm(batch.vectors, axis=1, keepdims=True) + 1e-12)
+        if self.manifest["dims"] is None:
+            self.manifest["dims"] = matrix.shape[1]
+        elif matrix.shape[1] != self.manifest["dims"]:
+            raise ValueError(f"Vector dims mismatch: {matrix.shape[1]} != {self.manifest['dims']}")
+        self._truncate_uncommitted()
+
+        with open(self._path("vectors.bin"), "ab") as f:
+            if self.dtype == "int8":
+                scales = np.abs(matrix).max(axis=1) / 127.0 + 1e-12
+                f.write(np.round(matrix / scales[:, None]).astype(np.int8).tobytes())
+                with open(self._path("scales.f32"), "ab") as sf:
+                    sf.write(scales.astype(np.float32).tobytes())
+            else:
+                f.write(matrix.tobytes())
+
+        if self.manifest["ivf_nlist"]:
+            with open(self._path("ivf_assign.i32"), "ab") as f:
+                f.write(np.argmax(matrix @ self._ivf[0].T, axis=1).astype(np.int32).tobytes())
+
+        with open(self._path("docs.jsonl"), "ab") as f:
+            for i, chunk_id in enumerate(batch.ids):
+                doc = {"id": chunk_id, **batch.source(i), "tokens": get_keyword(batch.contents[i]) if batch.contents[i] else []}
+                f.write((json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8"))
+            docs_bytes = f.tell()
+
+        self.manifest["count"] += len(batch)
+        self.manifest["docs_bytes"] = docs_bytes
+        self.manifest["generation"] = uuid.uuid4().hex
+        self._write_manifest()
+        self._open_vectors()
+        # 文档和BM25统计在下次检索时重新加载
+        self._docs = None
+        self._bm25 = None
+        return len(batch)
+
+    def delete(self, ids):
+        """按id删除文档: 追加带删除标记的零向量行, 加载时覆盖该id之前的所有行"""
+        if not self.count():
+            return 0
+        self._load_docs()
+        alive_ids = {self._docs[row]["id"] for row in np.flatnonzero(self._alive)}
+        ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in alive_ids]
+        if not ids:
+            return 0
+        tombstones = [{"id": doc_id, "content": "", "metadata": {"deleted": True}} for doc_id in ids]
+        return self.add(ChunkBatch(tombstones, np.zeros((len(ids), self.manifest["dims"]), dtype=np.float32)))
+
+    def update_metadata(self, updates):
+        """按id合并更新文档的metadata (对应ES的部分更新), 以追加新行的方式写入, 旧行在加载时被覆盖"""
+        return self.update_fields({doc_id: {"metadata": metadata} for doc_id, metadata in (updates or {}).items()})
+
+    def update_fields(self, updates):
+        """按id更新顶层字段 (file_name / page_num 等), metadata 按键合并, 写入方式同 update_metadata"""
+        if not updates or not self.count():
+            return 0
+        self._load_docs()
+        latest = {self._docs[row]["id"]: int(row) for row in np.flatnonzero(self._alive)}
+        chunks = []
+        for doc_id, fields in updates.items():
+            row = latest.get(doc_id)
+            if row is None:
+                continue
+            doc = self._docs[row]
+            chunks.append({
+                "id": doc_id,
+                "content": doc["text"],
+                "file_name": fields.get("file_name", doc.get("file_name")),
+                "content_type": doc.get("content_type"),
+                "page_num": fields.get("page_num", doc.get("page_num")),
+                "chunk_index": doc.get("chunk_index"),
+                "metadata": {**(doc.get("metadata") or {}), **fields.get("metadata", {})},
+                "vector": self._dequantize(np.array([row]))[0],
+            })
+        return self.add(chunks)
+
+    def build_ivf(self, nlist=None, sample_size=50000):
+        """训练IVF聚类中心并为全部向量分配簇, 之后的追加会自动分配到最近的簇
+
+        先写临时文件再替换, 正在检索的线程继续使用已打开的旧聚类中心和分配
+        """
+        with self._write_lock:
+            count = self.count()
+            if not count:
+                return
+            nlist = nlist or max(1, int(math.sqrt(count)))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+            nlist = min(nlist, len(sample_rows))
+            centroids = _kmeans(self._dequantize(sample_rows), nlist)
+            np.save(self._path("ivf_centroids.tmp.npy"), centroids)
+
+            with open(self._path("ivf_assign.i32.tmp"), "wb") as f:
+                for start in range(0, count, _SCORE_BLOCK):
+                    rows = np.arange(start, min(start + _SCORE_BLOCK, count))
+                    f.write(np.argmax(self._dequantize(rows) @ centroids.T, axis=1).astype(np.int32).tobytes())
+            os.replace(self._path("ivf_centroids.tmp.npy"), self._path("ivf_centroids.npy"))
+            os.replace(self._path("ivf_assign.i32.tmp"), self._path("ivf_assign.i32"))
+
+            self.manifest["ivf_nlist"] = nlist
+            self.manifest["ivf_trained_count"] = count
+            self._write_manifest()
+            self._open_vectors()
+
+    # ------------------------------------------------------------------
+    # 检索
+    # ------------------------------------------------------------------
+
+    def _dequantize(self, rows):
+        block = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= self._scales[rows][:, None]
+        return block
+
+    def _load_docs(self):
+        if self._docs is not None:
+            return
+        self._docs = []
+        self._masks = {}  # 过滤条件 -> 满足条件的行, 文档重新加载时失效
+        latest_row = {}
+        with open(self._path("docs.jsonl"), encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                if row >= self.count():
+                    break  # 追加过程中被中断的尾部数据
+                doc = json.loads(line)
+                self._docs.append(doc)
+                latest_row[doc["id"]] = row
+        # 同一个id被重复写入时与ES一致, 只保留最后一次; 最后一次是删除标记时该id已被删除
+        self._alive = np.zeros(len(self._docs), dtype=bool)
+        self._alive[[row for row in latest_row.values()
+                     if not (self._docs[row].get("metadata") or {}).get("deleted")]] = True
+
+    def _build_bm25(self):
+        self._load_docs()
+        postings = defaultdict(list)
+        doc_lens = np.zeros(len(self._docs), dtype=np.float32)
+        for row, doc in enumerate(self._docs):
+            if not self._alive[row]:
+                continue
+            tf = Counter(doc["tokens"])
+            doc_lens[row] = len(doc["tokens"])
+            for token, freq in tf.items():
+                postings[token].append((row, freq))
+        alive_count = max(int(self._alive.sum()), 1)
+        self._bm25 = {
+            "postings": postings,
+            "doc_lens": doc_lens,
+            "avg_len": float(doc_lens[self._alive].mean()) if self._alive.any() else 1.0,
+            "n": alive_count,
+        }
+
+    def _filter_mask(self, filters):
+        """有效且满足过滤条件的行"""
+        self._load_docs()
+        if not filters:
+            return self._alive
+        key = filters_key(filters)
+        if key not in self._masks:
+            mask = self._alive.copy()
+            for row in np.flatnonzero(mask):
+                mask[row] = match_filters(self._docs[row], filters)
+            self._masks[key] = mask
+        return self._masks[key]
+
+    def keyword_search(self, text, size=10, k1=1.5, b=0.75, filters=None):
+        if self._bm25 is None:
+            self._build_bm25()
+        bm25 = self._bm25
+        mask = self._filter_mask(filters) if filters else None
+        scores = defaultdict(float)
+        for token in set(get_keyword(text)):
+            plist = bm25["postings"].get(token)
+            if not plist:
+                continue
+            idf = math.log(1 + (bm25["n"] - len(plist) + 0.5) / (len(plist) + 0.5))
+            for row, freq in plist:
+                if mask is not None and not mask[row]:
+                    continue
+                norm = k1 * (1 - b + b * bm25["doc_lens"][row] / bm25["avg_len"])
+                scores[row] += idf * freq * (k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:size]
+        return [self._hit(row, idx) for idx, (row, _) in enumerate(ranked)]
+
+    def vector_search(self, query_vector, size=10, exact=None, filters=None):
+        """exact=None 时按数据量自动选择精确检索或IVF (IVF在写入时训练, 尚未训练时精确检索);
+        filters 在打分之前过滤
+        """
+        if not self.count():
+            return []
+        self._load_docs()
+        # 复制一份再归一化, 不修改调用方的查询向量 (可能来自查询向量缓存)
+        q = np.array(query_vector, dtype=np.float32)
+        q /= np.linalg.norm(q) + 1e-12
+
+        if exact is False and self._ivf is None:
+            self.build_ivf()
+        ivf = self._ivf
+        if exact is None:
+            exact = self.count() < IVF_MIN_VECTORS or ivf is None
+
+        if exact:
+            rows = np.arange(self.count())
+        else:
+            centroids, assign = ivf
+            probe = np.argsort(-(centroids @ q))[:self.nprobe]
+            rows = np.flatnonzero(np.isin(assign, probe))
+
+        rows = rows[self._filter_mask(filters)[rows]]
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SCORE_BLOCK):
+            block_rows = rows[start:start + _SCORE_BLOCK]
+            scores[start:start + len(block_rows)] = self._dequantize(block_rows) @ q
+
+        top = np.argsort(-scores)[:size]
+        return [self._hit(int(rows[i]), idx) for idx, i in enumerate(top)]
+
+    def iter_docs(self):
+        """按写入顺序产出有效文档 (id, float32向量, 与ES _source相同结构的字段)"""
+        if not self.count():
+            return
+        self._load_docs()
+        for row in np.flatnonzero(self._alive):
+            doc = self._docs[row]
+            source = {k: v for k, v in doc.items() if k not in ("id", "tokens")}
+            yield doc["id"], self._dequantize(np.array([row]))[0], source
+
+    def _hit(self, row, idx):
+        doc = self._docs[row]
+        metadata = dict(doc.get("metadata") or {})
+        metadata.setdefault("page_num", doc.get("page_num"))
+        metadata.setdefault("content_type", doc.get("content_type"))
+        metadata.setdefault("file_name", doc.get("file_name"))
+        return {'id': doc['id'], 'text': doc['text'], 'file_id': None, 'image_id': None,
+                'metadata': metadata, 'rank': idx + 1}
+
+    def search(self, text, size=10, exact=None, filters=None, timeout=None):
+        """BM25 + 向量检索 + RRF融合, 返回结构与 elastic_search 相同; timeout 为查询向量的超时(秒)"""
+        keyword_hits = self.keyword_search(text, size, filters=filters)
+        vector_hits = self.vector_search(embed_query(text, timeout), size, exact, filters)
+        return hybrid_search_rrf(keyword_hits, vector_hits)
+
+
+_open_indices = {}
+
+def get_local_index(index_dir, dtype="float32"):
+    """进程内复用已打开的本地索引"""
+    if index_dir not in _open_indices:
+        _open_indices[index_dir] = LocalVectorIndex(index_dir, dtype)
+    return _open_indices[index_dir]
+
+
+_search_result_cache = LRUCache(SEARCH_RESULT_CACHE_SIZE)
+
+def local_search(text, index_dir, use_cache=True, filters=None, timeout=None):
+    """与 elastic_search(text, es_index) 相同的接口"""
+    index = get_local_index(index_dir)
+    cache_key = (index_dir, normalize_query(text), index.generation(), filters_key(filters))
+    if use_cache:
+        cached = _search_result_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+    results = index.search(text, filters=filters, timeout=timeout)
+    if use_cache:
+        _search_result_cache.put(cache_key, copy.deepcopy(results))
+    return results
@@ -0,0 +1,131 @@
+"""
+页级粗排索引: 两阶段检索的第一阶段
+每页的所有块向量取平均并归一化, 作为该页的摘要向量, 写入伴生索引 <index>_pages。
+检索时先在页索引上用kNN选出最相关的若干页, 再只在这些页的块中做向量检索 (带filter的kNN),
+块的数量增长到百万级以后, 第二阶段的搜索空间只和选中的页数有关。
+
+页向量由已有的块向量计算, 不额外调用LLM或嵌入模型; 没有页索引的旧索引自动退回全量检索。
+"""
+
+import numpy as np
+from elasticsearch import helpers
+
+PAGE_INDEX_SUFFIX = "_pages"
+
+# 已确认存在的页索引, 避免每次查询都多一次exists请求
+_existing_page_indices = set()
+
+
+def page_index_name(index_name):
+    return index_name + PAGE_INDEX_SUFFIX
+
+
+def page_key(doc_key, page_num):
+    """块所在页的标识, 文件内容哈希 + 页码, 同名文件修改后会得到新的页"""
+    if not doc_key or page_num is None:
+        return None
+    return f"{doc_key}:{page_num}"
+
+
+def create_page_index(es, index_name, dims=1024):
+    """创建页索引, 页的数量远小于块, 固定使用float32 HNSW"""
+    mappings = {
+        "properties": {
+            "vector": {"type": "dense_vector", "dims": dims, "index": True, "similarity": "cosine"},
+            "file_name": {"type": "keyword"},
+            "page_num": {"type": "integer"},
+            "chunk_ids": {"type": "keyword"},
+            "chunk_count": {"type": "integer"},
+        }
+    }
+    es.indices.create(index=page_index_name(index_name), mappings=mappings)
+    print('[Create Page Index]' + page_index_name(index_name) + ' created')
+
+
+def delete_page_index(es, index_name):
+    name = page_index_name(index_name)
+    es.indices.delete(index=name, ignore_unavailable=True)
+    _existing_page_indices.discard(name)
+
+
+class PageCentroids:
+    """按页累加块向量, 得到每页的平均向量"""
+
+    def __init__(self):
+        self._pages = {}
+
+    def add(self, chunk_id, key, file_name, page_num, vector):
+        if key is None:
+            return
+        page = self._pages.get(key)
+        if page is None:
+            page = self._pages[key] = {"sum": np.zeros(len(vector), dtype=np.float64), "chunk_ids": [],
+                                       "file_name": file_name, "page_num": page_num}
+        page["sum"] += vector
+        page["chunk_ids"].append(chunk_id)
+
+    def add_batch(self, batch):
+        for i, chunk_id in enumerate(batch.ids):
+            self.add(chunk_id, batch.page_keys[i], batch.file_names[i], batch.page_nums[i], batch.vectors[i])
+
+    def __len__(self):
+        return len(self._pages)
+
+    def docs(self):
+        """产出 (页标识, 页文档)"""
+        for key, page in self._pages.items():
+            norm = np.linalg.norm(page["sum"])
+            if norm == 0:
+                continue
+            yield key, {
+                "vector": (page["sum"] / norm).astype(np.float32).tolist(),
+                "file_name": page["file_name"],
+                "page_num": page["page_num"],
+                "chunk_ids": page["chunk_ids"],
+                "chunk_count": len(page["chunk_ids"]),
+            }
+
+
+def index_page_centroids(es, index_name, centroids):
+    """写入页向量, 同一页重新加载时按页标识覆盖; 返回写入的页数"""
+    if not len(centroids):
+        return 0
+    name = page_index_name(index_name)
+    docs = list(centroids.docs())
+    if not es.indices.exists(index=name):
+        create_page_index(es, index_name, dims=len(docs[0][1]["vector"]))
+    actions = ({"_index": name, "_id": key, "_source": doc} for key, doc in docs)
+    indexed, _ = helpers.bulk(es, actions, chunk_size=500, refresh=True, raise_on_error=False)
+    return indexed
+
+
+def delete_page_centroids(es, index_name, chunk_ids):
+    """删除包含这些块的页 (文件被删除或被新版本替换), 页索引不存在时忽略"""
+    name = page_index_name(index_name)
+    if not chunk_ids or not es.indices.exists(index=name):
+        return 0
+    response = es.delete_by_query(index=name, refresh=True, query={"terms": {"chunk_ids": list(chunk_ids)}})
+    return response.get("deleted", 0)
+
+
+def select_pages(es, index_name, query_vector, page_top_k, num_candidates=None, filter=None):
+    """第一阶段: 返回与问题最相关的页标识列表, 页索引不存在时返回None
+
+    filter: 只能使用页索引中的 file_name / page_num 字段
+    """
+    name = page_index_name(index_name)
+    if name not in _existing_page_indices:
+        if not es.indices.exists(index=name):
+            return None
+        _existing_page_indices.add(name)
+    knn_query = {
+        "knn": {
+            "field": "vector",
+            "query_vector": query_vector,
+            "num_candidates": max(num_candidates or 0, page_top_k * 5),
+        }
+    }
+    if filter is not None:
+        knn_query["knn"]["filter"] = filter
+    res = es.search(index=name, query=knn_query, size=page_top_k, source=False)
+    return [hit["_id"] for hit in res["hits"]["hits"]]
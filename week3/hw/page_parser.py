@@ -0,0 +1,133 @@
+"""
+PDF逐页解析 (文本、表格Markdown、图片), 大文件按页区间分发到进程池
+get_text / find_tables / 图片导出都是纯CPU操作, 单进程处理一个上千页的PDF只能用到一个核。
+每个工作进程自己打开PDF处理一段连续的页, 结果按页码合并; 调用模型的部分仍在主进程中完成。
+
+本模块只依赖fitz, 工作进程以spawn方式启动时不会加载ES客户端、嵌入模型等重量级依赖。
+"""
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from table_prefilter import table_candidate
+
+IMAGE_DIR = "pdf_images"
+# 每个工作进程分到的页区间数, 大于1时各进程负载更均衡
+TASKS_PER_WORKER = 4
+# 每个工作进程至少处理的页数, 页数太少时启动进程的开销超过收益
+MIN_PAGES_PER_WORKER = 20
+
+
+def _page_context(page):
+    """按阅读顺序拼接页面上的文字, 作为图片的上下文"""
+    page_context = ""
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        if "lines" in block:
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    page_context += span["text"] + " "
+    return page_context
+
+
+def _parse_page(pdf_document, page_num, options, seen_xrefs):
+    page = pdf_document.load_page(page_num)
+    parsed = {"page_num": page_num, "text": page.get_text(), "tables": None, "images": []}
+
+    if options["tables"] and page_num not in options["skip_table_pages"]:
+        if options["table_prefilter"] and not table_candidate(page)[0]:
+            # 既没有表格线也没有对齐的文本列, 不调用find_tables
+            parsed["tables"] = []
+            parsed["table_prefiltered"] = True
+        else:
+            try:
+                parsed["tables"] = [table.to_markdown() for table in page.find_tables()]
+            except Exception:
+                parsed["tables"] = []
+
+    page_images = pdf_document.get_page_images(page_num) if options["images"] else []
+    if page_images:
+        parsed["image_context"] = _page_context(page)
+    page_width = page.rect.width
+    for img_index, item in enumerate(page_images):
+        xref, image_width, image_height = item[0], item[2], item[3]
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+        # Skip small images
+        if image_width < page_width / 3 or image_width < 200 or image_height < 100:
+            continue
+        image = {"xref": xref, "image_index": img_index + 1, "path": None}
+        if xref not in options["cached_xrefs"]:
+            try:
+                pix = fitz.Pixmap(pdf_document, xref)
+                if pix.colorspace and pix.colorspace.name == "DeviceCMYK":
+                    pix = fitz.Pixmap(fitz.csRGB, pix)
+                image["path"] = f"{options['image_dir']}/img_{page_num + 1}_{img_index + 1}.png"
+                pix.save(image["path"])
+                del pix
+            except Exception as e:
+                image["error"] = str(e)
+        parsed["images"].append(image)
+    return parsed
+
+
+def _parse_page_range(pdf_path, start, end, options):
+    """工作进程入口: 解析 [start, end) 页"""
+    pdf_document = fitz.open(pdf_path)
+    seen_xrefs = set()
+    try:
+        return [_parse_page(pdf_document, page_num, options, seen_xrefs) for page_num in range(start, end)]
+    finally:
+        pdf_document.close()
+
+
+def parse_pdf_pages(pdf_path, workers=1, tables=True, images=True, skip_table_pages=(), cached_xrefs=(),
+                    image_dir=IMAGE_DIR, table_prefilter=False):
+    """解析PDF的所有页, 按页码顺序返回
+
+    每页: {"page_num", "text", "tables": [markdown] 或 None(未解析), "image_context",
+           "images": [{"xref", "image_index", "path"}]}
+    同一张图片(xref)只在第一次出现的页返回; cached_xrefs 中的图片不导出文件 (path为None)。
+    table_prefilter: 先用 table_prefilter.table_candidate 预筛, 不可能有表格的页不调用find_tables,
+                     这些页的 tables 为空列表并带有 "table_prefiltered": True
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    options = {
+        "tables": tables,
+        "images": images,
+        "skip_table_pages": frozenset(skip_table_pages),
+        "cached_xrefs": frozenset(cached_xrefs),
+        "image_dir": image_dir,
+        "table_prefilter": table_prefilter,
+    }
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+
+    workers = max(1, min(workers, page_count // MIN_PAGES_PER_WORKER))
+    if workers == 1:
+        return _parse_page_range(pdf_path, 0, page_count, options)
+
+    step = math.ceil(page_count / (workers * TASKS_PER_WORKER))
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    # spawn: 不继承主进程中的线程和网络连接
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_parse_page_range, pdf_path, start, end, options) for start, end in ranges]
+        pages = [page for future in futures for page in future.result()]
+
+    # 各进程只在自己的页区间内去重, 合并时只保留图片第一次出现的位置
+    seen_xrefs = set()
+    for page in pages:
+        unique = []
+        for image in page["images"]:
+            if image["xref"] in seen_xrefs:
+                if image["path"] and os.path.exists(image["path"]):
+                    os.remove(image["path"])
+                continue
+            seen_xrefs.add(image["xref"])
+            unique.append(image)
+        page["images"] = unique
+    return pages
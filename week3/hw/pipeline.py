@@ -8,42 +8,139 @@
 import argparse
 import glob
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import time
 import traceback
 from typing import Dict, List, Any, Optional
 
 # 导入现有模块
-from config import get_es, ElasticConfig
-from document_process import process_pdf, num_tokens_from_string
-from embedding import local_embedding
-from es_functions import create_elastic_index, delete_elastic_index
-from image_table import extract_images_from_pdf, extract_tables_from_pdf
-from retrieve_documents import elastic_search, rerank, rag_fusion, coreference_resolution, query_decompositon
-from websearch import bocha_web_search, ask_llm
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import fitz
+# PDF解析 (fitz)、图片表格摘要 (openai)、文本切分 (langchain) 只在加载文档时用到,
+# 在 step2 / step3 中按需导入, --status、--query 等命令不为它们付出启动时间
+from config import get_es, get_es_stats, ElasticConfig
+from document_process import num_tokens_from_string
+from cache import SemanticAnswerCache
+from config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE, MEMORY_RECENT_TURNS, MEMORY_TOKEN_BUDGET
+from config import ARTIFACT_CACHE_PATH, DEDUPE_THRESHOLD, PDF_PARSE_WORKERS, TABLE_PREFILTER
+from config import INDEX_KEEP_VERSIONS, REBUILD_SMOKE_SAMPLES, REBUILD_SMOKE_MIN_HIT_RATE
+from config import QUERY_DEADLINE_SECONDS, DEADLINE_GENERATION_RESERVE, FEDERATED_INDEX_TIMEOUT
+from config import WEB_SEARCH_ENABLED, WEB_SEARCH_TIMEOUT, WEB_SEARCH_CACHE_TTL
+from deadline import Deadline
+from hedging import hedging_stats
+from artifact_cache import ArtifactCache, file_sha256
+from dedupe import MinHashDeduper
+from chunk_store import ChunkBatch
+from conversation_memory import ConversationMemory
+from embedding import local_embedding, embed_query, query_batcher_stats
+from es_functions import create_elastic_index, delete_elastic_index, bump_index_generation, get_index_generation, VECTOR_INDEX_TYPES
+from es_functions import is_external_text, resolve_index, next_index_version, swap_alias, gc_index_versions, get_alias_targets
+from text_store import get_text_store
+from page_index import PageCentroids, page_key, index_page_centroids, delete_page_centroids
+from local_index import get_local_index, local_search
+from watcher import PDFDirectoryWatcher
+from snapshot import export_es_snapshot, import_es_snapshot, export_local_snapshot, import_local_snapshot
+from retrieve_documents import elastic_search, federated_search, resolve_indices, filters_key, rerank, gated_rerank, rrf_merge, rag_fusion, coreference_resolution, query_decompositon
+from websearch import ask_llm, submit_web_search, web_results_to_docs, web_search_stats
 import json
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import numpy as np
+from elasticsearch import helpers
+
+# 步骤5每个bulk请求包含的块数
+BULK_BATCH_SIZE = 500
+# bulk中单个条目返回这些状态码 (限流、节点暂时不可用) 时重试该条目, 其他错误 (如mapping冲突) 不重试
+BULK_RETRY_STATUS = {429, 502, 503, 504}
+BULK_MAX_RETRIES = 5
+# 步骤8生成答案使用的结果数
+ANSWER_CONTEXT_SIZE = 5
+
+
+def citation_location(citation: Dict[str, Any]) -> str:
+    """引用的位置: 文档块为页码, 网络搜索结果为网址"""
+    if citation.get("url"):
+        return citation["url"]
+    return f"第{citation['page']}页"
 
 
 class RAGPipeline:
     """PDF RAG完整流水线"""
     
-    def __init__(self, index_name: str = "rag_pipeline_index"):
+    def __init__(self, index_name: str = "rag_pipeline_index", vector_index_type: Optional[str] = None,
+                 rescore_oversample: Optional[float] = None, backend: str = "es",
+                 local_index_dir: Optional[str] = None, local_vector_dtype: str = "float32",
+                 answer_cache: bool = True, artifact_cache: bool = True, dedupe: bool = True,
+                 parse_workers: Optional[int] = None, rerank_gate: bool = True,
+                 two_stage: Optional[bool] = None, page_top_k: Optional[int] = None,
+                 external_text: bool = False, search_indices: Optional[List[str]] = None,
+                 search_filters: Optional[Dict[str, Any]] = None, query_deadline: Optional[float] = None,
+                 use_rag_fusion: bool = False, use_web_search: Optional[bool] = None):
         """初始化流水线
         
         Args:
             index_name: Elasticsearch索引名称
+            vector_index_type: 新建索引时的向量布局 (hnsw/int8_hnsw/int4_hnsw/bbq_hnsw)，默认读取配置
+            rescore_oversample: 量化索引全精度重打分的候选倍数，默认读取配置
+            backend: 检索后端，"es" 使用Elasticsearch，"local" 使用本地嵌入式索引
+            local_index_dir: 本地索引目录，默认 local_index/<index_name>
+            local_vector_dtype: 本地索引的向量存储类型 (float32/int8)
+            answer_cache: 是否启用语义答案缓存
+            artifact_cache: 是否启用图片/表格提取结果的跨运行缓存
+            dedupe: 是否在向量化之前去除近似重复的块
+            parse_workers: 解析单个PDF的进程数，默认读取配置
+            rerank_gate: 两路检索结果高度一致时跳过rerank或只重排边界窗口
+            two_stage: 两阶段检索, 先选出最相关的页再在页内做向量检索，默认读取配置 (仅ES后端)
+            page_top_k: 两阶段检索第一阶段选出的页数，默认读取配置
+            external_text: 新建索引时使用文本分离布局，正文存入本地TextStore，ES只保存可检索字段和向量
+            search_indices: 查询时联合检索的多个索引或别名 (仅ES后端)，默认只检索 index_name
+            search_filters: 查询时的元数据过滤条件，如 {"content_type": "table", "file_name": "a.pdf", "page_num": [10, 50]}
+            query_deadline: 单次查询的时间预算(秒)，超出预算前跳过可选阶段，默认读取配置 (0为不限时)
+            use_rag_fusion: 步骤6额外检索LLM改写的问题并做RRF融合
+            use_web_search: 步骤6并发执行网络搜索，结果与文档检索结果一起融合，默认读取配置
         """
+        if backend not in ("es", "local"):
+            raise ValueError(f"Unsupported backend: {backend}")
         self.index_name = index_name
+        self.vector_index_type = vector_index_type
+        self.rescore_oversample = rescore_oversample
+        self.backend = backend
+        self.local_index_dir = local_index_dir or os.path.join("local_index", index_name)
+        self.local_vector_dtype = local_vector_dtype
+        self.local_index = None
+        self.answer_cache = SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL,
+                                                ANSWER_CACHE_SIZE) if answer_cache else None
+        self.artifact_cache = ArtifactCache(ARTIFACT_CACHE_PATH) if artifact_cache else None
+        self.deduper = MinHashDeduper(DEDUPE_THRESHOLD) if dedupe else None
+        self._dedupe_restored = False
+        # 步骤5写入后刷新索引并更新数据版本号; 蓝绿重建的新版本关闭, 构建完成后统一做一次
+        self.bump_generation = True
+        self.parse_workers = parse_workers or PDF_PARSE_WORKERS
+        self._index_lock = threading.Lock()
+        self.rerank_gate = rerank_gate
+        self.two_stage = two_stage
+        self.page_top_k = page_top_k
+        self.external_text = external_text
+        self.search_indices = search_indices
+        self.search_filters = search_filters
+        self.query_deadline = QUERY_DEADLINE_SECONDS if query_deadline is None else query_deadline
+        self.use_rag_fusion = use_rag_fusion
+        self.use_web_search = WEB_SEARCH_ENABLED if use_web_search is None else use_web_search
+        self.rerank_stats = {"queries": 0, "skip": 0, "window": 0, "full": 0, "docs_reranked": 0, "docs_total": 0}
         self.es = None
         self.chat_history = []
+        self.memory = ConversationMemory(MEMORY_RECENT_TURNS, MEMORY_TOKEN_BUDGET)
         self.processed_pdfs = []
         
     def step1_deploy_elasticsearch(self) -> Dict[str, Any]:
         """步骤1: 在本地部署Elasticsearch"""
         print("🚀 步骤1: 检查Elasticsearch部署...")
         
+        if self.backend == "local":
+            self.local_index = get_local_index(self.local_index_dir, self.local_vector_dtype)
+            print(f"✅ 使用本地索引 {self.local_index_dir}，跳过Elasticsearch")
+            return {"success": True, "message": "本地索引已就绪"}
+        
         try:
             self.es = get_es()
             
@@ -53,10 +150,12 @@ class RAGPipeline:
                 
                 # 检查是否需要创建索引
                 if not self.es.indices.exists(index=self.index_name):
-                    create_elastic_index(self.index_name)
+                    create_elastic_index(self.index_name, self.vector_index_type, self.external_text)
                     print(f"✅ 索引 {self.index_name} 创建成功")
                 else:
                     print(f"✅ 索引 {self.index_name} 已存在")
+                    if self.external_text and not is_external_text(self.es, self.index_name):
+                        print("⚠️ 已有索引不是文本分离布局, --external-text 只对新建索引生效")
                 
                 return {"success": True, "message": "Elasticsearch部署正常"}
             else:
@@ -67,6 +166,20 @@ class RAGPipeline:
     
     def check_index_status(self) -> Dict[str, Any]:
         """检查索引状态和文档数量"""
+        if self.backend == "local":
+            if not os.path.exists(os.path.join(self.local_index_dir, "manifest.json")):
+                return {
+                    "exists": False,
+                    "document_count": 0,
+                    "message": f"本地索引 '{self.local_index_dir}' 不存在"
+                }
+            document_count = get_local_index(self.local_index_dir, self.local_vector_dtype).count()
+            return {
+                "exists": True,
+                "document_count": document_count,
+                "message": f"本地索引 '{self.local_index_dir}' 包含 {document_count} 个文档"
+            }
+        
         try:
             if not self.es:
                 self.es = get_es()
@@ -83,11 +196,18 @@ class RAGPipeline:
             try:
                 count_result = self.es.count(index=self.index_name)
                 document_count = count_result.get('count', 0)
+                message = f"索引 '{self.index_name}' 包含 {document_count} 个文档"
+                physical_index = self._physical_index()
+                if physical_index != self.index_name:
+                    message += f" (别名, 当前版本 {physical_index})"
+                if is_external_text(self.es, physical_index):
+                    store_stats = get_text_store(physical_index).stats()
+                    message += f", 本地正文 {store_stats['count']} 条 ({store_stats['bytes'] / 1024 / 1024:.1f}MB)"
                 
                 return {
                     "exists": True,
                     "document_count": document_count,
-                    "message": f"索引 '{self.index_name}' 包含 {document_count} 个文档"
+                    "message": message
                 }
             except Exception as e:
                 return {
@@ -106,33 +226,48 @@ class RAGPipeline:
     def step2_process_pdf(self, pdf_path: str) -> Dict[str, Any]:
         """步骤2: PDF处理：提取文本、图片和表格"""
         print("📄 步骤2: 处理PDF文件...")
+        from image_table import extract_images_from_pdf, extract_tables_from_pdf, cached_parse_options
+        from page_parser import parse_pdf_pages, IMAGE_DIR
         
+        image_dir = None
         try:
             # 检查文件是否存在
             if not os.path.exists(pdf_path):
                 return {"success": False, "error": f"PDF文件不存在: {pdf_path}"}
             
+            # 逐页解析文本、表格和图片 (纯CPU部分, 大文件分发到多个进程)
+            file_hash = file_sha256(pdf_path)
+            # 每个文档的图片导出到独立目录, 监听模式下并发处理的文件不会覆盖彼此的图片
+            os.makedirs(IMAGE_DIR, exist_ok=True)
+            image_dir = tempfile.mkdtemp(prefix=f"{file_hash[:16]}_", dir=IMAGE_DIR)
+            parse_start = time.time()
+            pages = parse_pdf_pages(pdf_path, workers=self.parse_workers, table_prefilter=TABLE_PREFILTER,
+                                    image_dir=image_dir, **cached_parse_options(self.artifact_cache, file_hash))
+            parse_seconds = time.time() - parse_start
+            print(f"  解析完成: {len(pages)}页, 耗时{parse_seconds:.2f}秒 ({len(pages) / max(parse_seconds, 1e-6):.1f}页/秒)")
+            prefiltered = sum(1 for page in pages if page.get("table_prefiltered"))
+            if prefiltered:
+                print(f"  表格预筛: {prefiltered}/{len(pages)}页没有表格线和对齐文本列, 已跳过find_tables")
+            
             # 提取文本内容
             print("  提取文本内容...")
-            pdf_document = fitz.open(pdf_path)
             text_content = []
             
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document.load_page(page_num)
-                text = page.get_text()
+            for page in pages:
+                text = page["text"]
                 if text.strip():  # 只保存非空页面
                     text_content.append({
-                        "page_num": page_num + 1,
+                        "page_num": page["page_num"] + 1,
                         "content": text.strip(),
                         "content_type": "text"
                     })
             
-            pdf_document.close()
+            cache_hits_before = self.artifact_cache.hits if self.artifact_cache else 0
             
             # 提取图片
             print("  提取图片内容...")
             try:
-                images = extract_images_from_pdf(pdf_path)
+                images = extract_images_from_pdf(pdf_path, cache=self.artifact_cache, pages=pages, file_hash=file_hash)
                 image_content = []
                 for img in images:
                     image_content.append({
@@ -152,7 +287,7 @@ class RAGPipeline:
             # 提取表格
             print("  提取表格内容...")
             try:
-                tables = extract_tables_from_pdf(pdf_path)
+                tables = extract_tables_from_pdf(pdf_path, cache=self.artifact_cache, pages=pages, file_hash=file_hash)
                 table_content = []
                 for table in tables:
                     table_content.append({
@@ -170,8 +305,17 @@ class RAGPipeline:
                 table_content = []
             
             all_content = text_content + image_content + table_content
+            # 块id以文件内容哈希为前缀, 不同文件的块不会互相覆盖, 重新加载同一文件时覆盖原有的块
+            file_name = os.path.basename(pdf_path)
+            doc_key = file_hash[:16]
+            for item in all_content:
+                item["file_name"] = file_name
+                item["doc_key"] = doc_key
+            cache_hits = self.artifact_cache.hits - cache_hits_before if self.artifact_cache else 0
             
             print(f"✅ PDF处理完成: 文本页面{len(text_content)}页, 图片{len(image_content)}个, 表格{len(table_content)}个")
+            if cache_hits:
+                print(f"  ♻️ 提取缓存命中 {cache_hits} 次")
             
             return {
                 "success": True,
@@ -180,16 +324,22 @@ class RAGPipeline:
                     "text_pages": len(text_content),
                     "images": len(image_content),
                     "tables": len(table_content),
-                    "total_items": len(all_content)
+                    "total_items": len(all_content),
+                    "parse_seconds": parse_seconds,
+                    "artifact_cache_hits": cache_hits
                 }
             }
             
         except Exception as e:
             return {"success": False, "error": f"PDF处理失败: {str(e)}"}
+        finally:
+            if image_dir is not None:
+                shutil.rmtree(image_dir, ignore_errors=True)
     
     def step3_chunk_content(self, content: List[Dict], chunk_size: int = 1024) -> Dict[str, Any]:
         """步骤3: 内容切分：将内容拆分成可检索的单元"""
         print("✂️ 步骤3: 切分内容...")
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
         
         try:
             text_splitter = RecursiveCharacterTextSplitter(
@@ -205,16 +355,20 @@ class RAGPipeline:
                 content_text = item["content"]
                 content_type = item["content_type"]
                 page_num = item["page_num"]
+                id_prefix = f"{item['doc_key']}_" if item.get("doc_key") else ""
+                item_page_key = page_key(item.get("doc_key"), page_num)
                 
                 if content_type == "text" and len(content_text) > chunk_size:
                     # 对长文本进行切分
                     text_chunks = text_splitter.split_text(content_text)
                     for i, chunk_text in enumerate(text_chunks):
                         chunks.append({
-                            "id": f"chunk_{chunk_id}",
+                            "id": f"{id_prefix}chunk_{chunk_id}",
                             "content": chunk_text,
+                            "file_name": item.get("file_name"),
                             "content_type": content_type,
                             "page_num": page_num,
+                            "page_key": item_page_key,
                             "chunk_index": i,
                             "metadata": item.get("metadata", {})
                         })
@@ -222,10 +376,12 @@ class RAGPipeline:
                 else:
                     # 图片和表格不切分，直接作为一个块
                     chunks.append({
-                        "id": f"chunk_{chunk_id}",
+                        "id": f"{id_prefix}chunk_{chunk_id}",
                         "content": content_text,
+                        "file_name": item.get("file_name"),
                         "content_type": content_type,
                         "page_num": page_num,
+                        "page_key": item_page_key,
                         "chunk_index": 0,
                         "metadata": item.get("metadata", {})
                     })
@@ -242,6 +398,74 @@ class RAGPipeline:
         except Exception as e:
             return {"success": False, "error": f"内容切分失败: {str(e)}"}
     
+    def restore_dedupe_state(self) -> Dict[str, Any]:
+        """从索引中已有的块重建去重状态, 调用前需先完成步骤1
+        
+        去重状态只在内存中: 进程重启后不重建的话, 新文件不会与已入库的块去重,
+        删除文件时也找不到规范块上记录的其他文件副本, 这些副本的内容会随规范块一起从索引中消失
+        """
+        with self._index_lock:
+            return self._ensure_dedupe_state()
+    
+    def _ensure_dedupe_state(self) -> Dict[str, Any]:
+        """restore_dedupe_state 的实现, 调用方需持有 _index_lock; 每个流水线实例只重建一次"""
+        if self.deduper is None or self._dedupe_restored:
+            return {"success": True}
+        start = time.time()
+        try:
+            if self.backend == "local":
+                docs = ((doc_id, source.get("text"), (source.get("metadata") or {}).get("duplicates"))
+                        for doc_id, _, source in self.local_index.iter_docs())
+            else:
+                docs = self._iter_es_dedupe_docs(self._physical_index())
+            canonical = self.deduper.restore(docs)
+        except Exception as e:
+            # 重建失败时按空状态继续 (与未开启去重相同), 下一次加载或删除时再尝试
+            print(f"  ⚠️ 去重状态重建失败: {e}")
+            return {"success": False, "error": f"去重状态重建失败: {str(e)}"}
+        self._dedupe_restored = True
+        if canonical:
+            print(f"🧬 从索引重建去重状态: {canonical}个规范块, 耗时{time.time() - start:.1f}s")
+        return {"success": True, "canonical_chunks": canonical}
+    
+    def _iter_es_dedupe_docs(self, index_name: str):
+        """扫描ES索引产出 (块id, 正文, 副本出处), 不取回向量; 文本分离布局的正文从 TextStore 批量读取"""
+        if not self.es.indices.exists(index=index_name):
+            return
+        text_store = get_text_store(index_name) if is_external_text(self.es, index_name) else None
+        hits = helpers.scan(self.es, index=index_name, size=1000, request_timeout=120,
+                            source_excludes=["vector"])
+        while True:
+            batch = [(hit["_id"], hit.get("_source") or {}) for _, hit in zip(range(1000), hits)]
+            if not batch:
+                return
+            stored = text_store.get_many([doc_id for doc_id, _ in batch]) if text_store is not None else {}
+            for doc_id, source in batch:
+                text, extra = stored.get(doc_id, (source.get("text"), {}))
+                metadata = {**(source.get("metadata") or {}), **extra}
+                yield doc_id, text, metadata.get("duplicates")
+    
+    def dedupe_chunks(self, chunks: List[Dict], replaced_ids: Optional[List[str]] = None,
+                      replaced_file: Optional[str] = None) -> Dict[str, Any]:
+        """步骤3和4之间: 近似重复块只保留一个规范块, 副本的出处记录到规范块的metadata中
+        
+        replaced_ids / replaced_file: 重新加载修改过的文件时, 旧版本的块id和文件名, 见 MinHashDeduper.dedupe
+        """
+        if self.deduper is None:
+            return {"success": True, "chunks": chunks, "provenance_updates": {}, "dedupe_stats": {}}
+        
+        self._ensure_dedupe_state()
+        print("🧬 去除近似重复的块...")
+        try:
+            kept, updates, stats = self.deduper.dedupe(chunks, replaced_ids or (), replaced_file)
+            print(f"✅ 去重完成: {stats['input_chunks']}个块 → {stats['kept_chunks']}个, "
+                  f"节省向量{stats['embeddings_saved']}个、索引条目{stats['index_entries_saved']}个")
+            return {"success": True, "chunks": kept, "provenance_updates": updates, "dedupe_stats": stats}
+        except Exception as e:
+            # 去重只是优化, 失败时按原样继续
+            print(f"  ⚠️ 去重失败, 跳过: {e}")
+            return {"success": True, "chunks": chunks, "provenance_updates": {}, "dedupe_stats": {}}
+    
     def step4_vectorize_content(self, chunks: List[Dict]) -> Dict[str, Any]:
         """步骤4: 向量化：为文本、表格摘要和图片描述生成向量"""
         print("🔢 步骤4: 向量化内容...")
@@ -253,115 +477,316 @@ class RAGPipeline:
             # 批量生成向量
             print(f"  正在为{len(texts)}个块生成向量...")
             batch_size = 25
-            all_vectors = []
+            matrix = None
             
             for i in range(0, len(texts), batch_size):
                 batch_texts = texts[i:i + batch_size]
-                batch_vectors = local_embedding(batch_texts)
-                all_vectors.extend(batch_vectors)
+                batch_vectors = np.asarray(local_embedding(batch_texts), dtype=np.float32)
+                # 每批结果立即写入float32矩阵, 不保留Python float列表
+                if matrix is None:
+                    matrix = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+                matrix[i:i + len(batch_vectors)] = batch_vectors
                 print(f"  已处理 {min(i + batch_size, len(texts))}/{len(texts)} 个块")
             
-            # 将向量添加到块中
-            for chunk, vector in zip(chunks, all_vectors):
-                chunk["vector"] = vector
+            vectorized = ChunkBatch(chunks, matrix if matrix is not None else np.empty((0, 0), dtype=np.float32))
             
-            print(f"✅ 向量化完成: 生成{len(all_vectors)}个向量")
+            print(f"✅ 向量化完成: 生成{len(vectorized)}个向量 (占用内存约{vectorized.nbytes() / 1024 / 1024:.1f}MB)")
             
             return {
                 "success": True,
-                "vectorized_chunks": chunks,
-                "vector_count": len(all_vectors)
+                "vectorized_chunks": vectorized,
+                "vector_count": len(vectorized)
             }
             
         except Exception as e:
             return {"success": False, "error": f"向量化失败: {str(e)}"}
     
-    def step5_index_to_elasticsearch(self, vectorized_chunks: List[Dict]) -> Dict[str, Any]:
-        """步骤5: 索引：将内容与向量一起存储到Elasticsearch"""
+    def _update_chunk_fields(self, index_name: Optional[str], text_store, updates: Dict[str, Dict]) -> None:
+        """部分更新已入库块的字段 ({块id: {"file_name"?, "page_num"?, "metadata": {...}}}), metadata按键合并
+        
+        index_name 为物理索引名, 本地后端时忽略; text_store 为正文外置时的本地正文存储
+        """
+        if not updates:
+            return
+        if self.backend == "local":
+            self.local_index.update_fields(updates)
+            return
+        for doc_id, fields in updates.items():
+            try:
+                doc = dict(fields)
+                if text_store is not None:
+                    # 部分更新会按_source重建文档, 被排除的正文需要一并提交才能保留在倒排索引中
+                    text_store.fill_source(doc_id, doc)
+                self.es.update(index=index_name, id=doc_id, doc=doc)
+            except Exception as e:
+                print(f"    ⚠️ 更新出处失败 {doc_id}: {e}")
+    
+    def step5_index_to_elasticsearch(self, vectorized_chunks: ChunkBatch,
+                                     provenance_updates: Optional[Dict[str, List]] = None) -> Dict[str, Any]:
+        """步骤5: 索引：将内容与向量一起存储到Elasticsearch
+        
+        provenance_updates: 去重步骤产出的 {已入库规范块id: 副本出处列表}, 写入对应文档的metadata.duplicates
+        """
         print("📇 步骤5: 索引到Elasticsearch...")
         
+        if self.backend == "local":
+            try:
+                indexed_count = self.local_index.add(vectorized_chunks)
+                indexed_ids = list(ChunkBatch.from_dicts(vectorized_chunks).ids)
+                self._update_chunk_fields(None, None, {doc_id: {"metadata": {"duplicates": duplicates}}
+                                                       for doc_id, duplicates in (provenance_updates or {}).items()})
+                if self.deduper is not None:
+                    self.deduper.commit()
+                print(f"✅ 索引完成: 成功写入本地索引{indexed_count}个块")
+                return {
+                    "success": True,
+                    "indexed_count": indexed_count,
+                    "indexed_ids": indexed_ids,
+                    "total_chunks": len(vectorized_chunks)
+                }
+            except Exception as e:
+                return {"success": False, "error": f"本地索引写入失败: {str(e)}"}
+        
         try:
-            indexed_count = 0
-            batch_size = 25
+            vectorized_chunks = ChunkBatch.from_dicts(vectorized_chunks)
+            # index_name 为别名时写入它当前指向的版本, 页索引和本地正文也按该版本保存
+            index_name = self._physical_index()
+            
+            text_store = get_text_store(index_name) if is_external_text(self.es, index_name) else None
+            if text_store is not None:
+                # 正文先写入本地, 块在ES中可被检索到时正文一定已经存在
+                text_store.put_batch(vectorized_chunks)
             
-            for i in range(0, len(vectorized_chunks), batch_size):
-                batch = vectorized_chunks[i:i + batch_size]
+            indexed_ids, failed = [], {}
+            for i in range(0, len(vectorized_chunks), BULK_BATCH_SIZE):
+                positions = list(range(i, min(i + BULK_BATCH_SIZE, len(vectorized_chunks))))
                 
-                for chunk in batch:
-                    body = {
-                        "text": chunk["content"],
-                        "vector": chunk["vector"],
-                        "content_type": chunk["content_type"],
-                        "page_num": chunk["page_num"],
-                        "chunk_index": chunk["chunk_index"],
-                        "metadata": chunk.get("metadata", {})
-                    }
-                    
-                    retry = 0
-                    while retry <= 5:
-                        try:
-                            self.es.index(index=self.index_name, id=chunk["id"], body=body)
-                            indexed_count += 1
-                            break
-                        except Exception as e:
-                            print(f"    重试索引 {chunk['id']}: {e}")
-                            retry += 1
-                            time.sleep(1)
+                retry = 0
+                while positions and retry <= BULK_MAX_RETRIES:
+                    try:
+                        response = self.es.bulk(operations=vectorized_chunks.bulk_body(index_name, positions=positions))
+                    except Exception as e:
+                        print(f"    重试批量索引 {i}-{i + BULK_BATCH_SIZE}: {e}")
+                        retry += 1
+                        time.sleep(1)
+                        continue
+                    # 整个请求成功时, 单个条目仍可能失败 (如429限流), 只重发这些条目
+                    retry_positions = []
+                    for position, item in zip(positions, response["items"]):
+                        result = item.get("index", {})
+                        if not result.get("error"):
+                            indexed_ids.append(vectorized_chunks.ids[position])
+                            failed.pop(position, None)
+                            continue
+                        failed[position] = result["error"]
+                        if result.get("status") in BULK_RETRY_STATUS:
+                            retry_positions.append(position)
+                    positions = retry_positions
+                    if positions:
+                        retry += 1
+                        print(f"    {len(positions)}个块被暂时拒绝, 第{retry}次重试")
+                        time.sleep(retry)
+                for position in positions:
+                    failed.setdefault(position, "重试次数用尽")
                 
-                print(f"  已索引 {min(i + batch_size, len(vectorized_chunks))}/{len(vectorized_chunks)} 个块")
+                print(f"  已索引 {min(i + BULK_BATCH_SIZE, len(vectorized_chunks))}/{len(vectorized_chunks)} 个块")
+            
+            indexed_count = len(indexed_ids)
+            if failed:
+                for position, error in list(failed.items())[:5]:
+                    print(f"    索引失败 {vectorized_chunks.ids[position]}: {error}")
+                print(f"  ⚠️ {len(failed)}个块索引失败")
+                if text_store is not None:
+                    text_store.delete([vectorized_chunks.ids[position] for position in failed])
             
-            print(f"✅ 索引完成: 成功索引{indexed_count}个块")
+            self._update_chunk_fields(index_name, text_store, {doc_id: {"metadata": {"duplicates": duplicates}}
+                                                               for doc_id, duplicates in (provenance_updates or {}).items()})
+            if self.deduper is not None:
+                # 只登记实际写入的块, 写入失败的块之后重新加载时不会被当作已入库的副本丢弃
+                self.deduper.commit(indexed_ids)
+            
+            # 两阶段检索使用的页向量, 由本批块向量按页平均得到
+            pages_indexed = 0
+            if indexed_count:
+                try:
+                    centroids = PageCentroids()
+                    centroids.add_batch(vectorized_chunks)
+                    pages_indexed = index_page_centroids(self.es, index_name, centroids)
+                except Exception as e:
+                    print(f"    ⚠️ 页向量写入失败, 两阶段检索将退回全量检索: {e}")
+            
+            if self.bump_generation and (indexed_count or provenance_updates):
+                # 更新索引版本号, 使检索缓存失效
+                bump_index_generation(self.es, index_name)
+            
+            print(f"✅ 索引完成: 成功索引{indexed_count}个块, {pages_indexed}个页向量")
             
             return {
                 "success": True,
                 "indexed_count": indexed_count,
+                "indexed_ids": indexed_ids,
+                "failed_count": len(failed),
+                "pages_indexed": pages_indexed,
                 "total_chunks": len(vectorized_chunks)
             }
             
         except Exception as e:
             return {"success": False, "error": f"索引失败: {str(e)}"}
     
-    def step6_hybrid_search(self, query: str, top_k: int = 10) -> Dict[str, Any]:
-        """步骤6: 检索：支持混合搜索（hybrid search）"""
+    def _search_once(self, query: str, top_k: int, indices, filters, timeout: Optional[float] = None):
+        """单个问题的一次检索, 返回 (结果, 联合检索报告)"""
+        if self.backend == "local":
+            return local_search(query, self.local_index_dir, filters=filters, timeout=timeout), None
+        if indices:
+            search_results, federated_report = federated_search(
+                query, indices, top_k=top_k, rescore_oversample=self.rescore_oversample,
+                two_stage=self.two_stage, page_top_k=self.page_top_k, filters=filters,
+                timeout=min(timeout, FEDERATED_INDEX_TIMEOUT) if timeout else None)
+            for index, reason in federated_report["dropped"].items():
+                print(f"  ⚠️ 索引 {index} 未参与本次检索: {reason}")
+            return search_results, federated_report
+        return elastic_search(query, self.index_name, rescore_oversample=self.rescore_oversample,
+                              two_stage=self.two_stage, page_top_k=self.page_top_k, top_k=top_k,
+                              filters=filters, timeout=timeout), None
+    
+    def step6_hybrid_search(self, query: str, top_k: int = 10, indices: Optional[List[str]] = None,
+                            filters: Optional[Dict[str, Any]] = None,
+                            deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """步骤6: 检索：支持混合搜索（hybrid search）
+        
+        indices: 联合检索的索引列表或别名，默认使用 search_indices；为空时只检索 index_name
+        filters: 元数据过滤条件，默认使用 search_filters；在BM25和kNN打分之前生效
+        deadline: 查询的时间预算，检索请求的超时取剩余预算；时间不足时跳过或提前结束RAG Fusion
+        开启网络搜索时，网络搜索先在后台发出，与文档检索并发执行，结果转换成检索结果的格式后一起RRF融合
+        """
         print("🔍 步骤6: 混合搜索...")
+        deadline = deadline or Deadline()
         
         try:
+            indices = indices or self.search_indices
+            filters = filters or self.search_filters
+            if filters:
+                print(f"  过滤条件: {filters_key(filters)}")
+            
+            # 网络搜索与文档检索并发: 先发出请求, 文档检索结束后只等待剩余的时间
+            web_future = None
+            if self.use_web_search:
+                if deadline.allows("web_search"):
+                    web_timeout = deadline.timeout(cap=WEB_SEARCH_TIMEOUT)
+                    web_started = time.monotonic()
+                    web_future = submit_web_search(query, timeout=web_timeout)
+                else:
+                    deadline.degrade("web_search", f"剩余{deadline.available():.1f}秒, 跳过网络搜索")
+            
             # 执行混合搜索
-            search_results = elastic_search(query, self.index_name)
+            # 检索是必需阶段, 超时可以用到截止时间; 可选的改写检索不占用生成答案的预留
+            search_results, federated_report = self._search_once(query, top_k, indices, filters,
+                                                                 deadline.timeout(reserve=False))
+            
+            if self.use_rag_fusion:
+                if not deadline.allows("rag_fusion"):
+                    deadline.degrade("rag_fusion", f"剩余{deadline.available():.1f}秒, 跳过问题改写")
+                else:
+                    rewrites = rag_fusion(query, timeout=deadline.timeout())
+                    result_lists = [search_results]
+                    for i, rewrite in enumerate(rewrites):
+                        if not deadline.allows("rag_fusion"):
+                            deadline.degrade("rag_fusion", f"只检索了{i}/{len(rewrites)}个改写")
+                            break
+                        print(f"  改写检索: {rewrite}")
+                        result_lists.append(self._search_once(rewrite, top_k, indices, filters, deadline.timeout())[0])
+                    search_results = rrf_merge(result_lists)
+            
+            if web_future is not None:
+                web_docs = self._collect_web_results(web_future, web_timeout - (time.monotonic() - web_started),
+                                                     deadline)
+                if web_docs:
+                    search_results = rrf_merge([search_results, web_docs])
             
             # 限制结果数量
             search_results = search_results[:top_k]
             
-            print(f"✅ 混合搜索完成: 找到{len(search_results)}个相关结果")
+            if federated_report is not None:
+                print(f"✅ 联合检索完成: {len(federated_report['searched'])}/{len(federated_report['indices'])}个索引, "
+                      f"找到{len(search_results)}个相关结果")
+            else:
+                print(f"✅ 混合搜索完成: 找到{len(search_results)}个相关结果")
             
             return {
                 "success": True,
                 "search_results": search_results,
-                "result_count": len(search_results)
+                "result_count": len(search_results),
+                "federated_report": federated_report
             }
             
         except Exception as e:
             return {"success": False, "error": f"混合搜索失败: {str(e)}"}
     
-    def step7_rerank_results(self, query: str, search_results: List[Dict]) -> Dict[str, Any]:
-        """步骤7: 重排序：应用RRF或reranker model做最终排序"""
+    def _collect_web_results(self, web_future, wait_seconds: float, deadline: Deadline) -> List[Dict]:
+        """等待后台的网络搜索, 超时或失败时记为降级并返回空列表; 超时的请求完成后仍会写入缓存"""
+        try:
+            results = web_future.result(timeout=max(wait_seconds, 0.0))
+        except FutureTimeoutError:
+            deadline.degrade("web_search", "网络搜索超时, 只使用文档检索结果")
+            return []
+        except Exception as e:
+            deadline.degrade("web_search", f"网络搜索失败 ({type(e).__name__}), 只使用文档检索结果")
+            return []
+        web_docs = web_results_to_docs(results)
+        print(f"  网络搜索: {len(web_docs)}个结果")
+        return web_docs
+    
+    def step7_rerank_results(self, query: str, search_results: List[Dict],
+                             deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """步骤7: 重排序：应用RRF或reranker model做最终排序
+        
+        deadline: 剩余时间不足时跳过重排序，直接使用混合搜索的排序
+        """
         print("🎯 步骤7: 重排序结果...")
+        deadline = deadline or Deadline()
+        if not deadline.allows("rerank"):
+            deadline.degrade("rerank", f"剩余{deadline.available():.1f}秒, 使用混合搜索排序")
+            return {
+                "success": True,
+                "reranked_results": search_results,
+                "result_count": len(search_results),
+                "warning": "时间预算不足，跳过重排序"
+            }
         
         try:
             # 应用重排序
-            reranked_results = rerank(query, search_results)
+            if self.rerank_gate:
+                reranked_results, decision = gated_rerank(query, search_results, ANSWER_CONTEXT_SIZE,
+                                                          timeout=deadline.timeout())
+            else:
+                reranked_results = rerank(query, search_results, timeout=deadline.timeout())
+                decision = {"action": "full", "window": (0, len(search_results))}
+            
+            start, end = decision["window"]
+            self.rerank_stats["queries"] += 1
+            self.rerank_stats[decision["action"]] += 1
+            self.rerank_stats["docs_reranked"] += end - start
+            self.rerank_stats["docs_total"] += len(search_results)
             
-            print(f"✅ 重排序完成: 重新排序{len(reranked_results)}个结果")
+            if decision["action"] == "skip":
+                print(f"✅ 两路检索高度一致 (重合{decision['overlap']:.0%}, 分数间隔{decision['margin']:.2f})，跳过重排序")
+            elif decision["action"] == "window":
+                print(f"✅ 重排序完成: 只重排第{start + 1}-{end}个边界结果 (分数间隔{decision['margin']:.2f})")
+            else:
+                print(f"✅ 重排序完成: 重新排序{len(reranked_results)}个结果")
             
             return {
                 "success": True,
                 "reranked_results": reranked_results,
-                "result_count": len(reranked_results)
+                "result_count": len(reranked_results),
+                "rerank_decision": decision
             }
             
         except Exception as e:
             # 如果重排序失败，返回原始结果
             print(f"⚠️ 重排序失败，使用原始结果: {e}")
+            if deadline.enabled and deadline.available() <= 0:
+                deadline.degrade("rerank", "重排序超时, 使用混合搜索排序")
             return {
                 "success": True,
                 "reranked_results": search_results,
@@ -369,26 +794,35 @@ class RAGPipeline:
                 "warning": "重排序失败，使用原始搜索结果"
             }
     
-    def step8_generate_answer(self, query: str, reranked_results: List[Dict]) -> Dict[str, Any]:
-        """步骤8: 回答：基于检索结果生成带引用的回答"""
+    def step8_generate_answer(self, query: str, reranked_results: List[Dict],
+                              deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """步骤8: 回答：基于检索结果生成带引用的回答
+        
+        deadline: LLM调用的超时取剩余预算；超时或预算已用完时返回最相关的原文片段
+        """
         print("💬 步骤8: 生成答案...")
+        deadline = deadline or Deadline()
         
         try:
             # 准备上下文
             context_parts = []
             citations = []
             
-            for i, result in enumerate(reranked_results[:5]):  # 使用前5个结果
+            for i, result in enumerate(reranked_results[:ANSWER_CONTEXT_SIZE]):  # 使用前5个结果
                 text = result.get("text", "")
                 page_num = result.get("metadata", {}).get("page_num", "未知")
                 content_type = result.get("metadata", {}).get("content_type", "text")
+                duplicates = (result.get("metadata") or {}).get("duplicates", [])
                 
                 context_parts.append(f"[引用{i+1}] {text}")
                 citations.append({
                     "id": i + 1,
                     "page": page_num,
                     "type": content_type,
-                    "content": text[:200] + "..." if len(text) > 200 else text
+                    "content": text[:200] + "..." if len(text) > 200 else text,
+                    "also_in": duplicates,
+                    "index": result.get("index"),
+                    "url": result.get("metadata", {}).get("url")
                 })
             
             context = "\n\n".join(context_parts)
@@ -410,7 +844,20 @@ class RAGPipeline:
 答案:"""
 
             # 调用LLM生成答案
-            answer = ask_llm(prompt)
+            if deadline.enabled and deadline.remaining() <= 0:
+                answer = None
+                deadline.degrade("generation", "预算已用完, 返回检索到的原文")
+            else:
+                try:
+                    answer = ask_llm(prompt, timeout=deadline.timeout(cap=60, reserve=False))
+                except Exception as e:
+                    if not deadline.enabled:
+                        raise
+                    answer = None
+                    deadline.degrade("generation", f"生成答案超时或失败 ({type(e).__name__}), 返回检索到的原文")
+            if answer is None:
+                answer = "⏳ 未能在时间预算内生成答案，以下是最相关的检索内容：\n\n" + "\n\n".join(
+                    f"[引用{c['id']}] {c['content']}" for c in citations)
             
             print("✅ 答案生成完成")
             
@@ -424,6 +871,197 @@ class RAGPipeline:
         except Exception as e:
             return {"success": False, "error": f"答案生成失败: {str(e)}"}
     
+    def new_deadline(self) -> Deadline:
+        """按 query_deadline 创建一次查询的时间预算, 为生成答案预留 DEADLINE_GENERATION_RESERVE 秒"""
+        return Deadline(self.query_deadline, DEADLINE_GENERATION_RESERVE)
+    
+    def _index_generation(self) -> str:
+        """当前索引的数据版本号"""
+        if self.backend == "local":
+            return get_local_index(self.local_index_dir, self.local_vector_dtype).generation()
+        if not self.es:
+            self.es = get_es()
+        if self.search_indices:
+            return "|".join(get_index_generation(self.es, index)
+                            for index in resolve_indices(self.es, self.search_indices))
+        return get_index_generation(self.es, self.index_name)
+    
+    def answer_query(self, query: str, top_k: int = 10, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """针对已建好的索引回答问题: 语义缓存 → 步骤6混合搜索 → 步骤7重排序 → 步骤8生成答案
+        
+        deadline: 查询的时间预算，默认按 query_deadline 新建；返回结果中 degraded 列出被跳过或提前结束的阶段
+        """
+        if deadline is None:
+            deadline = self.new_deadline()
+        if self.backend == "local":
+            scope = self.local_index_dir
+        else:
+            scope = ",".join(self.search_indices) if self.search_indices else self.index_name
+        if self.search_filters:
+            # 不同过滤条件下的答案不能互相复用
+            scope += "|" + filters_key(self.search_filters)
+        if self.use_web_search:
+            # 带网络搜索结果的答案与只基于文档的答案分开缓存
+            scope += "|web"
+        query_vector = None
+        generation = None
+        
+        if self.answer_cache is not None:
+            try:
+                lookup_start = time.time()
+                # 缓存查询也受时间预算限制, 查询向量超时时跳过缓存, 检索阶段会再按剩余预算重试
+                query_vector = embed_query(query, deadline.timeout(reserve=False))
+                generation = self._index_generation()
+                entry, similarity = self.answer_cache.lookup(query_vector, scope, generation)
+                if entry is not None:
+                    lookup_ms = (time.time() - lookup_start) * 1000
+                    print(f"⚡ 语义缓存命中 (相似度 {similarity:.3f}, 原问题: {entry['query']}, 耗时 {lookup_ms:.1f}ms)")
+                    return {
+                        "success": True,
+                        "answer": entry["answer"],
+                        "citations": entry["citations"],
+                        "from_cache": True,
+                        "cache_similarity": similarity,
+                        "cached_query": entry["query"],
+                        "degraded": deadline.degraded,
+                        "deadline": deadline.report()
+                    }
+            except Exception as e:
+                print(f"⚠️ 语义缓存查询失败: {e}")
+        
+        results = {}
+        
+        # 步骤6: 混合搜索
+        step6_result = self.step6_hybrid_search(query, top_k, deadline=deadline)
+        if not step6_result["success"]:
+            return {"success": False, "error": f"步骤6失败: {step6_result['error']}"}
+        results.update(step6_result)
+        
+        # 步骤7: 重排序
+        step7_result = self.step7_rerank_results(query, step6_result["search_results"], deadline)
+        if not step7_result["success"]:
+            return {"success": False, "error": f"步骤7失败: {step7_result['error']}"}
+        results.update(step7_result)
+        
+        # 步骤8: 生成答案
+        step8_result = self.step8_generate_answer(query, step7_result["reranked_results"], deadline)
+        if not step8_result["success"]:
+            return {"success": False, "error": f"步骤8失败: {step8_result['error']}"}
+        results.update(step8_result)
+        results["from_cache"] = False
+        results["degraded"] = deadline.degraded
+        results["deadline"] = deadline.report()
+        
+        # 降级得到的答案不写入缓存, 之后有足够时间时重新完整回答
+        if self.answer_cache is not None and query_vector is not None and not deadline.degraded:
+            # 带网络搜索结果的答案不能比搜索结果本身缓存得更久
+            self.answer_cache.store(query_vector, scope, generation, query,
+                                    step8_result["answer"], step8_result["citations"],
+                                    ttl=WEB_SEARCH_CACHE_TTL if self.use_web_search else None)
+        
+        return results
+    
+    def ingest_file(self, pdf_path: str, chunk_size: int = 1024,
+                    replaces: Optional[List[str]] = None) -> Dict[str, Any]:
+        """单个PDF依次执行步骤2-5, 调用前需先完成步骤1
+        
+        PDF解析和模型调用可以在多个线程中并发; 去重、向量化和写入索引串行执行, 保证去重状态一致
+        replaces: 该文件旧版本的块id (文件被修改后重新加载), 这些块不作为去重的规范块,
+                  调用方随后用 delete_chunks 删除其中不再存在的块
+        """
+        # 步骤2: 处理PDF
+        step2_result = self.step2_process_pdf(pdf_path)
+        if not step2_result["success"]:
+            return {"success": False, "error": f"PDF处理失败: {step2_result['error']}"}
+        
+        # 步骤3: 切分内容
+        step3_result = self.step3_chunk_content(step2_result["content"], chunk_size)
+        if not step3_result["success"]:
+            return {"success": False, "error": f"内容切分失败: {step3_result['error']}"}
+        
+        with self._index_lock:
+            # 去除近似重复的块
+            dedupe_result = self.dedupe_chunks(step3_result["chunks"], replaces,
+                                               os.path.basename(pdf_path) if replaces is not None else None)
+            
+            # 步骤4: 向量化
+            step4_result = self.step4_vectorize_content(dedupe_result["chunks"])
+            if not step4_result["success"]:
+                return {"success": False, "error": f"向量化失败: {step4_result['error']}"}
+            
+            # 步骤5: 索引
+            step5_result = self.step5_index_to_elasticsearch(step4_result["vectorized_chunks"],
+                                                             dedupe_result["provenance_updates"])
+            if not step5_result["success"]:
+                return {"success": False, "error": f"索引失败: {step5_result['error']}"}
+        
+        return {
+            "success": True,
+            # 只记录实际写入的块, 写入失败的块不会在之后被当作该文件的旧版本删除
+            "chunk_ids": step5_result["indexed_ids"],
+            "step2": step2_result,
+            "step3": step3_result,
+            "dedupe": dedupe_result,
+            "step5": step5_result
+        }
+    
+    def delete_chunks(self, chunk_ids: List[str], file_name: Optional[str] = None,
+                      file_removed: bool = False) -> Dict[str, Any]:
+        """从索引中删除指定的块 (文件被删除或被新版本替换时使用)
+        
+        file_name: 这些块所属的文件名; 给出时, 记录了其他文件副本的规范块不删除, 改为归属副本所在的文件
+                   (副本去重时没有入库, 删除规范块会让这些内容从索引中消失)
+        file_removed: 整个文件被删除, 同时从其他规范块上去掉该文件的副本出处
+        
+        Returns:
+            repointed: {改为归属其他文件的块id: 新的文件名}, 调用方据此更新文件与块的对应关系
+        """
+        repointed = {}
+        if not chunk_ids and not file_removed:
+            return {"success": True, "deleted_count": 0, "repointed": repointed}
+        try:
+            with self._index_lock:
+                restored = self._ensure_dedupe_state()
+                if file_name is not None and not restored["success"]:
+                    # 没有去重状态时无法知道哪些块记录了其他文件的副本, 删除会丢掉这些内容
+                    raise RuntimeError(restored["error"])
+                updates = {}
+                if self.deduper is not None and file_name is not None:
+                    # 改为归属其他文件的块保留原页的 page_key, 两阶段检索中该页的页向量随原文件删除后,
+                    # 这些块只能通过全量检索命中, 直到副本所在的文件重新加载
+                    for chunk_id, owner in self.deduper.repoint(chunk_ids, file_name).items():
+                        updates[chunk_id] = {"file_name": owner["file_name"], "page_num": owner["page_num"],
+                                             "metadata": {"duplicates": owner["duplicates"]}}
+                        repointed[chunk_id] = owner["file_name"]
+                    if file_removed:
+                        for chunk_id, duplicates in self.deduper.remove_provenance(file_name, chunk_ids).items():
+                            updates[chunk_id] = {"metadata": {"duplicates": duplicates}}
+                    chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in repointed]
+                
+                if self.backend == "local":
+                    self._update_chunk_fields(None, None, updates)
+                    deleted_count = self.local_index.delete(chunk_ids)
+                else:
+                    deleted_count = 0
+                    index_name = self._physical_index()
+                    external_text = is_external_text(self.es, index_name)
+                    self._update_chunk_fields(index_name, get_text_store(index_name) if external_text else None,
+                                              updates)
+                    for i in range(0, len(chunk_ids), BULK_BATCH_SIZE):
+                        response = self.es.delete_by_query(index=index_name, refresh=True,
+                                                           query={"ids": {"values": chunk_ids[i:i + BULK_BATCH_SIZE]}})
+                        deleted_count += response.get("deleted", 0)
+                    delete_page_centroids(self.es, index_name, chunk_ids)
+                    if external_text:
+                        get_text_store(index_name).delete(chunk_ids)
+                    if deleted_count or updates:
+                        bump_index_generation(self.es, index_name)
+                if self.deduper is not None:
+                    self.deduper.forget(chunk_ids)
+            return {"success": True, "deleted_count": deleted_count, "repointed": repointed}
+        except Exception as e:
+            return {"success": False, "error": f"删除失败: {str(e)}"}
+    
     def load_documents_only(self, pdf_paths: List[str], chunk_size: int = 1024) -> Dict[str, Any]:
         """仅加载文档到Elasticsearch，不进行查询
         
@@ -451,6 +1089,7 @@ class RAGPipeline:
             "failed_files": [],
             "total_chunks": 0,
             "total_indexed": 0,
+            "embeddings_saved": 0,
             "total_stats": {"text_pages": 0, "images": 0, "tables": 0}
         }
         
@@ -465,37 +1104,16 @@ class RAGPipeline:
             print("-" * 60)
             
             try:
-                # 步骤2: 处理PDF
-                step2_result = self.step2_process_pdf(pdf_path)
-                if not step2_result["success"]:
-                    error_msg = f"PDF处理失败: {step2_result['error']}"
-                    print(f"❌ {error_msg}")
-                    total_results["failed_files"].append({"file": pdf_path, "error": error_msg})
-                    continue
-                
-                # 步骤3: 切分内容
-                step3_result = self.step3_chunk_content(step2_result["content"], chunk_size)
-                if not step3_result["success"]:
-                    error_msg = f"内容切分失败: {step3_result['error']}"
-                    print(f"❌ {error_msg}")
-                    total_results["failed_files"].append({"file": pdf_path, "error": error_msg})
-                    continue
-                
-                # 步骤4: 向量化
-                step4_result = self.step4_vectorize_content(step3_result["chunks"])
-                if not step4_result["success"]:
-                    error_msg = f"向量化失败: {step4_result['error']}"
-                    print(f"❌ {error_msg}")
-                    total_results["failed_files"].append({"file": pdf_path, "error": error_msg})
-                    continue
-                
-                # 步骤5: 索引
-                step5_result = self.step5_index_to_elasticsearch(step4_result["vectorized_chunks"])
-                if not step5_result["success"]:
-                    error_msg = f"索引失败: {step5_result['error']}"
+                ingest_result = self.ingest_file(pdf_path, chunk_size)
+                if not ingest_result["success"]:
+                    error_msg = ingest_result["error"]
                     print(f"❌ {error_msg}")
                     total_results["failed_files"].append({"file": pdf_path, "error": error_msg})
                     continue
+                step2_result = ingest_result["step2"]
+                step3_result = ingest_result["step3"]
+                step5_result = ingest_result["step5"]
+                dedupe_result = ingest_result["dedupe"]
                 
                 # 成功处理的文件
                 file_result = {
@@ -507,6 +1125,7 @@ class RAGPipeline:
                 total_results["processed_files"].append(file_result)
                 total_results["total_chunks"] += step3_result["total_chunks"]
                 total_results["total_indexed"] += step5_result["indexed_count"]
+                total_results["embeddings_saved"] += dedupe_result["dedupe_stats"].get("embeddings_saved", 0)
                 
                 # 累加统计
                 for key in total_results["total_stats"]:
@@ -537,6 +1156,13 @@ class RAGPipeline:
         print(f"⏱️  总耗时: {execution_time:.2f}秒")
         print(f"📁 处理文件: {len(total_results['processed_files'])}/{len(pdf_paths)}个成功")
         print(f"📇 索引统计: {total_results['total_indexed']}个文档块已加载到 {self.index_name}")
+        if total_results["embeddings_saved"]:
+            print(f"🧬 去重统计: 节省向量和索引条目各{total_results['embeddings_saved']}个")
+        from image_filter import image_filter_stats
+        filter_stats = image_filter_stats()
+        if filter_stats["dropped"]:
+            print(f"🖼️ 装饰性图片过滤: 检查{filter_stats['checked']}张, 丢弃{filter_stats['dropped']}张 "
+                  f"({filter_stats['drop_rate']:.0%}, 节省同样次数的VLM摘要调用)")
         print(f"📄 内容统计: 文本页面{total_results['total_stats']['text_pages']}页, " +
               f"图片{total_results['total_stats']['images']}个, " + 
               f"表格{total_results['total_stats']['tables']}个")
@@ -552,6 +1178,174 @@ class RAGPipeline:
         
         return total_results
 
+    def export_snapshot(self, snapshot_dir: str) -> Dict[str, Any]:
+        """导出当前索引的文本块、元数据和向量到快照目录"""
+        print(f"📦 导出快照到 {snapshot_dir} ...")
+        start_time = time.time()
+        try:
+            step1_result = self.step1_deploy_elasticsearch()
+            if not step1_result["success"]:
+                return {"success": False, "error": step1_result["error"]}
+            if self.backend == "local":
+                manifest = export_local_snapshot(self.local_index, snapshot_dir)
+            else:
+                manifest = export_es_snapshot(self.es, self._physical_index(), snapshot_dir)
+            execution_time = time.time() - start_time
+            print(f"✅ 快照导出完成: {manifest['count']}个块, {len(manifest['shards'])}个分片, 耗时{execution_time:.2f}秒")
+            return {"success": True, "count": manifest["count"], "execution_time": execution_time}
+        except Exception as e:
+            return {"success": False, "error": f"快照导出失败: {str(e)}"}
+    
+    def import_snapshot(self, snapshot_dir: str) -> Dict[str, Any]:
+        """从快照目录批量加载到索引, 跳过PDF解析、图片/表格摘要和向量化"""
+        print(f"📦 从快照 {snapshot_dir} 导入到 {self.index_name} ...")
+        start_time = time.time()
+        try:
+            if self.backend == "local":
+                self.local_index = get_local_index(self.local_index_dir, self.local_vector_dtype)
+                result = import_local_snapshot(self.local_index, snapshot_dir)
+            else:
+                self.es = get_es()
+                result = import_es_snapshot(self.es, snapshot_dir, self._physical_index(), self.vector_index_type,
+                                            self.external_text)
+            execution_time = time.time() - start_time
+            print(f"✅ 快照导入完成: 成功{result['indexed']}/{result['total']}个块, 失败{result['failed']}个, "
+                  f"耗时{execution_time:.2f}秒 ({result['indexed'] / max(execution_time, 1e-6):.0f} 块/秒)")
+            return {"success": result["failed"] == 0, **result, "execution_time": execution_time,
+                    "error": f"{result['failed']}个块写入失败" if result["failed"] else None}
+        except Exception as e:
+            return {"success": False, "error": f"快照导入失败: {str(e)}"}
+    
+    def _physical_index(self) -> str:
+        """写入使用的实际索引: index_name 为别名时解析为它当前指向的版本, 索引不存在时原样返回"""
+        if not self.es:
+            self.es = get_es()
+        if not self.es.indices.exists(index=self.index_name):
+            return self.index_name
+        return resolve_index(self.es, self.index_name)
+    
+    def _smoke_check(self, index_name: str, smoke_queries: Optional[List[str]] = None) -> Dict[str, Any]:
+        """新版本切换前的冒烟检查
+        
+        给定问题时每个问题都必须有检索结果; 否则抽样若干块, 用块正文的开头检索, 该块应出现在前10个结果中
+        """
+        document_count = self.es.count(index=index_name).get("count", 0)
+        if not document_count:
+            return {"success": False, "error": f"新版本 {index_name} 中没有文档"}
+        
+        if smoke_queries:
+            empty = [query for query in smoke_queries
+                     if not elastic_search(query, index_name, use_cache=False, top_k=1)]
+            if empty:
+                return {"success": False, "error": f"{len(empty)}/{len(smoke_queries)}个检查问题没有结果: {empty[:3]}"}
+            return {"success": True, "document_count": document_count, "queries": len(smoke_queries)}
+        
+        sample = self.es.search(index=index_name, size=REBUILD_SMOKE_SAMPLES, source=False,
+                                query={"function_score": {"random_score": {"seed": 42, "field": "_seq_no"}}})
+        sample_ids = [hit["_id"] for hit in sample["hits"]["hits"]]
+        texts = {}
+        if is_external_text(self.es, index_name):
+            texts = {chunk_id: text for chunk_id, (text, _) in get_text_store(index_name).get_many(sample_ids).items()}
+        else:
+            docs = self.es.mget(index=index_name, ids=sample_ids, source=["text"])["docs"]
+            texts = {doc["_id"]: doc["_source"].get("text") for doc in docs if doc.get("found")}
+        hits = 0
+        for chunk_id in sample_ids:
+            text = (texts.get(chunk_id) or "").strip()[:200]
+            results = elastic_search(text, index_name, use_cache=False, top_k=10) if text else []
+            hits += any(r["id"] == chunk_id for r in results)
+        hit_rate = hits / max(len(sample_ids), 1)
+        if hit_rate < REBUILD_SMOKE_MIN_HIT_RATE:
+            return {"success": False, "error": f"自检索命中率 {hit_rate:.0%} 低于 {REBUILD_SMOKE_MIN_HIT_RATE:.0%}"}
+        return {"success": True, "document_count": document_count, "hit_rate": hit_rate}
+    
+    def rebuild_index(self, pdf_paths: Optional[List[str]] = None, snapshot_dir: Optional[str] = None,
+                      chunk_size: int = 1024, smoke_queries: Optional[List[str]] = None,
+                      keep_versions: Optional[int] = None) -> Dict[str, Any]:
+        """蓝绿重建: 在新版本 <index_name>_v<N> 中完整构建, 冒烟检查通过后把别名 index_name 原子切换到新版本
+        
+        构建期间查询通过别名继续读取旧版本; 构建失败或检查不通过时别名不变, 新版本保留以便排查。
+        更换嵌入模型、切分大小或mapping时使用, 不再需要先删除索引。
+        构建期间写入旧版本的增量 (监听、ingest_file、delete_chunks) 不会进入新版本: 切换前旧版本的
+        数据版本号发生变化时拒绝切换, 需要在写入停止后重新执行重建。
+        
+        Args:
+            pdf_paths: 重新解析加载的PDF文件 (与 snapshot_dir 二选一)
+            snapshot_dir: 从快照导入, 跳过解析和向量化
+            chunk_size: 文档分块大小
+            smoke_queries: 冒烟检查使用的问题, 默认抽样块做自检索
+            keep_versions: 切换后保留的旧版本数，默认读取配置
+        """
+        if self.backend == "local":
+            return {"success": False, "error": "蓝绿重建仅支持ES后端"}
+        if not pdf_paths and not snapshot_dir:
+            return {"success": False, "error": "需要指定PDF文件或快照目录"}
+        keep_versions = INDEX_KEEP_VERSIONS if keep_versions is None else keep_versions
+        start_time = time.time()
+        self.es = get_es()
+        new_index = next_index_version(self.es, self.index_name)
+        # 旧版本的数据版本号, 每次写入都会变化, 切换前用来检测构建期间的写入
+        old_generation = get_index_generation(self.es, self.index_name) \
+            if self.es.indices.exists(index=self.index_name) else None
+        print(f"🔁 蓝绿重建: {self.index_name} -> {new_index} (构建期间查询继续使用当前版本)")
+        
+        # 新版本使用独立的流水线实例, 去重状态从空开始, 不影响当前实例的查询
+        builder = RAGPipeline(new_index, vector_index_type=self.vector_index_type,
+                              rescore_oversample=self.rescore_oversample, answer_cache=False,
+                              artifact_cache=self.artifact_cache is not None, dedupe=self.deduper is not None,
+                              parse_workers=self.parse_workers, two_stage=self.two_stage,
+                              page_top_k=self.page_top_k, external_text=self.external_text)
+        # 逐文件的refresh会抵消构建期间的 refresh_interval -1, 新版本在冒烟检查前统一refresh一次
+        builder.bump_generation = False
+        try:
+            if snapshot_dir:
+                build_result = builder.import_snapshot(snapshot_dir)
+            else:
+                create_elastic_index(new_index, self.vector_index_type, self.external_text)
+                settings = self.es.indices.get_settings(index=new_index)[new_index]["settings"]["index"]
+                original = {"refresh_interval": settings.get("refresh_interval"),
+                            "number_of_replicas": settings.get("number_of_replicas", "1")}
+                # 构建期间关闭refresh和副本, 加快写入, 也不占用线上查询的资源
+                self.es.indices.put_settings(index=new_index,
+                                             settings={"refresh_interval": "-1", "number_of_replicas": 0})
+                try:
+                    build_result = builder.load_documents_only(pdf_paths, chunk_size)
+                finally:
+                    self.es.indices.put_settings(index=new_index, settings=original)
+                if build_result.get("success") and not build_result["processed_files"]:
+                    build_result = {"success": False, "error": "没有成功加载的文件"}
+                if build_result.get("success"):
+                    bump_index_generation(self.es, new_index)
+            if not build_result.get("success"):
+                return {"success": False, "index": new_index,
+                        "error": f"新版本构建失败, 别名未切换: {build_result.get('error')}"}
+            
+            print(f"🔎 冒烟检查 {new_index} ...")
+            smoke_result = self._smoke_check(new_index, smoke_queries)
+            if not smoke_result["success"]:
+                return {"success": False, "index": new_index,
+                        "error": f"冒烟检查未通过, 别名未切换: {smoke_result['error']}"}
+            
+            # 持有写入锁完成检查和切换, 当前进程中的写入不会落在两者之间
+            with self._index_lock:
+                if old_generation is not None and get_index_generation(self.es, self.index_name) != old_generation:
+                    return {"success": False, "index": new_index,
+                            "error": "构建期间旧版本有新的写入, 这些写入不在新版本中, 别名未切换; "
+                                     "请停止写入 (如 --watch) 后重新执行重建"}
+                previous = get_alias_targets(self.es, self.index_name)
+                swap_alias(self.es, self.index_name, new_index)
+            removed = gc_index_versions(self.es, self.index_name, keep=keep_versions)
+        except Exception as e:
+            return {"success": False, "index": new_index, "error": f"蓝绿重建失败, 别名未切换: {str(e)}"}
+        
+        execution_time = time.time() - start_time
+        print(f"✅ 别名 {self.index_name} 已切换到 {new_index} (文档 {smoke_result['document_count']} 个, "
+              f"耗时{execution_time:.2f}秒)")
+        if removed:
+            print(f"🗑️ 已删除旧版本: {', '.join(removed)}")
+        return {"success": True, "index": new_index, "previous": previous, "removed": removed,
+                "smoke_check": smoke_result, "execution_time": execution_time}
+    
     def run_complete_pipeline(self, pdf_path: str, query: str, 
                             chunk_size: int = 1024, top_k: int = 10) -> Dict[str, Any]:
         """运行完整的RAG流水线"""
@@ -579,35 +1373,28 @@ class RAGPipeline:
             return {"success": False, "error": f"步骤3失败: {step3_result['error']}"}
         results.update(step3_result)
         
+        # 去除近似重复的块
+        dedupe_result = self.dedupe_chunks(step3_result["chunks"])
+        results["dedupe_stats"] = dedupe_result["dedupe_stats"]
+        
         # 步骤4: 向量化
-        step4_result = self.step4_vectorize_content(step3_result["chunks"])
+        step4_result = self.step4_vectorize_content(dedupe_result["chunks"])
         if not step4_result["success"]:
             return {"success": False, "error": f"步骤4失败: {step4_result['error']}"}
         results.update(step4_result)
         
         # 步骤5: 索引
-        step5_result = self.step5_index_to_elasticsearch(step4_result["vectorized_chunks"])
+        step5_result = self.step5_index_to_elasticsearch(step4_result["vectorized_chunks"],
+                                                         dedupe_result["provenance_updates"])
         if not step5_result["success"]:
             return {"success": False, "error": f"步骤5失败: {step5_result['error']}"}
         results.update(step5_result)
         
-        # 步骤6: 混合搜索
-        step6_result = self.step6_hybrid_search(query, top_k)
-        if not step6_result["success"]:
-            return {"success": False, "error": f"步骤6失败: {step6_result['error']}"}
-        results.update(step6_result)
-        
-        # 步骤7: 重排序
-        step7_result = self.step7_rerank_results(query, step6_result["search_results"])
-        if not step7_result["success"]:
-            return {"success": False, "error": f"步骤7失败: {step7_result['error']}"}
-        results.update(step7_result)
-        
-        # 步骤8: 生成答案
-        step8_result = self.step8_generate_answer(query, step7_result["reranked_results"])
-        if not step8_result["success"]:
-            return {"success": False, "error": f"步骤8失败: {step8_result['error']}"}
-        results.update(step8_result)
+        # 步骤6-8: 检索、重排序、生成答案
+        answer_result = self.answer_query(query, top_k)
+        if not answer_result["success"]:
+            return answer_result
+        results.update(answer_result)
         
         end_time = time.time()
         execution_time = end_time - start_time
@@ -630,7 +1417,7 @@ class RAGPipeline:
         print("\n" + "=" * 60)
         print("💬 进入交互式问答模式")
         print("输入问题开始对话，输入 'quit' 或 'exit' 退出")
-        print("输入 'history' 查看对话历史")
+        print("输入 'history' 查看对话历史，输入 'stats' 查看缓存命中率和对话记忆")
         print("=" * 60)
         
         while True:
@@ -643,6 +1430,7 @@ class RAGPipeline:
                 
                 # 退出命令
                 if user_input.lower() in ['quit', 'exit', '退出', 'q']:
+                    self._show_cache_stats()
                     print("👋 再见!")
                     break
                 
@@ -651,36 +1439,43 @@ class RAGPipeline:
                     self._show_chat_history()
                     continue
                 
+                # 查看缓存统计
+                if user_input.lower() in ['stats', '统计']:
+                    self._show_cache_stats()
+                    continue
+                
                 print(f"\n🔍 正在处理问题: {user_input}")
                 
+                # 时间预算从收到问题开始计算, 包含指代消解
+                deadline = self.new_deadline()
+                
                 # 指代消解（如果有历史对话）
                 query = user_input
-                if self.chat_history:
+                if self.memory and not deadline.allows("coreference"):
+                    deadline.degrade("coreference", "时间预算不足, 使用原问题")
+                elif self.memory:
                     try:
-                        resolved_queries = coreference_resolution(user_input, self.chat_history)
+                        history = self.memory.render()
+                        memory_stats = self.memory.stats()
+                        print(f"🧠 对话记忆: {memory_stats['rendered_tokens']} tokens "
+                              f"(完整历史 {memory_stats['raw_tokens']} tokens, 累计节省 {memory_stats['tokens_saved']})")
+                        resolved_queries = coreference_resolution(user_input, history, timeout=deadline.timeout())
                         if resolved_queries and len(resolved_queries) > 0:
                             query = resolved_queries[0]
                             if query != user_input:
                                 print(f"📝 指代消解: {query}")
                     except Exception as e:
                         print(f"⚠️ 指代消解失败: {e}")
+                        if deadline.enabled:
+                            deadline.degrade("coreference", "指代消解超时或失败, 使用原问题")
                 
                 # 执行搜索和回答
                 start_time = time.time()
                 
-                # 步骤6: 混合搜索
-                step6_result = self.step6_hybrid_search(query, 10)
-                if not step6_result["success"]:
-                    print(f"❌ 搜索失败: {step6_result['error']}")
-                    continue
-                
-                # 步骤7: 重排序
-                step7_result = self.step7_rerank_results(query, step6_result["search_results"])
-                
-                # 步骤8: 生成答案
-                step8_result = self.step8_generate_answer(query, step7_result["reranked_results"])
+                # 步骤6-8: 检索、重排序、生成答案 (语义缓存命中时直接返回)
+                step8_result = self.answer_query(query, 10, deadline=deadline)
                 if not step8_result["success"]:
-                    print(f"❌ 答案生成失败: {step8_result['error']}")
+                    print(f"❌ 回答失败: {step8_result['error']}")
                     continue
                 
                 end_time = time.time()
@@ -695,15 +1490,23 @@ class RAGPipeline:
                 if step8_result.get("citations"):
                     print("\n📚 引用来源:")
                     for citation in step8_result["citations"]:
-                        print(f"  [引用{citation['id']}] 第{citation['page']}页 ({citation['type']})")
+                        source = f" [{citation['index']}]" if citation.get("index") else ""
+                        print(f"  [引用{citation['id']}] {citation_location(citation)} ({citation['type']}){source}")
                         print(f"    内容: {citation['content']}")
+                        if citation.get("also_in"):
+                            also_in = "、".join(f"{d['file_name']} 第{d['page_num']}页" for d in citation["also_in"])
+                            print(f"    相同内容还出现在: {also_in}")
                 
+                if step8_result.get("degraded"):
+                    stages = "、".join(d["stage"] for d in step8_result["degraded"])
+                    print(f"\n⏳ 时间预算 {deadline.budget}秒内降级的阶段: {stages}")
                 print(f"\n⏱️ 响应时间: {end_time - start_time:.2f}秒")
                 print("=" * 50)
                 
-                # 保存到历史
+                # 保存到历史, 较早的轮次在后台压缩为摘要
                 self.chat_history.append(f"user: {user_input}")
                 self.chat_history.append(f"assistant: {step8_result['answer']}")
+                self.memory.add_turn(user_input, step8_result["answer"])
                 
                 # 限制历史长度
                 if len(self.chat_history) > 20:
@@ -716,6 +1519,38 @@ class RAGPipeline:
                 print(f"❌ 处理错误: {e}")
                 traceback.print_exc()
     
+    def _show_cache_stats(self):
+        """显示语义答案缓存命中率、重排序门控和对话记忆节省的token"""
+        if self.answer_cache is None:
+            print("📝 语义答案缓存未启用")
+        else:
+            stats = self.answer_cache.stats()
+            print(f"📊 语义答案缓存: 查询{stats['lookups']}次, 命中{stats['hits']}次, "
+                  f"命中率{stats['hit_rate']:.1%}, 缓存条目{stats['size']}个 (阈值{stats['threshold']})")
+        stats = self.rerank_stats
+        if stats["queries"]:
+            print(f"🎯 重排序门控: {stats['queries']}次查询, 跳过{stats['skip']}次, 窗口重排{stats['window']}次, "
+                  f"全部重排{stats['full']}次, 送入rerank的文档{stats['docs_reranked']}/{stats['docs_total']}")
+        batch_stats = query_batcher_stats()
+        if batch_stats and batch_stats["batches"]:
+            delay = batch_stats["queue_delay_ms"]
+            sizes = ", ".join(f"{size}条×{count}" for size, count in batch_stats["batch_sizes"].items())
+            print(f"📦 查询向量微批: {batch_stats['requests']}次请求合并为{batch_stats['batches']}批 "
+                  f"(平均{batch_stats['mean_batch_size']:.1f}条, 分布 {sizes}), "
+                  f"排队延迟 p50 {delay['p50']:.1f}ms / p95 {delay['p95']:.1f}ms")
+        for name, hedge_stats in hedging_stats().items():
+            if hedge_stats["calls"]:
+                print(f"🔀 对冲请求 {name}: {hedge_stats['calls']}次调用, 对冲{hedge_stats['hedged']}次 "
+                      f"(额外负载{hedge_stats['extra_load']:.1%}, 对冲请求先返回{hedge_stats['hedge_wins']}次, "
+                      f"预算不足{hedge_stats['budget_denied']}次), 当前对冲延迟 {hedge_stats['hedge_delay_ms']}ms")
+        web_stats = web_search_stats()
+        if web_stats["requests"] or web_stats["cache"]["hits"]:
+            print(f"🌐 网络搜索: 请求{web_stats['requests']}次, 失败{web_stats['errors']}次, "
+                  f"缓存命中{web_stats['cache']['hits']}次, 过期{web_stats['expired']}次")
+        memory_stats = self.memory.stats()
+        print(f"🧠 对话记忆: 原文{memory_stats['recent_turns']}轮, 摘要实体{memory_stats['summarized_entities']}个, "
+              f"累计节省{memory_stats['tokens_saved']} tokens")
+    
     def _show_chat_history(self):
         """显示聊天历史"""
         if not self.chat_history:
@@ -753,13 +1588,139 @@ def main():
                        help="检索结果数量")
     parser.add_argument("--interactive", action="store_true", 
                        help="进入交互式模式")
+    parser.add_argument("--vector-index-type", type=str, choices=VECTOR_INDEX_TYPES, default=None,
+                       help="新建索引的向量存储布局 (默认hnsw即float32, 量化可选int8_hnsw/int4_hnsw/bbq_hnsw)")
+    parser.add_argument("--rescore-oversample", type=float, default=None,
+                       help="量化索引的全精度重打分候选倍数 (0表示关闭)")
+    parser.add_argument("--backend", type=str, choices=["es", "local"], default="es",
+                       help="检索后端: es 使用Elasticsearch, local 使用本地嵌入式索引 (无需ES)")
+    parser.add_argument("--local-index-dir", type=str, default=None,
+                       help="本地索引目录 (默认 local_index/<index-name>)")
+    parser.add_argument("--local-vector-dtype", type=str, choices=["float32", "int8"], default="float32",
+                       help="本地索引的向量存储类型")
+    parser.add_argument("--no-answer-cache", action="store_true",
+                       help="关闭语义答案缓存")
+    parser.add_argument("--export-snapshot", type=str, metavar="DIR",
+                       help="把索引中的文本块、元数据和向量导出为快照目录")
+    parser.add_argument("--import-snapshot", type=str, metavar="DIR",
+                       help="从快照目录批量加载到索引 (无需重新解析PDF和向量化)")
+    parser.add_argument("--no-artifact-cache", action="store_true",
+                       help="关闭图片/表格提取结果缓存, 强制重新调用VLM和LLM")
+    parser.add_argument("--no-dedupe", action="store_true",
+                       help="关闭向量化之前的近似重复块去重")
+    parser.add_argument("--watch", action="store_true",
+                       help="持续监听 --pdf-dir 目录, 增量加载新增、修改和删除的PDF")
+    parser.add_argument("--watch-interval", type=float, default=2.0,
+                       help="监听模式的目录扫描间隔(秒)")
+    parser.add_argument("--watch-debounce", type=float, default=5.0,
+                       help="文件大小和修改时间保持不变多少秒后开始加载")
+    parser.add_argument("--watch-workers", type=int, default=2,
+                       help="监听模式下同时处理的文件数")
+    parser.add_argument("--watch-status-file", type=str, default=None,
+                       help="监听进度状态文件 (默认 <pdf-dir>/.rag_watch_<index-name>.status.json)")
+    parser.add_argument("--no-rerank-gate", action="store_true",
+                       help="关闭重排序门控, 每次都对全部结果调用rerank")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                       help="解析单个PDF的进程数 (默认CPU核数, 页数较少时自动减少)")
+    parser.add_argument("--two-stage", action="store_true", default=None,
+                       help="两阶段检索: 先在页索引上选出最相关的页, 再只在这些页的块中做向量检索")
+    parser.add_argument("--page-top-k", type=int, default=None,
+                       help="两阶段检索第一阶段选出的页数")
+    parser.add_argument("--search-indices", type=str, nargs="+", default=None,
+                       help="查询时联合检索的多个索引或别名 (默认只检索 --index-name)")
+    parser.add_argument("--filter-content-type", type=str, nargs="+", choices=["text", "image", "table"], default=None,
+                       help="只检索指定类型的块")
+    parser.add_argument("--filter-file", type=str, nargs="+", default=None,
+                       help="只检索指定文件名的块")
+    parser.add_argument("--filter-pages", type=str, default=None, metavar="START-END",
+                       help="只检索指定页码范围的块, 如 10-50 (闭区间, 可省略一端: 10- 或 -50)")
+    parser.add_argument("--external-text", action="store_true",
+                       help="新建索引使用文本分离布局: 正文存入本地SQLite, ES只保存可检索字段和向量")
+    parser.add_argument("--deadline", type=float, default=None, metavar="SECONDS",
+                       help="单次查询的时间预算(秒), 时间不足时跳过指代消解、问题改写、重排序等可选阶段 (默认读取配置, 0为不限时)")
+    parser.add_argument("--rag-fusion", action="store_true",
+                       help="步骤6额外检索LLM改写的问题并做RRF融合")
+    parser.add_argument("--web-search", action="store_true", default=None,
+                       help="步骤6并发执行网络搜索，结果与文档检索结果一起融合")
+    parser.add_argument("--rebuild", action="store_true",
+                       help="蓝绿重建: 用 --pdf/--pdf-dir 或 --import-snapshot 构建新版本, 检查通过后把 --index-name 别名切换过去")
+    parser.add_argument("--smoke-queries-file", type=str, default=None,
+                       help="重建后冒烟检查使用的问题文件 (每行一个), 默认抽样块做自检索")
+    parser.add_argument("--keep-versions", type=int, default=None,
+                       help="重建切换后保留的旧版本数 (默认读取配置 INDEX_KEEP_VERSIONS)")
     
     args = parser.parse_args()
     
+    search_filters = {}
+    if args.filter_content_type:
+        search_filters["content_type"] = args.filter_content_type
+    if args.filter_file:
+        search_filters["file_name"] = args.filter_file
+    if args.filter_pages:
+        start, sep, end = args.filter_pages.partition("-")
+        if not sep:
+            end = start  # 单页
+        search_filters["page_num"] = [int(start) if start else None, int(end) if end else None]
+    
     # 创建流水线实例
-    pipeline = RAGPipeline(args.index_name)
+    pipeline = RAGPipeline(args.index_name, vector_index_type=args.vector_index_type,
+                           rescore_oversample=args.rescore_oversample, backend=args.backend,
+                           local_index_dir=args.local_index_dir, local_vector_dtype=args.local_vector_dtype,
+                           answer_cache=not args.no_answer_cache, artifact_cache=not args.no_artifact_cache,
+                           dedupe=not args.no_dedupe, parse_workers=args.parse_workers,
+                           rerank_gate=not args.no_rerank_gate, two_stage=args.two_stage,
+                           page_top_k=args.page_top_k, external_text=args.external_text,
+                           search_indices=args.search_indices, search_filters=search_filters or None,
+                           query_deadline=args.deadline, use_rag_fusion=args.rag_fusion,
+                           use_web_search=args.web_search)
+    
+    if args.rebuild and args.watch:
+        # 重建期间监听写入的增量只进入旧版本, 切换时会被拒绝
+        print("❌ --rebuild 不能与 --watch 同时使用, 请先停止监听再重建")
+        return
+    
+    if args.rebuild:
+        # 蓝绿重建模式
+        pdf_paths = [args.pdf] if args.pdf else []
+        if args.pdf_dir:
+            pdf_paths.extend(glob.glob(os.path.join(args.pdf_dir, "*.pdf")))
+        smoke_queries = None
+        if args.smoke_queries_file:
+            with open(args.smoke_queries_file, encoding="utf-8") as f:
+                smoke_queries = [line.strip() for line in f if line.strip()]
+        result = pipeline.rebuild_index(pdf_paths=pdf_paths, snapshot_dir=args.import_snapshot,
+                                        chunk_size=args.chunk_size, smoke_queries=smoke_queries,
+                                        keep_versions=args.keep_versions)
+        if not result["success"]:
+            print(f"❌ {result['error']}")
     
-    if args.interactive:
+    elif args.export_snapshot:
+        # 快照导出模式
+        result = pipeline.export_snapshot(args.export_snapshot)
+        if not result["success"]:
+            print(f"❌ {result['error']}")
+    
+    elif args.import_snapshot:
+        # 快照导入模式
+        result = pipeline.import_snapshot(args.import_snapshot)
+        if not result["success"]:
+            print(f"❌ {result['error']}")
+    
+    elif args.watch:
+        # 目录监听模式
+        if not args.pdf_dir or not os.path.isdir(args.pdf_dir):
+            print("❌ 监听模式需要通过 --pdf-dir 指定已存在的目录")
+            return
+        step1_result = pipeline.step1_deploy_elasticsearch()
+        if not step1_result["success"]:
+            print(f"❌ Elasticsearch连接失败: {step1_result['error']}")
+            return
+        watcher = PDFDirectoryWatcher(pipeline, args.pdf_dir, chunk_size=args.chunk_size,
+                                      poll_interval=args.watch_interval, debounce=args.watch_debounce,
+                                      max_workers=args.watch_workers, status_path=args.watch_status_file)
+        watcher.run()
+    
+    elif args.interactive:
         # 交互式模式
         print("🤖 PDF RAG流水线 - 交互式模式")
         
@@ -823,6 +1784,13 @@ def main():
             print("💡 建议操作:")
             print(f"   python pipeline.py --pdf document.pdf --load-only --index-name {args.index_name}")
         
+        if args.backend == "es":
+            es_stats = get_es_stats()
+            print(f"\n🔌 连接状态: 熔断器 {es_stats['breaker_state']} (累计熔断{es_stats['breaker_trips']}次)")
+            for node_url, node_stats in es_stats["nodes"].items():
+                print(f"   {node_url}: 请求{node_stats['requests']}次, 失败{node_stats['failures']}次, "
+                      f"平均{node_stats['avg_ms']:.1f}ms, 连接{node_stats['open_connections']}/{node_stats['pool_size']}")
+        
     elif args.load_only:
         # 仅加载模式
         pdf_paths = []
@@ -871,7 +1839,8 @@ def main():
             if result.get("citations"):
                 print("\n📚 引用来源:")
                 for citation in result["citations"]:
-                    print(f"  [引用{citation['id']}] 第{citation['page']}页 ({citation['type']})")
+                    source = f" [{citation['index']}]" if citation.get("index") else ""
+                    print(f"  [引用{citation['id']}] {citation_location(citation)} ({citation['type']}){source}")
             
             print(f"\n📊 统计信息:")
             print(f"  - 处理文档块: {result.get('total_chunks', 0)}")
@@ -881,6 +1850,32 @@ def main():
         else:
             print(f"❌ 流水线执行失败: {result['error']}")
     
+    elif args.query:
+        # 单次查询模式: 直接查询已建好的索引
+        if args.backend == "es":
+            step1_result = pipeline.step1_deploy_elasticsearch()
+            if not step1_result["success"]:
+                print(f"❌ Elasticsearch连接失败: {step1_result['error']}")
+                return
+        start_time = time.time()
+        result = pipeline.answer_query(args.query, args.top_k)
+        if not result["success"]:
+            print(f"❌ 回答失败: {result['error']}")
+            return
+        print("\n" + "=" * 60)
+        print("🤖 最终答案:")
+        print("=" * 60)
+        print(result["answer"])
+        if result.get("citations"):
+            print("\n📚 引用来源:")
+            for citation in result["citations"]:
+                source = f" [{citation['index']}]" if citation.get("index") else ""
+                print(f"  [引用{citation['id']}] {citation_location(citation)} ({citation['type']}){source}")
+        if result.get("degraded"):
+            stages = ", ".join(item["stage"] for item in result["degraded"])
+            print(f"\n⏳ 时间预算内降级的阶段: {stages}")
+        print(f"\n⏱️ 响应时间: {time.time() - start_time:.2f}秒")
+    
     else:
         # 显示帮助
         parser.print_help()
@@ -891,6 +1886,9 @@ def main():
         print("  # 完整流水线 (处理+查询)")
         print("  python pipeline.py --pdf document.pdf --query '什么是机器学习？'")
         print("")
+        print("  # 查询已建好的索引")
+        print("  python pipeline.py --query '什么是机器学习？'")
+        print("")
         print("  # 仅加载单个文档")
         print("  python pipeline.py --pdf document.pdf --load-only")
         print("")
@@ -902,6 +1900,10 @@ def main():
         print("")
         print("  # 交互式查询模式 (需要先有文档)")
         print("  python pipeline.py --interactive")
+        print("")
+        print("  # 导出快照 / 从快照重建索引")
+        print("  python pipeline.py --export-snapshot snapshots/docs_v1")
+        print("  python pipeline.py --import-snapshot snapshots/docs_v1 --index-name docs_test")
 
 
 if __name__ == "__main__":
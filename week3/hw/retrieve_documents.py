@@ -1,16 +1,162 @@
+import copy
 import json
-from openai import OpenAI
-from config import get_es, OPENAI_API_KEY
-from embedding import local_embedding
-import jieba
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import get_es, budget_client, OPENAI_API_KEY
+from embedding import embed_query
+from cache import LRUCache, normalize_query
 import re
 import requests
-from config import RERANK_URL
-def elastic_search(text, es_index):
+from config import RERANK_URL, VECTOR_RESCORE_OVERSAMPLE, VECTOR_NUM_CANDIDATES, SEARCH_RESULT_CACHE_SIZE
+from config import RERANK_GATE_MIN_OVERLAP, RERANK_GATE_MIN_MARGIN, RERANK_GATE_WINDOW
+from config import TWO_STAGE_RETRIEVAL, COARSE_PAGE_TOP_K, FEDERATED_INDEX_TIMEOUT, FEDERATED_MAX_WORKERS
+from es_functions import get_vector_index_type, is_external_text, resolve_index_generation
+from page_index import select_pages
+from text_store import get_text_store
+from hedging import hedged
+
+# 融合后的检索结果缓存, 键为 (索引名, 归一化查询, 索引版本号, 重打分参数, 两阶段参数, 过滤条件)
+_search_result_cache = LRUCache(SEARCH_RESULT_CACHE_SIZE)
+
+# 支持过滤的字段: 精确匹配 (值或值列表) 和整数范围 ([下限, 上限], 闭区间, 任一端可为None)
+FILTER_KEYWORD_FIELDS = ("file_name", "content_type", "doc_type", "language")
+FILTER_RANGE_FIELDS = ("page_num",)
+# 页索引只有文件名和页码
+PAGE_FILTER_FIELDS = ("file_name", "page_num")
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+def _as_range(value):
+    if isinstance(value, (list, tuple)):
+        low, high = value
+        return low, high
+    return value, value
+
+def build_es_filter(filters, fields=None):
+    """把 {"content_type": "table", "file_name": [...], "page_num": [10, 50]} 转为ES过滤条件, 没有条件时返回None"""
+    clauses = []
+    for field, value in (filters or {}).items():
+        if value is None or (fields is not None and field not in fields):
+            continue
+        if field in FILTER_KEYWORD_FIELDS:
+            clauses.append({"terms": {field: _as_list(value)}})
+        elif field in FILTER_RANGE_FIELDS:
+            low, high = _as_range(value)
+            bounds = {k: v for k, v in (("gte", low), ("lte", high)) if v is not None}
+            if bounds:
+                clauses.append({"range": {field: bounds}})
+        else:
+            raise ValueError(f"Unsupported filter field: {field}")
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"bool": {"filter": clauses}}
+
+def match_filters(source, filters):
+    """本地后端使用: 文档字段是否满足过滤条件, 语义与 build_es_filter 相同"""
+    for field, value in (filters or {}).items():
+        if value is None:
+            continue
+        if field in FILTER_KEYWORD_FIELDS:
+            if source.get(field) not in _as_list(value):
+                return False
+        elif field in FILTER_RANGE_FIELDS:
+            low, high = _as_range(value)
+            actual = source.get(field)
+            if actual is None or (low is not None and actual < low) or (high is not None and actual > high):
+                return False
+        else:
+            raise ValueError(f"Unsupported filter field: {field}")
+    return True
+
+def filters_key(filters):
+    """过滤条件的规范化字符串, 用作缓存键"""
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False) if filters else None
+
+def _and_filters(*filters):
+    clauses = [f for f in filters if f is not None]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"bool": {"filter": clauses}}
+
+def elastic_search(text, es_index, rescore_oversample=None, use_cache=True, two_stage=None, page_top_k=None,
+                   top_k=None, filters=None, timeout=None):
+    """BM25 + 向量检索, RRF融合
+
+    two_stage: 先在页索引上选出 page_top_k 个页, 向量检索只在这些页的块中进行;
+    BM25本身走倒排索引, 仍在全部块上检索, 作为粗排漏掉相关页时的兜底。默认读取配置
+    top_k: 只返回前top_k个结果; 文本分离布局的索引只为返回的结果从本地取回正文
+    filters: 元数据过滤条件 (见 build_es_filter), 在BM25和kNN打分之前过滤, 例如只检索表格或某个文件的10-50页
+    timeout: 每个ES请求和查询向量的超时(秒), 用于查询的时间预算; 超时抛出异常而不是返回部分分片的结果, 检索缓存不会存入不完整的结果
+    """
     es=get_es()
-    key_words = get_keyword(text)
+    client = budget_client(es, timeout)
+    # 别名先解析为当前版本的实际索引, 蓝绿切换后页索引、TextStore和mapping缓存都跟着切换;
+    # 检索缓存使用的版本号来自同一次get_mapping
+    es_index, generation = resolve_index_generation(client, es_index)
+    results = _fused_search(client, text, es_index, rescore_oversample, use_cache, two_stage, page_top_k, filters,
+                            timeout, generation)
+    if top_k is not None:
+        results = results[:top_k]
+    if is_external_text(es, es_index):
+        get_text_store(es_index).hydrate(results)
+    return results
+
+def _fused_search(es, text, es_index, rescore_oversample, use_cache, two_stage, page_top_k, filters, timeout=None,
+                  generation=None):
+    if two_stage is None:
+        two_stage = TWO_STAGE_RETRIEVAL
+    page_top_k = page_top_k or COARSE_PAGE_TOP_K
+    cache_key = None
+    if use_cache:
+        cache_key = (es_index, normalize_query(text), generation, rescore_oversample,
+                     page_top_k if two_stage else None, filters_key(filters))
+        cached = _search_result_cache.get(cache_key)
+        if cached is not None:
+            # 下游rerank会原地修改结果, 返回副本
+            return copy.deepcopy(cached)
+
+    metadata_filter = build_es_filter(filters)
+    keyword_hits = keyword_search(es, es_index, get_keyword(text), filter=metadata_filter)
+    # print(keyword_hits)
+    # keyword_hits = [] #test vector search
 
+    query_vector = embed_query(text, timeout)
+    page_filter = _page_filter(es, es_index, query_vector, two_stage, page_top_k, filters)
+    vector_hits = vector_search(es, es_index, query_vector, rescore_oversample=rescore_oversample,
+                                filter=_and_filters(metadata_filter, page_filter))
+    
+    # print(vector_hits)
+    combined_results = hybrid_search_rrf(keyword_hits, vector_hits)
+    # print(combined_results)
+    if cache_key is not None:
+        _search_result_cache.put(cache_key, copy.deepcopy(combined_results))
+    return combined_results
 
+def _page_filter(es, es_index, query_vector, two_stage, page_top_k, filters=None):
+    """两阶段检索的第一阶段, 返回第二阶段向量检索的过滤条件 (不启用或没有页索引时为None)"""
+    if not two_stage:
+        return None
+    page_keys = select_pages(es, es_index, query_vector, page_top_k,
+                             filter=build_es_filter(filters, PAGE_FILTER_FIELDS))
+    return {"terms": {"page_key": page_keys}} if page_keys else None
+
+def _hit_metadata(source):
+    # 页码、类型和文件名是顶层字段, 与本地后端一致地放入metadata供步骤8引用
+    metadata = dict(source.get('metadata') or {})
+    for field in ('page_num', 'content_type', 'file_name'):
+        if source.get(field) is not None:
+            metadata.setdefault(field, source[field])
+    return metadata
+
+def _hits(res, size=None):
+    return [{'id': hit['_id'], 'text': hit['_source'].get('text'), 
+             'file_id': hit['_source'].get('file_id'),'image_id': hit['_source'].get('image_id'), 'metadata':_hit_metadata(hit['_source']),
+             'rank': idx + 1, 'score': hit['_score']} for idx, hit in enumerate(res['hits']['hits'][:size])]
+
+def keyword_search(es, es_index, key_words, size=10, timeout=None, filter=None):
+    """BM25检索, key_words为分词后的关键词; timeout为ES分片级超时, 超时的分片不返回结果"""
     keyword_query = {
         "bool": {
             "should": [
@@ -19,40 +165,172 @@ def elastic_search(text, es_index):
             "minimum_should_match": 1
         }
     }
-    res_keyword = es.search(index=es_index, query=keyword_query)
-    keyword_hits = [{'id': hit['_id'], 'text': hit['_source'].get('text'), 
-                     'file_id': hit['_source'].get('file_id'), 'image_id': hit['_source'].get('image_id'), 'metadata':hit['_source'].get('metadata'),
-                     'rank': idx + 1} for idx, hit in enumerate(res_keyword['hits']['hits'])]
-    # print(keyword_hits)
-    # keyword_hits = [] #test vector search
+    if filter is not None:
+        keyword_query["bool"]["filter"] = [filter]
+    search_kwargs = {"index": es_index, "query": keyword_query, "size": size,
+                     # 向量只用于打分, 不随结果返回
+                     "source_excludes": ["vector"]}
+    if timeout:
+        search_kwargs["timeout"] = f"{int(timeout * 1000)}ms"
+    return _hits(es.search(**search_kwargs))
+
+def vector_search(es, es_index, query_vector, size=10, rescore_oversample=None, filter=None, timeout=None):
+    """向量检索, 根据索引的向量布局自动选择查询方式
+
+    - hnsw(float32): 保持原有的script_score精确余弦相似度
+    - 量化布局: 使用HNSW kNN查询, 可选用原始float向量对前 size*oversample 个候选重打分
+    - filter: 可选的ES过滤条件, 只在满足条件的块中计算相似度
+    - timeout: ES分片级超时(秒), 超时的分片不返回结果
+    """
+    if rescore_oversample is None:
+        rescore_oversample = VECTOR_RESCORE_OVERSAMPLE
+    exact_score_script = {
+        "source": "cosineSimilarity(params.queryVector, 'vector') + 1.0",
+        "params": {"queryVector": query_vector}
+    }
 
-    embedding = local_embedding([text])
-    vector_query = {
-        "bool": {
-            "must": [{"match_all": {}}],
-            "should": [
-                {"script_score": {
-                    "query": {"match_all": {}},
-                    "script": {
-                        "source": "cosineSimilarity(params.queryVector, 'vector') + 1.0",
-                        "params": {"queryVector": embedding[0]}
-                    }
-                }}
-            ]
+    if get_vector_index_type(es, es_index) == 'hnsw':
+        vector_query = {
+            "bool": {
+                "must": [{"match_all": {}}],
+                "should": [
+                    {"script_score": {
+                        "query": {"match_all": {}},
+                        "script": exact_score_script
+                    }}
+                ]
+            }
         }
-    }
-    res_vector = es.search(index=es_index, query=vector_query)
-    
-    # print(res_vector)
-    
-    vector_hits = [{'id': hit['_id'], 'text': hit['_source'].get('text'), 
-                    'file_id': hit['_source'].get('file_id'),'image_id': hit['_source'].get('image_id'), 'metadata':hit['_source'].get('metadata'),
-                    'rank': idx + 1} for idx, hit in enumerate(res_vector['hits']['hits'])]
-    
-    # print(vector_hits)
-    combined_results = hybrid_search_rrf(keyword_hits, vector_hits)
-    # print(combined_results)
-    return combined_results
+        if filter is not None:
+            vector_query["bool"]["filter"] = [filter]
+        search_kwargs = {"index": es_index, "query": vector_query, "size": size, "source_excludes": ["vector"]}
+    else:
+        window_size = int(size * rescore_oversample) if rescore_oversample and rescore_oversample > 1 else size
+        knn_query = {
+            "knn": {
+                "field": "vector",
+                "query_vector": query_vector,
+                "num_candidates": max(VECTOR_NUM_CANDIDATES, window_size)
+            }
+        }
+        if filter is not None:
+            knn_query["knn"]["filter"] = filter
+        search_kwargs = {"index": es_index, "query": knn_query, "size": window_size, "source_excludes": ["vector"]}
+        if window_size > size:
+            # 量化得分只用于召回候选, 最终顺序由全精度余弦相似度决定
+            search_kwargs["rescore"] = {
+                "window_size": window_size,
+                "query": {
+                    "rescore_query": {"script_score": {"query": {"match_all": {}}, "script": exact_score_script}},
+                    "query_weight": 0.0,
+                    "rescore_query_weight": 1.0
+                }
+            }
+    if timeout:
+        search_kwargs["timeout"] = f"{int(timeout * 1000)}ms"
+
+    return _hits(es.search(**search_kwargs), size)
+
+def resolve_indices(es, names):
+    """把索引名列表 (或逗号分隔的字符串) 中的别名展开为实际索引, 保持顺序并去重"""
+    if isinstance(names, str):
+        names = names.split(',')
+    indices = []
+    for name in (n.strip() for n in names):
+        if not name:
+            continue
+        if es.indices.exists_alias(name=name):
+            indices.extend(sorted(es.indices.get_alias(name=name).keys()))
+        else:
+            indices.append(name)
+    return list(dict.fromkeys(indices))
+
+def _normalize_leg(hits, index):
+    """单个索引内的分数除以该索引的最高分: 不同索引的BM25 IDF和向量布局的打分尺度不同, 归一化后才能合并排序"""
+    top = max((h['score'] or 0 for h in hits), default=0) or 1.0
+    for h in hits:
+        h['norm_score'] = (h['score'] or 0) / top
+        h['index'] = index
+    return hits
+
+def _merge_leg(per_index_hits, size):
+    """合并各索引同一路的结果, 按归一化分数重新排名"""
+    merged = sorted((h for hits in per_index_hits for h in hits), key=lambda h: h['norm_score'], reverse=True)[:size]
+    for idx, h in enumerate(merged):
+        h['rank'] = idx + 1
+    return merged
+
+def federated_search(text, indices, top_k=None, rescore_oversample=None, two_stage=None, page_top_k=None,
+                     timeout=None, size=10, filters=None):
+    """在多个索引 (或别名) 上并发执行BM25和向量检索, 每个索引内归一化分数后合并, 再RRF融合
+
+    timeout: 每个索引的超时(秒); 同时作为ES的分片级超时, 超时的分片或整个索引被丢弃, 不影响其他索引;
+             查询向量也在该时间内返回, 否则抛出异常 (所有索引的向量检索都依赖它)
+    返回 (结果列表, 报告 {"indices", "searched", "dropped": {索引: 原因}, "latency_ms"})
+    每个结果带有 index 字段, 标明来自哪个索引
+    """
+    es = get_es()
+    timeout = FEDERATED_INDEX_TIMEOUT if timeout is None else timeout
+    # 慢索引只在自己的超时内失败一次: 不重试, 也不计入进程级熔断器, 不影响其他索引和其他查询
+    client = budget_client(es, timeout)
+    indices = resolve_indices(client, indices)
+    two_stage = TWO_STAGE_RETRIEVAL if two_stage is None else two_stage
+    page_top_k = page_top_k or COARSE_PAGE_TOP_K
+    report = {"indices": indices, "searched": [], "dropped": {}, "latency_ms": {}}
+    if not indices:
+        return [], report
+
+    key_words = get_keyword(text)
+    query_vector = embed_query(text, timeout)
+    metadata_filter = build_es_filter(filters)
+
+    def search_leg(index, leg):
+        start = time.perf_counter()
+        if leg == 'keyword':
+            hits = keyword_search(client, index, key_words, size, timeout, metadata_filter)
+        else:
+            page_filter = _page_filter(client, index, query_vector, two_stage, page_top_k, filters)
+            hits = vector_search(client, index, query_vector, size, rescore_oversample,
+                                 _and_filters(metadata_filter, page_filter), timeout)
+        return hits, (time.perf_counter() - start) * 1000
+
+    # 每个索引的两路检索都并发执行
+    pool = ThreadPoolExecutor(max_workers=min(FEDERATED_MAX_WORKERS, 2 * len(indices)), thread_name_prefix="federated")
+    futures = {pool.submit(search_leg, index, leg): (index, leg) for index in indices for leg in ('keyword', 'vector')}
+    done, _ = wait(futures, timeout=timeout + 1 if timeout else None)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    legs = {}
+    for future, (index, leg) in futures.items():
+        if future not in done:
+            report["dropped"][index] = "timeout"
+            continue
+        try:
+            hits, latency = future.result()
+        except Exception as e:
+            report["dropped"][index] = str(e)
+            continue
+        legs.setdefault(index, {})[leg] = hits
+        report["latency_ms"][index] = max(report["latency_ms"].get(index, 0), round(latency, 1))
+
+    keyword_lists, vector_lists = [], []
+    for index in indices:
+        if index in report["dropped"]:
+            continue  # 只返回了一路的索引也丢弃, 避免它在融合中被压低
+        report["searched"].append(index)
+        keyword_lists.append(_normalize_leg(legs[index]['keyword'], index))
+        vector_lists.append(_normalize_leg(legs[index]['vector'], index))
+
+    keyword_hits = _merge_leg(keyword_lists, size)
+    vector_hits = _merge_leg(vector_lists, size)
+    # 融合按 (索引, id) 区分结果, 每个结果带有来源索引
+    results = hybrid_search_rrf(keyword_hits, vector_hits)
+    if top_k is not None:
+        results = results[:top_k]
+    for index in report["searched"]:
+        if is_external_text(es, index):
+            get_text_store(index).hydrate([r for r in results if r['index'] == index])
+    return results, report
 
 def get_keyword(query):
     # 确保输入是字符串类型
@@ -66,6 +344,7 @@ def get_keyword(query):
         return []
     
     try:
+        import jieba
         # 使用搜索引擎模式进行分词
         seg_list = jieba.cut_for_search(query)
         # Filter out stop words
@@ -86,23 +365,29 @@ stop_words = set([
 ])
     
     
+def _doc_key(doc):
+    # 联合检索时不同索引中的块id可能相同 (同一文件加载到多个索引), 按 (索引, id) 区分
+    return doc.get('index'), doc['id']
+
 def hybrid_search_rrf(keyword_hits, vector_hits, k=60):
     # Initialize score dictionary
     scores = {}
     
     # Process keyword hits
     for hit in keyword_hits:
-        doc_id = hit['id']
-        if doc_id not in scores:
-            scores[doc_id] = {'score': 0, 'text': hit['text'], 'id': doc_id, 'file_id': hit['file_id'],'image_id':hit['image_id'],'metadata':hit['metadata']}
-        scores[doc_id]['score'] += 1 / (k + hit['rank'])
+        doc_key = _doc_key(hit)
+        if doc_key not in scores:
+            scores[doc_key] = {'score': 0, 'text': hit['text'], 'id': hit['id'], 'file_id': hit['file_id'],'image_id':hit['image_id'],'metadata':hit['metadata'], 'index': hit.get('index')}
+        scores[doc_key]['score'] += 1 / (k + hit['rank'])
+        scores[doc_key]['keyword_rank'] = hit['rank']
     
     # Process vector hits
     for hit in vector_hits:
-        doc_id = hit['id']
-        if doc_id not in scores:
-            scores[doc_id] = {'score': 0, 'text': hit['text'], 'id': doc_id, 'file_id': hit['file_id'],'image_id':hit['image_id'],'metadata':hit['metadata']}
-        scores[doc_id]['score'] += 1 / (k + hit['rank'])
+        doc_key = _doc_key(hit)
+        if doc_key not in scores:
+            scores[doc_key] = {'score': 0, 'text': hit['text'], 'id': hit['id'], 'file_id': hit['file_id'],'image_id':hit['image_id'],'metadata':hit['metadata'], 'index': hit.get('index')}
+        scores[doc_key]['score'] += 1 / (k + hit['rank'])
+        scores[doc_key]['vector_rank'] = hit['rank']
     
     # Sort documents by their RRF score and assign ranks
     ranked_docs = sorted(scores.values(), key=lambda x: x['score'], reverse=True)
@@ -110,16 +395,22 @@ def hybrid_search_rrf(keyword_hits, vector_hits, k=60):
     # Removing the timestamps
     for _, doc in enumerate(ranked_docs):
         timestamp_pattern = re.compile(r'\d{2}:\d{2}\.\d{3} --> \d{2}:\d{2}\.\d{3}')
-        doc['text'] = re.sub(timestamp_pattern, '', doc['text'])    
+        if doc['text']:  # 文本分离布局的索引在融合之后才取回正文
+            doc['text'] = re.sub(timestamp_pattern, '', doc['text'])    
         
     # Format the final list of results                      #去除image标签
-    final_results = [{'id': doc['id'], 'text': doc['text'], 'file_id': doc['file_id'],'image_id':doc['image_id'], 'metadata':doc['metadata'],'rank': idx + 1} for idx, doc in enumerate(ranked_docs)]
+    # rrf_score 和两路各自的排名供重排序门控使用
+    final_results = [{'id': doc['id'], 'text': doc['text'], 'file_id': doc['file_id'],'image_id':doc['image_id'], 'metadata':doc['metadata'],'rank': idx + 1,
+                      'rrf_score': doc['score'], 'keyword_rank': doc.get('keyword_rank'), 'vector_rank': doc.get('vector_rank')} for idx, doc in enumerate(ranked_docs)]
+    for result, doc in zip(final_results, ranked_docs):
+        if doc['index'] is not None:
+            result['index'] = doc['index']
     # print(final_results)
     return final_results
 
-def rerank(query, result_doc):
+def rerank(query, result_doc, timeout=None):
 
-    res = requests.post(RERANK_URL, json={"query": query, "documents": [doc['text'] for doc in result_doc]}).json()
+    res = hedged("rerank", _post_rerank, query, [doc['text'] for doc in result_doc], timeout)
     if res and 'scores' in res and len(res['scores']) == len(result_doc):
         for idx, doc in enumerate(result_doc):
             result_doc[idx]['score'] = res['scores'][idx]
@@ -129,7 +420,64 @@ def rerank(query, result_doc):
             
     return result_doc
 
-def rag_fusion(query):
+def _post_rerank(query, documents, timeout=None):
+    return requests.post(RERANK_URL, json={"query": query, "documents": documents}, timeout=timeout).json()
+
+def rerank_gate(results, cutoff=5, min_overlap=RERANK_GATE_MIN_OVERLAP, min_margin=RERANK_GATE_MIN_MARGIN,
+                window=RERANK_GATE_WINDOW):
+    """根据关键词和向量两路检索的一致程度决定是否需要rerank
+
+    cutoff: 回答使用的结果数 (与步骤8一致), 只关心前cutoff个结果是否可靠
+    overlap: 两路各自前cutoff个结果的重合比例
+    margin: 第cutoff个和第cutoff+1个结果的RRF分数差, 以第一名的分数归一化
+    返回 {"action": "skip" | "window" | "full", "window": (start, end), "overlap", "margin"}
+    """
+    decision = {"action": "full", "window": (0, len(results)), "overlap": 0.0, "margin": 0.0}
+    if len(results) <= 1:
+        decision["action"] = "skip"
+        return decision
+    if any(r.get('rrf_score') is None or (r.get('metadata') or {}).get('content_type') == 'web' for r in results):
+        return decision  # 没有RRF信息或混有网络搜索结果 (两路一致性不反映网页的排序), 按原方式全部重排
+
+    keyword_top = {_doc_key(r) for r in results if r.get('keyword_rank') and r['keyword_rank'] <= cutoff}
+    vector_top = {_doc_key(r) for r in results if r.get('vector_rank') and r['vector_rank'] <= cutoff}
+    overlap = len(keyword_top & vector_top) / cutoff
+    scores = [r['rrf_score'] for r in results]
+    margin = (scores[cutoff - 1] - scores[cutoff]) / scores[0] if len(scores) > cutoff and scores[0] > 0 else 1.0
+    decision.update(overlap=overlap, margin=margin)
+
+    if overlap < min_overlap:
+        return decision
+    if margin >= min_margin:
+        decision.update(action="skip", window=(0, 0))
+    else:
+        # 两路结论一致, 只有入选边界附近的排序不确定
+        start = max(0, cutoff - window // 2)
+        decision.update(action="window", window=(start, min(len(results), start + window)))
+    return decision
+
+def gated_rerank(query, results, cutoff=5, timeout=None):
+    """按门控结果跳过rerank、只重排边界窗口或全部重排, 返回 (结果, 门控决策)"""
+    decision = rerank_gate(results, cutoff)
+    start, end = decision["window"]
+    if decision["action"] == "skip":
+        return results, decision
+    if decision["action"] == "window":
+        return results[:start] + rerank(query, results[start:end], timeout) + results[end:], decision
+    return rerank(query, results, timeout), decision
+
+def rrf_merge(result_lists, k=60):
+    """多个问题 (原问题和RAG Fusion改写) 的检索结果按排名做RRF融合"""
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            doc_key = _doc_key(doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(doc_key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [dict(docs[doc_key], rank=idx + 1, rrf_score=scores[doc_key]) for idx, doc_key in enumerate(ranked)]
+
+def rag_fusion(query, timeout=None):
     prompt = f'''请根据用户的查询，将其重新改写为 2 个不同的查询。这些改写后的查询应当尽可能覆盖原始查询中的不同方面或角度，以便更全面地获取相关信息。请确保每个改写后的查询仍然与原始查询相关，并且在内容上有所不同。
 
 用JSON的格式输出：
@@ -141,16 +489,18 @@ def rag_fusion(query):
 '''
     # Call OpenAI ChatGPT 4o nano to generate query variations
     
+    from openai import OpenAI
     client = OpenAI(api_key=OPENAI_API_KEY)
     
     try:
-        response = client.chat.completions.create(
+        response = hedged("llm:gpt-5-nano", client.chat.completions.create,
             model="gpt-5-nano",
             messages=[
                 {"role": "system", "content": "你是一个智能AI助手，专注于改写用户查询，并以 JSON 格式输出"},
                 {"role": "user", "content": prompt}
             ],
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            **({"timeout": timeout} if timeout else {})
         )
         
         result = response.choices[0].message.content
@@ -161,7 +511,7 @@ def rag_fusion(query):
         print(f"Error calling OpenAI API: {e}")
         return []
 
-def coreference_resolution(query,chat_history):
+def coreference_resolution(query,chat_history,timeout=None):
     prompt = f'''目标：根据提供的用户与知识库助手的历史记录，做指代消解，将用户最新问题中出现的代词或指代内容替换为历史记录中的明确对象，生成一条完整的独立问题。
 
 说明：
@@ -203,20 +553,57 @@ def coreference_resolution(query,chat_history):
 输出JSON：
 ''' 
     # Call OpenAI ChatGPT 4o nano to generate query variations
+    from openai import OpenAI
     client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    response = hedged("llm:gpt-5", client.chat.completions.create,
         model="gpt-5",
         messages=[
             {"role": "system", "content": "你是一个智能AI助手，专注于做指代消解，并以 JSON 格式输出"},
             {"role": "user", "content": prompt}
         ],
-        response_format={"type": "json_object"}
+        response_format={"type": "json_object"},
+        **({"timeout": timeout} if timeout else {})
     )
     result = response.choices[0].message.content
     parsed_result = json.loads(result)
     return parsed_result.get("query")
 
 
+def summarize_conversation(previous_summary, turns):
+    turns_text = "\n".join(f"'user': {user}\n'assistant': {assistant}" for user, assistant in turns)
+    prompt = f'''目标：把用户与知识库助手较早的对话压缩为实体和话题摘要，供后续做指代消解使用。
+
+说明：
+- entities: 对话中出现的具体对象（人名、机构、法律条文、产品、概念等），保留原文写法，最多20个，最近提到的排在前面。
+- topics: 用户关心的话题，每个不超过20字，最多10个。
+- 需要合并已有摘要，去除重复内容。
+
+以JSON的格式输出
+{{"entities":["实体1","实体2"],"topics":["话题1"]}}
+
+已有摘要：
+{json.dumps(previous_summary, ensure_ascii=False)}
+
+需要压缩的对话：
+{turns_text}
+
+输出JSON：
+'''
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    response = hedged("llm:gpt-5-nano", client.chat.completions.create,
+        model="gpt-5-nano",
+        messages=[
+            {"role": "system", "content": "你是一个智能AI助手，专注于压缩对话历史，并以 JSON 格式输出"},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    result = response.choices[0].message.content
+    parsed_result = json.loads(result)
+    return {"entities": parsed_result.get("entities", []), "topics": parsed_result.get("topics", [])}
+
+
 def query_decompositon(query):
     prompt=f''' 
 目标：分析用户的问题，判断其是否需要拆分为子问题以提高信息检索的准确性。如果需要拆分，提供拆分后的子问题列表；如果不需要，直接返回原问题。
@@ -291,8 +678,9 @@ def query_decompositon(query):
 用户问题:
 "{query}"
 '''
+    from openai import OpenAI
     client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    response = hedged("llm:gpt-5", client.chat.completions.create,
         model="gpt-5",
         messages=[
             {"role": "system", "content": "你是一个智能AI助手，专注于做查询拆分，并以 JSON 格式输出"},
@@ -0,0 +1,171 @@
+"""
+索引快照: 导出切分后的文本块、元数据和向量, 用于快速重建索引而不必重新解析PDF、调用VLM和嵌入模型
+
+快照为一个目录:
+    manifest.json       来源索引、向量布局、维度、总数和分片列表
+    part-00000.npz      每个分片包含 ids / vectors(float32矩阵) / sources(按行拼接的JSON)
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+from elasticsearch import helpers
+
+from es_functions import create_elastic_index, get_vector_index_type, bump_index_generation, is_external_text
+from page_index import PageCentroids, index_page_centroids
+from text_store import get_text_store
+
+SNAPSHOT_SHARD_SIZE = 50000
+BULK_CHUNK_SIZE = 500
+BULK_THREADS = 4
+
+
+def _write_shard(snapshot_dir, shard_no, ids, vectors, sources):
+    name = f"part-{shard_no:05d}.npz"
+    sources_blob = "\n".join(json.dumps(s, ensure_ascii=False) for s in sources).encode("utf-8")
+    np.savez_compressed(
+        os.path.join(snapshot_dir, name),
+        ids=np.asarray(ids, dtype=np.str_),
+        vectors=np.asarray(vectors, dtype=np.float32),
+        sources=np.frombuffer(sources_blob, dtype=np.uint8),
+    )
+    return {"file": name, "count": len(ids)}
+
+
+def iter_snapshot(snapshot_dir):
+    """逐个分片读取快照, 产出 (id, vector(np.float32), source)"""
+    for shard in read_snapshot_manifest(snapshot_dir)["shards"]:
+        with np.load(os.path.join(snapshot_dir, shard["file"])) as data:
+            ids = data["ids"]
+            vectors = data["vectors"]
+            sources = data["sources"].tobytes().decode("utf-8").split("\n")
+        for doc_id, vector, source in zip(ids, vectors, sources):
+            yield str(doc_id), vector, json.loads(source)
+
+
+def read_snapshot_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export_snapshot(snapshot_dir, docs, source_name, vector_index_type=None):
+    """把 (id, vector, source) 序列写成分片快照, source中不包含vector字段"""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    shards, ids, vectors, sources = [], [], [], []
+    dims = None
+    for doc_id, vector, source in docs:
+        ids.append(doc_id)
+        vectors.append(vector)
+        sources.append(source)
+        dims = dims or len(vector)
+        if len(ids) >= SNAPSHOT_SHARD_SIZE:
+            shards.append(_write_shard(snapshot_dir, len(shards), ids, vectors, sources))
+            ids, vectors, sources = [], [], []
+    if ids:
+        shards.append(_write_shard(snapshot_dir, len(shards), ids, vectors, sources))
+
+    manifest = {
+        "source": source_name,
+        "vector_index_type": vector_index_type,
+        "dims": dims,
+        "count": sum(s["count"] for s in shards),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "shards": shards,
+    }
+    with open(os.path.join(snapshot_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def iter_es_docs(es, index_name):
+    """扫描ES索引中的全部文档, 文本分离布局的索引从本地 TextStore 补全正文"""
+    text_store = get_text_store(index_name) if is_external_text(es, index_name) else None
+    for hit in helpers.scan(es, index=index_name, size=1000, request_timeout=120):
+        source = dict(hit["_source"])
+        vector = source.pop("vector", None)
+        if vector is None:
+            continue
+        if text_store is not None:
+            text_store.fill_source(hit["_id"], source)
+        yield hit["_id"], vector, source
+
+
+def export_es_snapshot(es, index_name, snapshot_dir):
+    return export_snapshot(snapshot_dir, iter_es_docs(es, index_name), index_name,
+                           get_vector_index_type(es, index_name))
+
+
+def import_es_snapshot(es, snapshot_dir, index_name, vector_index_type=None, external_text=False):
+    """把快照批量写入新索引: 加载期间关闭refresh和副本, 完成后恢复
+
+    external_text: 新建的索引使用文本分离布局; 目标索引为该布局时正文同时写入本地 TextStore
+    """
+    manifest = read_snapshot_manifest(snapshot_dir)
+    if not es.indices.exists(index=index_name):
+        create_elastic_index(index_name, vector_index_type or manifest.get("vector_index_type"), external_text)
+    text_store = get_text_store(index_name) if is_external_text(es, index_name) else None
+
+    settings = es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+    original = {
+        "refresh_interval": settings.get("refresh_interval"),
+        "number_of_replicas": settings.get("number_of_replicas", "1"),
+    }
+    es.indices.put_settings(index=index_name, settings={"refresh_interval": "-1", "number_of_replicas": 0})
+
+    # 导入的同时按页累加向量, 重建两阶段检索的页索引
+    centroids = PageCentroids()
+
+    def actions():
+        texts = []
+        for doc_id, vector, source in iter_snapshot(snapshot_dir):
+            centroids.add(doc_id, source.get("page_key"), source.get("file_name"), source.get("page_num"), vector)
+            if text_store is not None:
+                texts.append((doc_id, source.get("text"), source.get("metadata")))
+                if len(texts) >= BULK_CHUNK_SIZE:
+                    text_store.put_many(texts)
+                    texts = []
+            source["vector"] = vector.tolist()
+            yield {"_index": index_name, "_id": doc_id, "_source": source}
+        if texts:
+            text_store.put_many(texts)
+
+    indexed, failed = 0, 0
+    try:
+        for ok, _ in helpers.parallel_bulk(es.options(request_timeout=120), actions(), thread_count=BULK_THREADS,
+                                           chunk_size=BULK_CHUNK_SIZE, raise_on_error=False):
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+    finally:
+        es.indices.put_settings(index=index_name, settings=original)
+        es.indices.refresh(index=index_name)
+        if indexed:
+            bump_index_generation(es, index_name)
+
+    pages = index_page_centroids(es, index_name, centroids) if indexed else 0
+    return {"indexed": indexed, "failed": failed, "total": manifest["count"], "pages": pages}
+
+
+def export_local_snapshot(local_index, snapshot_dir):
+    return export_snapshot(snapshot_dir, local_index.iter_docs(), local_index.index_dir)
+
+
+def import_local_snapshot(local_index, snapshot_dir, batch_size=5000):
+    """把快照追加到本地索引"""
+    manifest = read_snapshot_manifest(snapshot_dir)
+    indexed, batch = 0, []
+    for doc_id, vector, source in iter_snapshot(snapshot_dir):
+        chunk = dict(source)
+        chunk["id"] = doc_id
+        chunk["content"] = chunk.pop("text", "")
+        chunk["vector"] = vector
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            indexed += local_index.add(batch)
+            batch = []
+    if batch:
+        indexed += local_index.add(batch)
+    return {"indexed": indexed, "failed": 0, "total": manifest["count"]}
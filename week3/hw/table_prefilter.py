@@ -0,0 +1,81 @@
+"""
+表格候选页预筛
+page.find_tables() 是逐页解析中最慢的操作之一 (每页几十毫秒), 而大部分页面上根本没有表格。
+调用之前先用两个便宜的信号 (每页约1-2毫秒) 判断该页是否可能有表格, 都不满足时跳过 find_tables:
+- 表格线: get_drawings() 中水平和垂直的线段 (细长矩形、矩形边框的四条边也算),
+  find_tables 默认按线检测, 同时有足够的横线和竖线才可能组成单元格
+- 文本对齐: 按基线分行、按较大的水平间距切分单元格, 多行的单元格左边缘落在同样的几个x位置上,
+  覆盖没有框线、靠版面分析才能识别的表格
+
+本模块只依赖fitz页面对象, 在解析工作进程中调用。
+"""
+
+from collections import Counter, defaultdict
+
+# 短于该长度(pt)的线段不算表格线, 过滤下划线、项目符号等
+MIN_RULE_LENGTH = 10.0
+# 宽或高不超过该值(pt)的填充矩形视为一条线
+RULE_THICKNESS = 2.0
+# 至少需要的水平线和垂直线数量
+MIN_HORIZONTAL_RULES = 2
+MIN_VERTICAL_RULES = 2
+# 同一行中水平间距超过该值(pt)的相邻单词属于不同单元格
+CELL_GAP = 8.0
+# 基线和单元格左边缘的对齐容差(pt)
+ALIGN_TOLERANCE = 3.0
+# 至少有这么多列、每列在这么多行中对齐, 才视为表格状的文本
+MIN_ALIGNED_COLUMNS = 3
+MIN_ALIGNED_ROWS = 3
+
+
+def count_rules(drawings):
+    """返回 (水平线数, 垂直线数)"""
+    horizontal = vertical = 0
+    for path in drawings:
+        for item in path.get("items", ()):
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                dx, dy = abs(p2.x - p1.x), abs(p2.y - p1.y)
+                if dy <= RULE_THICKNESS and dx >= MIN_RULE_LENGTH:
+                    horizontal += 1
+                elif dx <= RULE_THICKNESS and dy >= MIN_RULE_LENGTH:
+                    vertical += 1
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height <= RULE_THICKNESS and rect.width >= MIN_RULE_LENGTH:
+                    horizontal += 1
+                elif rect.width <= RULE_THICKNESS and rect.height >= MIN_RULE_LENGTH:
+                    vertical += 1
+                elif rect.width >= MIN_RULE_LENGTH and rect.height >= MIN_RULE_LENGTH:
+                    # 带边框或底色的矩形 (单元格、表格外框)
+                    horizontal += 2
+                    vertical += 2
+    return horizontal, vertical
+
+
+def count_aligned_columns(words):
+    """words: page.get_text("words") 的结果; 返回在至少 MIN_ALIGNED_ROWS 个多单元格行中对齐的列数"""
+    rows = defaultdict(list)
+    for x0, _, x1, y1, *_ in words:
+        rows[round(y1 / ALIGN_TOLERANCE)].append((x0, x1))
+
+    column_rows = Counter()
+    for row in rows.values():
+        row.sort()
+        cell_starts = [row[0][0]]
+        for (_, prev_x1), (x0, _) in zip(row, row[1:]):
+            if x0 - prev_x1 > CELL_GAP:
+                cell_starts.append(x0)
+        if len(cell_starts) >= MIN_ALIGNED_COLUMNS:
+            column_rows.update({round(x / ALIGN_TOLERANCE) for x in cell_starts})
+    return sum(1 for count in column_rows.values() if count >= MIN_ALIGNED_ROWS)
+
+
+def table_candidate(page):
+    """该页是否可能有表格; 返回 (是否候选, 原因), 原因为 "rules" / "aligned_text" / None"""
+    horizontal, vertical = count_rules(page.get_drawings())
+    if horizontal >= MIN_HORIZONTAL_RULES and vertical >= MIN_VERTICAL_RULES:
+        return True, "rules"
+    if count_aligned_columns(page.get_text("words")) >= MIN_ALIGNED_COLUMNS:
+        return True, "aligned_text"
+    return False, None
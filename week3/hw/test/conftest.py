@@ -0,0 +1,157 @@
+"""
+测试公用的fixture: 模拟ES的HTTP服务, 用于超时、熔断等不需要真实集群的路径
+"""
+
+import fnmatch
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubES:
+    """按路径应答的最小ES: slow 中的索引检索时先等待 delay 秒; requests 记录 (方法, 路径)
+
+    另外支持建索引、settings、别名切换和bulk写入, 用于蓝绿重建的切换流程;
+    bulk_errors: {文档id: [状态码, ...]}, 该文档的前几次写入依次返回这些错误状态
+    """
+
+    def __init__(self):
+        self.slow = set()
+        self.delay = 2.0
+        self.requests = []
+        self.mappings = {}
+        self.aliases = {}
+        self.settings = {}
+        self.bulk_errors = {}
+        self._lock = threading.Lock()
+
+    def mapping(self, index):
+        return self.mappings.setdefault(index, {"properties": {"vector": {"type": "dense_vector"}}})
+
+    def handle(self, method, path, body):
+        with self._lock:
+            self.requests.append((method, path))
+        parts = [p for p in path.split("?")[0].split("/") if p]
+        if not parts:
+            return 200, {"version": {"number": "8.11.0"}}
+        if parts[:1] == ["_bulk"]:
+            items = []
+            for action in (line["index"] for line in body if "index" in line):
+                pending = self.bulk_errors.get(action.get("_id"))
+                status = pending.pop(0) if pending else 201
+                item = {"_id": action.get("_id"), "status": status}
+                if status >= 300:
+                    item["error"] = {"type": "es_rejected_execution_exception" if status == 429
+                                     else "mapper_parsing_exception"}
+                items.append({"index": item})
+            return 200, {"errors": any("error" in item["index"] for item in items), "items": items}
+        if parts[:1] == ["_aliases"]:
+            for action in body["actions"]:
+                (kind, args), = action.items()
+                targets = self.aliases.setdefault(args["alias"], [])
+                if kind == "add":
+                    targets.append(args["index"])
+                elif kind == "remove" and args["index"] in targets:
+                    targets.remove(args["index"])
+            return 200, {"acknowledged": True}
+        if parts[:1] == ["_alias"]:
+            alias = parts[1]
+            if alias not in self.aliases:
+                return 404, {}
+            return 200, {index: {"aliases": {alias: {}}} for index in self.aliases[alias]}
+        index = parts[0]
+        if "*" in index:
+            return 200, {name: {} for name in self.mappings if fnmatch.fnmatch(name, index)}
+        if method == "PUT" and len(parts) == 1:
+            self.mappings[index] = body.get("mappings", {})
+            return 200, {"acknowledged": True, "index": index}
+        if parts[1:] == ["_settings"]:
+            if method == "PUT":
+                self.settings.setdefault(index, {}).update(body)
+                return 200, {"acknowledged": True}
+            return 200, {index: {"settings": {"index": {"refresh_interval": "1s", "number_of_replicas": "1",
+                                                        **self.settings.get(index, {})}}}}
+        if parts[1:] == ["_mapping"]:
+            targets = self.aliases.get(index, [index])
+            if method == "PUT":
+                for name in targets:
+                    self.mapping(name)["_meta"] = body.get("_meta", {})
+                return 200, {"acknowledged": True}
+            return 200, {name: {"mappings": self.mapping(name)} for name in targets}
+        if parts[1:] == ["_refresh"]:
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if parts[1:] == ["_search"]:
+            if index in self.slow:
+                time.sleep(self.delay)
+            hit = {"_id": "chunk_1", "_score": 1.0, "_source": {"text": f"{index} text", "page_num": 1}}
+            return 200, {"hits": {"hits": [hit]}, "timed_out": False}
+        if method == "HEAD":
+            return (200 if index in self.mappings or self.aliases.get(index) else 404), {}
+        return 404, {"error": f"unsupported {method} {path}"}
+
+    def search_count(self, index):
+        return sum(1 for method, path in self.requests if path.split("?")[0] == f"/{index}/_search")
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if "ndjson" in (self.headers.get("Content-Type") or ""):
+                body = [json.loads(line) for line in raw.splitlines() if line.strip()]
+            else:
+                body = json.loads(raw) if raw else {}
+            status, payload = stub.handle(method, self.path, body)
+            data = json.dumps(payload).encode("utf-8")
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 客户端已超时断开
+
+        def do_GET(self):
+            self._respond("GET")
+
+        def do_POST(self):
+            self._respond("POST")
+
+        def do_PUT(self):
+            self._respond("PUT")
+
+        def do_HEAD(self):
+            self._respond("HEAD")
+
+    return Handler
+
+
+@pytest.fixture
+def stub_es(monkeypatch):
+    """启动模拟ES, 共享客户端和熔断器指向它, 测试结束后恢复"""
+    config = pytest.importorskip("config")
+    stub = StubES()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(config.ElasticConfig, "url", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(config, "_es_client", None)
+    monkeypatch.setattr(config, "_breaker", config.CircuitBreaker(config.ElasticConfig.breaker_failure_threshold,
+                                                                 config.ElasticConfig.breaker_reset_timeout))
+    yield stub
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,43 @@
+"""
+语义答案缓存: 版本号变化后不再命中; 单条目的有效期 (带网络搜索结果的答案) 不超过缓存整体的有效期;
+查询和写入不修改调用方的向量
+"""
+
+import time
+
+import numpy as np
+
+from cache import SemanticAnswerCache
+
+
+def _vector(seed):
+    return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+
+
+def test_generation_change_invalidates():
+    cache = SemanticAnswerCache(threshold=0.95, ttl=60)
+    cache.store(_vector(0), "docs", "g1", "问题", "答案", [])
+    assert cache.lookup(_vector(0), "docs", "g1")[0]["answer"] == "答案"
+    assert cache.lookup(_vector(0), "docs", "g2")[0] is None
+    assert cache.lookup(_vector(0), "docs|web", "g1")[0] is None
+
+
+def test_entry_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(threshold=0.95, ttl=86400)
+    cache.store(_vector(0), "docs", "g1", "问题", "文档答案", [])
+    cache.store(_vector(1), "docs|web", "g1", "问题", "网络答案", [], ttl=600)
+
+    now[0] += 601
+    assert cache.lookup(_vector(1), "docs|web", "g1")[0] is None
+    assert cache.lookup(_vector(0), "docs", "g1")[0]["answer"] == "文档答案"
+
+
+def test_lookup_keeps_caller_vector():
+    cache = SemanticAnswerCache(threshold=0.95, ttl=60)
+    vector = _vector(0) * 3
+    original = vector.copy()
+    cache.store(vector, "docs", "g1", "问题", "答案", [])
+    cache.lookup(vector, "docs", "g1")
+    assert np.array_equal(vector, original)
@@ -0,0 +1,35 @@
+"""
+步骤5的bulk写入: 被暂时拒绝 (429) 的条目单独重发, 永久失败的条目不计入已索引, 也不登记为去重的规范块
+"""
+
+import numpy as np
+
+import pipeline as pipeline_module
+from chunk_store import ChunkBatch
+from pipeline import RAGPipeline
+
+
+def _batch(count=4):
+    chunks = [{"id": f"doc_chunk_{i}", "content": f"第{i}条 " + "合同条款内容 " * 20, "file_name": "a.pdf",
+               "page_num": i + 1} for i in range(count)]
+    return ChunkBatch(chunks, np.random.default_rng(0).standard_normal((count, 8)).astype(np.float32))
+
+
+def test_rejected_items_retried(stub_es, monkeypatch):
+    monkeypatch.setattr(pipeline_module.time, "sleep", lambda seconds: None)
+    stub_es.mappings["docs"] = {"properties": {}}
+    stub_es.bulk_errors = {"doc_chunk_1": [429, 429], "doc_chunk_2": [400]}
+    pipeline = RAGPipeline("docs", answer_cache=False, artifact_cache=False)
+    assert pipeline.step1_deploy_elasticsearch()["success"]
+
+    batch = _batch()
+    dedupe = pipeline.dedupe_chunks(batch.to_dicts())
+    result = pipeline.step5_index_to_elasticsearch(ChunkBatch.from_dicts(dedupe["chunks"]))
+
+    assert result["success"]
+    assert sorted(result["indexed_ids"]) == ["doc_chunk_0", "doc_chunk_1", "doc_chunk_3"]
+    # 第一次请求4个条目, 之后两次只重发被429拒绝的 doc_chunk_1; 400不重试
+    bulk_requests = [path for method, path in stub_es.requests if path.split("?")[0] == "/_bulk"]
+    assert len(bulk_requests) == 3
+    assert "doc_chunk_2" not in pipeline.deduper._signatures
+    assert "doc_chunk_1" in pipeline.deduper._signatures
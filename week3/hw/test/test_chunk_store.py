@@ -0,0 +1,32 @@
+"""
+bulk请求体编码: orjson 与不依赖 orjson 的回退路径写出的文档相同, 向量按float32无损往返
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+import chunk_store
+from chunk_store import ChunkBatch
+
+
+def _batch():
+    chunks = [{"id": f"doc_chunk_{i}", "content": f"第{i}条 \"条款\"", "file_name": "a.pdf", "page_num": i + 1,
+               "metadata": {"duplicates": [{"file_name": "b.pdf", "page_num": 2}]}} for i in range(3)]
+    vectors = np.random.default_rng(0).standard_normal((3, 8)).astype(np.float32)
+    vectors[0, :3] = [0.1, 1e-5, -3.25]
+    return ChunkBatch(chunks, vectors)
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_encode_source_roundtrip(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(chunk_store, "orjson", None)
+    batch = _batch()
+    for i in range(len(batch)):
+        source = json.loads(batch._encode_source(i))
+        assert np.array_equal(np.asarray(source.pop("vector"), dtype=np.float32), batch.vectors[i])
+        assert source == json.loads(json.dumps(batch.source(i)))
@@ -0,0 +1,63 @@
+"""
+查询时间预算: 可选阶段在剩余时间不足时降级, 依赖调用的超时取剩余预算并为生成答案预留时间
+"""
+
+import math
+
+import pytest
+
+import deadline as deadline_module
+from deadline import Deadline, MIN_TIMEOUT, STAGE_MIN_SECONDS
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(deadline_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_unlimited_budget(clock):
+    deadline = Deadline(None, reserve=3.0)
+    assert not deadline.enabled
+    assert math.isinf(deadline.remaining())
+    assert deadline.timeout(cap=10) == 10
+    assert deadline.timeout() is None
+    assert all(deadline.allows(stage) for stage in STAGE_MIN_SECONDS)
+
+
+def test_reserve_and_stage_degradation(clock):
+    deadline = Deadline(8.0, reserve=6.0)
+    # 预留不超过预算的一半
+    assert deadline.reserve == 4.0
+    assert deadline.timeout(cap=10) == pytest.approx(4.0)
+    assert deadline.timeout(cap=10, reserve=False) == pytest.approx(8.0)
+    assert deadline.allows("rag_fusion")
+
+    clock[0] += 2.5
+    assert not deadline.allows("rag_fusion")
+    assert deadline.allows("rerank")
+    assert deadline.timeout(cap=1.0) == pytest.approx(1.0)
+
+    clock[0] += 5.0
+    assert not deadline.allows("rerank")
+    assert deadline.timeout() == MIN_TIMEOUT
+
+    deadline.degrade("rerank", "剩余时间不足")
+    report = deadline.report()
+    assert report["budget"] == 8.0
+    assert [d["stage"] for d in report["degraded"]] == ["rerank"]
+    assert report["degraded"][0]["at_ms"] == pytest.approx(7500.0)
+
+
+def test_rerank_skipped_when_budget_spent(clock, monkeypatch):
+    pipeline_module = pytest.importorskip("pipeline")
+    monkeypatch.setattr(pipeline_module, "rerank", lambda *args, **kwargs: pytest.fail("rerank called"))
+    pipeline = pipeline_module.RAGPipeline("docs", answer_cache=False, artifact_cache=False, rerank_gate=False)
+    deadline = Deadline(4.0, reserve=2.0)
+    clock[0] += 1.8
+    results = [{"id": "a"}, {"id": "b"}]
+
+    step7 = pipeline.step7_rerank_results("问题", results, deadline)
+    assert step7["success"] and step7["reranked_results"] == results
+    assert [d["stage"] for d in deadline.degraded] == ["rerank"]
@@ -0,0 +1,80 @@
+"""
+查询时间预算下的ES请求: 超时不重试、不打开进程级熔断器
+"""
+
+import time
+
+import pytest
+
+import config
+import retrieve_documents
+from elastic_transport import ConnectionTimeout
+
+
+@pytest.fixture(autouse=True)
+def fake_query_vector(monkeypatch):
+    monkeypatch.setattr(retrieve_documents, "embed_query", lambda text, timeout=None: [0.1] * 8)
+    # 分词词典在第一次调用时加载, 不计入超时测试的耗时
+    retrieve_documents.get_keyword("预热")
+
+
+def test_budget_timeout_fails_fast_without_retry(stub_es):
+    stub_es.slow.add("docs")
+    start = time.perf_counter()
+    with pytest.raises(ConnectionTimeout):
+        retrieve_documents.elastic_search("问题", "docs", use_cache=False, two_stage=False, timeout=0.3)
+    assert time.perf_counter() - start < 0.8
+    assert stub_es.search_count("docs") == 1
+
+
+def test_budget_timeouts_do_not_trip_breaker(stub_es):
+    stub_es.slow.add("docs")
+    for _ in range(config.ElasticConfig.breaker_failure_threshold + 1):
+        with pytest.raises(ConnectionTimeout):
+            retrieve_documents.elastic_search("问题", "docs", use_cache=False, two_stage=False, timeout=0.2)
+        assert config._breaker.consecutive_failures == 0
+    assert config._breaker.state == "closed"
+    # 其他调用方不受影响
+    stub_es.slow.clear()
+    assert retrieve_documents.elastic_search("问题", "docs", use_cache=False, two_stage=False, timeout=0.5)
+
+
+def test_half_open_probe_released_on_budget_timeout(stub_es):
+    config._breaker.state = "open"
+    config._breaker.opened_at = time.time() - config._breaker.reset_timeout
+    stub_es.slow.add("docs")
+    with pytest.raises(ConnectionTimeout):
+        retrieve_documents.elastic_search("问题", "docs", use_cache=False, two_stage=False, timeout=0.2)
+    # 试探请求因调用方超时结束, 下一个请求仍可以试探, 成功后熔断器关闭
+    stub_es.slow.clear()
+    assert retrieve_documents.elastic_search("问题", "docs", use_cache=False, two_stage=False, timeout=0.5)
+    assert config._breaker.state == "closed"
+
+
+def test_default_timeout_still_counts_as_failure(stub_es):
+    stub_es.slow.add("docs")
+    stub_es.delay = 0.5
+    client = config.get_es().options(request_timeout=config.ElasticConfig.request_timeout, max_retries=0)
+    config.ElasticConfig.request_timeout, saved = 0.2, config.ElasticConfig.request_timeout
+    try:
+        with pytest.raises(ConnectionTimeout):
+            client.options(request_timeout=0.2).search(index="docs", query={"match_all": {}})
+    finally:
+        config.ElasticConfig.request_timeout = saved
+    assert config._breaker.consecutive_failures == 1
+
+
+def test_federated_drops_slow_index_only(stub_es):
+    stub_es.slow.add("slow_docs")
+    start = time.perf_counter()
+    results, report = retrieve_documents.federated_search("问题", ["docs", "slow_docs"], two_stage=False, timeout=0.3)
+    assert time.perf_counter() - start < 1.5
+    assert report["searched"] == ["docs"]
+    assert "slow_docs" in report["dropped"]
+    assert results and all(r["index"] == "docs" for r in results)
+    # 慢索引每一路只请求一次, 熔断器保持关闭, 之后的查询正常
+    assert stub_es.search_count("slow_docs") == 2
+    assert config._breaker.consecutive_failures == 0 and config._breaker.state == "closed"
+    stub_es.slow.clear()
+    _, report = retrieve_documents.federated_search("问题", ["docs", "slow_docs"], two_stage=False, timeout=0.3)
+    assert report["searched"] == ["docs", "slow_docs"]
@@ -0,0 +1,37 @@
+"""
+对冲请求: 失败请求的耗时同样计入延迟分布; 对冲次数受预算限制
+"""
+
+import time
+
+import pytest
+
+from hedging import Hedger
+
+
+def test_failed_calls_recorded():
+    hedger = Hedger("test-failed", min_samples=1, enabled=True)
+
+    def slow_failure():
+        time.sleep(0.05)
+        raise TimeoutError("upstream timeout")
+
+    with pytest.raises(TimeoutError):
+        hedger.call(slow_failure)
+    assert hedger.tracker.percentile(50) >= 0.05
+
+
+def test_hedges_limited_by_budget():
+    hedger = Hedger("test-budget", percentile=50, budget_ratio=0.1, min_samples=5, enabled=True)
+    for _ in range(5):
+        hedger.call(lambda: None)
+
+    def stalled():
+        time.sleep(0.05)
+
+    for _ in range(20):
+        hedger.call(stalled)
+    stats = hedger.stats()
+    # 25个请求最多积累2.5个令牌: 至多对冲2次, 其余超过对冲延迟的请求被预算拒绝
+    assert 1 <= stats["hedged"] <= 2
+    assert stats["budget_denied"] >= 1
@@ -0,0 +1,63 @@
+"""
+装饰性图片过滤: 纯色、渐变和只有边框的图片分数低, 图表和照片类图片分数高
+"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from image_filter import image_features, image_score, filter_meaningful_images
+
+# 与 IMAGE_FILTER_THRESHOLD 的默认值相同
+THRESHOLD = 0.45
+
+
+def _solid():
+    return Image.new("RGB", (400, 300), (240, 240, 240))
+
+
+def _gradient():
+    ramp = np.tile(np.linspace(0, 255, 400, dtype=np.uint8), (300, 1))
+    return Image.fromarray(np.stack([ramp] * 3, axis=-1))
+
+
+def _border():
+    image = _solid()
+    ImageDraw.Draw(image).rectangle([2, 2, 397, 297], outline=(0, 0, 0), width=4)
+    return image
+
+
+def _chart():
+    image = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(image)
+    for i, height in enumerate([120, 200, 80, 160, 240, 60]):
+        draw.rectangle([40 + i * 55, 280 - height, 80 + i * 55, 280], fill=(30 + i * 30, 90, 200 - i * 25))
+        draw.text((40 + i * 55, 285 - height - 20), f"{height}", fill="black")
+    for y in range(40, 281, 40):
+        draw.line([30, y, 380, y], fill=(180, 180, 180))
+    return image
+
+
+def _photo():
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("make", [_solid, _gradient, _border])
+def test_decorative_images_score_low(make):
+    assert image_score(image_features(make())) < THRESHOLD
+
+
+@pytest.mark.parametrize("make", [_chart, _photo])
+def test_content_images_score_high(make):
+    assert image_score(image_features(make())) >= THRESHOLD
+
+
+def test_filter_hook(tmp_path):
+    blank, chart = tmp_path / "blank.png", tmp_path / "chart.png"
+    _solid().save(blank)
+    _chart().save(chart)
+    assert not filter_meaningful_images(str(blank), threshold=THRESHOLD)
+    assert filter_meaningful_images(str(chart), threshold=THRESHOLD)
+    # 阈值<=0时保留全部, 无法读取的图片也保留
+    assert filter_meaningful_images(str(blank), threshold=0)
+    assert filter_meaningful_images(str(tmp_path / "missing.png"), threshold=THRESHOLD)
@@ -0,0 +1,51 @@
+"""
+本地后端的IVF: 在写入时训练并随数据增长重新训练, 检索路径不训练, 也不修改调用方的查询向量
+"""
+
+import numpy as np
+import pytest
+
+import local_index
+from local_index import LocalVectorIndex
+
+
+def _chunks(start, count, dims=8):
+    vectors = np.random.default_rng(start).standard_normal((count, dims)).astype(np.float32)
+    return [{"id": f"doc_chunk_{start + i}", "content": f"条款 {start + i}", "file_name": "a.pdf",
+             "page_num": 1, "vector": vectors[i]} for i in range(count)]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "IVF_MIN_VECTORS", 40)
+    return LocalVectorIndex(str(tmp_path / "index"))
+
+
+def test_ivf_trained_at_ingest_and_retrained(index, monkeypatch):
+    index.add(_chunks(0, 30))
+    assert not index.manifest["ivf_nlist"]
+
+    index.add(_chunks(30, 20))
+    assert index.manifest["ivf_trained_count"] == 50
+
+    index.add(_chunks(50, 20))
+    assert index.manifest["ivf_trained_count"] == 50
+    index.add(_chunks(70, 40))
+    assert index.manifest["ivf_trained_count"] == 110
+    assert index.manifest["ivf_nlist"] == int(np.sqrt(110))
+
+    # 检索只使用已训练的IVF, 不在查询路径上训练
+    monkeypatch.setattr(index, "build_ivf", lambda *args, **kwargs: pytest.fail("build_ivf on query path"))
+    query = _chunks(0, 1)[0]["vector"]
+    original = query.copy()
+    hits = index.vector_search(query, size=5)
+    assert hits and hits[0]["id"] == "doc_chunk_0"
+    assert np.array_equal(query, original)
+
+
+def test_reopened_index_keeps_ivf(index, tmp_path):
+    index.add(_chunks(0, 60))
+    reopened = LocalVectorIndex(str(tmp_path / "index"))
+    assert reopened.manifest["ivf_nlist"] == index.manifest["ivf_nlist"]
+    query = _chunks(0, 1)[0]["vector"]
+    assert reopened.vector_search(query, size=1)[0]["id"] == "doc_chunk_0"
@@ -0,0 +1,68 @@
+"""
+蓝绿重建的切换: 新版本构建期间不逐文件refresh, 冒烟检查前统一更新一次版本号;
+构建期间旧版本有写入时拒绝切换别名
+"""
+
+import numpy as np
+import pytest
+
+import pipeline as pipeline_module
+from chunk_store import ChunkBatch
+from es_functions import bump_index_generation, get_index_generation
+from pipeline import RAGPipeline
+
+
+def _batch(start, count=3):
+    chunks = [{"id": f"doc_chunk_{start + i}", "content": f"条款 {start + i}", "file_name": f"f{start}.pdf",
+               "page_num": i + 1} for i in range(count)]
+    return ChunkBatch(chunks, np.random.default_rng(start).standard_normal((count, 8)).astype(np.float32))
+
+
+@pytest.fixture
+def rebuild(stub_es, monkeypatch):
+    """别名 docs 指向 docs_v1; 构建时每个"文件"走一次步骤5, during_build 在构建结束前执行"""
+    stub_es.mappings["docs_v1"] = {"properties": {}}
+    stub_es.aliases["docs"] = ["docs_v1"]
+    smoke = {}
+
+    def load_documents_only(self, pdf_paths, chunk_size=1024):
+        assert self.step1_deploy_elasticsearch()["success"]
+        for i, _ in enumerate(pdf_paths):
+            assert self.step5_index_to_elasticsearch(_batch(i * 10))["success"]
+        for write in during_build:
+            write()
+        return {"success": True, "processed_files": list(pdf_paths)}
+
+    def smoke_check(self, index_name, smoke_queries=None):
+        smoke["writes"] = [(method, path.split("?")[0]) for method, path in stub_es.requests if method != "GET"
+                           and path.split("?")[0] in (f"/{index_name}/_mapping", f"/{index_name}/_refresh")]
+        return {"success": True, "document_count": 6}
+
+    during_build = []
+    monkeypatch.setattr(RAGPipeline, "load_documents_only", load_documents_only)
+    monkeypatch.setattr(RAGPipeline, "_smoke_check", smoke_check)
+    pipeline = RAGPipeline("docs", answer_cache=False, artifact_cache=False, dedupe=False)
+    return pipeline, smoke, during_build
+
+
+def test_rebuild_bumps_generation_once(stub_es, rebuild):
+    pipeline, smoke, _ = rebuild
+    result = pipeline.rebuild_index(pdf_paths=["a.pdf", "b.pdf"], keep_versions=1)
+
+    assert result["success"], result.get("error")
+    assert stub_es.aliases["docs"] == ["docs_v2"]
+    # 两个文件只在冒烟检查前refresh并更新版本号一次
+    assert smoke["writes"] == [("POST", "/docs_v2/_refresh"), ("PUT", "/docs_v2/_mapping")]
+
+
+def test_rebuild_refuses_swap_after_write_to_old_version(stub_es, rebuild):
+    pipeline, _, during_build = rebuild
+    during_build.append(lambda: bump_index_generation(pipeline_module.get_es(), "docs"))
+    before = get_index_generation(pipeline_module.get_es(), "docs")
+
+    result = pipeline.rebuild_index(pdf_paths=["a.pdf"], keep_versions=1)
+
+    assert not result["success"]
+    assert "别名未切换" in result["error"]
+    assert stub_es.aliases["docs"] == ["docs_v1"]
+    assert get_index_generation(pipeline_module.get_es(), "docs") != before
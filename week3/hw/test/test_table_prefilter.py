@@ -0,0 +1,47 @@
+"""
+表格候选页预筛: 有框线或多列对齐文本的页是候选页, 普通段落页跳过 find_tables
+"""
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from table_prefilter import table_candidate
+
+PROSE = ("The parties enter into this agreement voluntarily and on equal terms, and each party shall perform "
+         "its obligations in full. A party in breach shall bear liability and compensate the other party for "
+         "the resulting losses. ") * 6
+
+
+@pytest.fixture
+def page():
+    doc = fitz.open()
+    yield doc.new_page()
+    doc.close()
+
+
+def _rows():
+    return [("item", "qty", "price"), ("apple", "3", "4.50"), ("pear", "12", "2.25"), ("plum", "7", "9.00")]
+
+
+def test_ruled_table(page):
+    for r, row in enumerate(_rows()):
+        for c, cell in enumerate(row):
+            rect = fitz.Rect(72 + c * 120, 100 + r * 24, 192 + c * 120, 124 + r * 24)
+            page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+            page.insert_text((rect.x0 + 4, rect.y1 - 7), cell, fontsize=10)
+    assert table_candidate(page) == (True, "rules")
+
+
+def test_aligned_text_table(page):
+    for r, row in enumerate(_rows()):
+        for c, cell in enumerate(row):
+            page.insert_text((72 + c * 120, 120 + r * 20), cell, fontsize=10)
+    assert table_candidate(page) == (True, "aligned_text")
+
+
+def test_prose_page(page):
+    page.insert_textbox(fitz.Rect(72, 72, 520, 700), PROSE, fontsize=11)
+    # 页眉下划线不算表格线
+    page.draw_line((72, 60), (520, 60), color=(0, 0, 0))
+    assert table_candidate(page) == (False, None)
@@ -0,0 +1,157 @@
+"""
+监听目录增量加载与去重: 修改或删除已加载的PDF后, 未改动的块和其他文件依赖的规范块仍在索引中
+
+使用本地后端, 向量化替换为按文本哈希生成的确定性向量, 不依赖模型服务:
+  cd week3/hw && python -m pytest -q test
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fitz = pytest.importorskip("fitz")
+
+import local_index
+import pipeline as pipeline_module
+from pipeline import RAGPipeline
+from watcher import PDFDirectoryWatcher
+
+def _page_text(label, seed):
+    words = np.random.default_rng(seed).choice(["alpha", "beta", "gamma", "delta", "omega", "sigma", "kappa",
+                                                  "lambda", "theta", "zeta", "rho", "tau"], size=120)
+    return f"{label} " + " ".join(f"{word}{j % 7}" for j, word in enumerate(words))
+
+
+PAGES = [_page_text(f"topic{i}", i) for i in range(5)]
+
+
+def _fake_embedding(texts):
+    vectors = []
+    for text in texts:
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        vectors.append(np.random.default_rng(seed).standard_normal(16).astype(np.float32))
+    return np.stack(vectors)
+
+
+def _write_pdf(path, pages):
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def _alive_texts(pipeline):
+    index = pipeline.local_index
+    index._load_docs()
+    return {index._docs[row]["id"]: index._docs[row] for row in np.flatnonzero(index._alive)}
+
+
+@pytest.fixture
+def make_watcher(tmp_path, monkeypatch):
+    """每次调用新建流水线和监听器 (模拟进程重启), 索引目录和状态文件不变"""
+    monkeypatch.setattr(pipeline_module, "local_embedding", _fake_embedding)
+    monkeypatch.setattr(pipeline_module, "num_tokens_from_string", lambda text: len(text.split()))
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+
+    def make():
+        # 进程内已打开的本地索引也要丢掉, 重启后从磁盘重新加载
+        local_index._open_indices.pop(str(tmp_path / "index"), None)
+        pipeline = RAGPipeline(index_name="watch_test", backend="local", local_index_dir=str(tmp_path / "index"),
+                               answer_cache=False, artifact_cache=False, parse_workers=1)
+        assert pipeline.step1_deploy_elasticsearch()["success"]
+        return PDFDirectoryWatcher(pipeline, str(pdf_dir), chunk_size=4096, debounce=0)
+    return make
+
+
+@pytest.fixture
+def watcher(make_watcher):
+    return make_watcher()
+
+
+def _ingest(watcher, path):
+    stat = os.stat(path)
+    watcher.pending[path] = (stat.st_size, stat.st_mtime, 0)
+    watcher.in_progress.add(path)
+    watcher._ingest(path)
+    assert watcher.failed == 0, watcher.recent[0]
+
+
+def test_edit_keeps_unchanged_chunks(watcher):
+    path = os.path.join(watcher.pdf_dir, "a.pdf")
+    _write_pdf(path, PAGES)
+    _ingest(watcher, path)
+    assert len(_alive_texts(watcher.pipeline)) == len(PAGES)
+
+    edited = list(PAGES)
+    edited[2] = _page_text("changed", 100)
+    _write_pdf(path, edited)
+    _ingest(watcher, path)
+
+    docs = _alive_texts(watcher.pipeline)
+    assert sorted(doc["page_num"] for doc in docs.values()) == [1, 2, 3, 4, 5]
+    texts = " ".join(doc["text"] for doc in docs.values())
+    assert "changed" in texts
+    assert "topic2" not in texts
+    for i in (0, 1, 3, 4):
+        assert f"topic{i}" in texts
+    assert sorted(docs) == sorted(watcher.indexed[path]["chunk_ids"])
+
+
+def test_delete_repoints_canonical_chunks(watcher):
+    path_a = os.path.join(watcher.pdf_dir, "a.pdf")
+    path_b = os.path.join(watcher.pdf_dir, "b.pdf")
+    _write_pdf(path_a, PAGES)
+    _ingest(watcher, path_a)
+    # b.pdf 的第1页与 a.pdf 的第4页相同, 去重后只保留 a.pdf 的块
+    _write_pdf(path_b, [PAGES[3], _page_text("only-in-b", 200)])
+    _ingest(watcher, path_b)
+    assert len(_alive_texts(watcher.pipeline)) == len(PAGES) + 1
+
+    watcher.in_progress.add(path_a)
+    watcher._delete(path_a)
+    assert watcher.failed == 0, watcher.recent[0]
+
+    docs = _alive_texts(watcher.pipeline)
+    assert len(docs) == 2
+    shared = [doc for doc in docs.values() if "topic3" in doc["text"]]
+    assert len(shared) == 1
+    assert shared[0]["file_name"] == "b.pdf" and shared[0]["page_num"] == 1
+    assert not (shared[0].get("metadata") or {}).get("duplicates")
+    assert sorted(docs) == sorted(watcher.indexed[path_b]["chunk_ids"])
+
+
+def test_restart_restores_dedupe_state(make_watcher):
+    watcher = make_watcher()
+    path_a = os.path.join(watcher.pdf_dir, "a.pdf")
+    path_b = os.path.join(watcher.pdf_dir, "b.pdf")
+    _write_pdf(path_a, PAGES)
+    _ingest(watcher, path_a)
+    _write_pdf(path_b, [PAGES[3], _page_text("only-in-b", 200)])
+    _ingest(watcher, path_b)
+
+    # 重启: 去重状态从索引重建, 之后加载的文件与已入库的块去重
+    watcher = make_watcher()
+    assert watcher.pipeline.deduper.stats()["canonical_chunks"] == len(PAGES) + 1
+    path_c = os.path.join(watcher.pdf_dir, "c.pdf")
+    _write_pdf(path_c, [PAGES[0], _page_text("only-in-c", 300)])
+    _ingest(watcher, path_c)
+    assert len(_alive_texts(watcher.pipeline)) == len(PAGES) + 2
+
+    # 删除 a.pdf 后, b.pdf 和 c.pdf 的副本页改为归属各自的文件, 不会从索引中消失
+    watcher.in_progress.add(path_a)
+    watcher._delete(path_a)
+    assert watcher.failed == 0, watcher.recent[0]
+
+    docs = _alive_texts(watcher.pipeline)
+    assert len(docs) == 4
+    owners = {doc["file_name"]: doc["page_num"] for doc in docs.values() if "topic" in doc["text"]}
+    assert owners == {"b.pdf": 1, "c.pdf": 1}
+    assert sorted(docs) == sorted(watcher.indexed[path_b]["chunk_ids"] + watcher.indexed[path_c]["chunk_ids"])
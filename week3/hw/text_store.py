@@ -0,0 +1,126 @@
+"""
+块正文的本地存储 (文本与索引分离)
+默认布局下每个块的 text、metadata.page_context、metadata.table_markdown 都保存在ES的 _source 中,
+索引体积和每次检索的响应都被这些大字段撑大。分离布局下 text 仍会被ES索引 (BM25可用),
+但这些字段都通过mapping的 _source.excludes 不再存储; 原文按块id写入本地SQLite,
+检索只返回id、分数和小字段, 最终的top-k结果再从本地取回正文。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+from config import TEXT_STORE_DIR
+
+# 分离布局中不存入ES _source 的字段
+EXTERNAL_TEXT_FIELDS = ["text", "metadata.page_context", "metadata.table_markdown"]
+# metadata中随正文一起存到本地的字段
+EXTERNAL_METADATA_FIELDS = ("page_context", "table_markdown")
+
+
+def _split_metadata(metadata):
+    return {k: metadata[k] for k in EXTERNAL_METADATA_FIELDS if k in (metadata or {})}
+
+
+class TextStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT, extra TEXT)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def put_many(self, rows):
+        """rows: (块id, 正文, metadata) 的可迭代对象, metadata中只保存大字段"""
+        records = [(chunk_id, text, json.dumps(_split_metadata(metadata), ensure_ascii=False))
+                   for chunk_id, text, metadata in rows]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)", records)
+            self._conn.commit()
+        return len(records)
+
+    def put_batch(self, batch):
+        """写入一个 ChunkBatch 的正文"""
+        return self.put_many(zip(batch.ids, batch.contents, batch.metadata))
+
+    def get_many(self, ids):
+        """返回 {块id: (正文, metadata大字段)}, 不存在的id不出现在结果中"""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        with self._lock:
+            # SQLite默认最多999个参数
+            for i in range(0, len(ids), 900):
+                part = ids[i:i + 900]
+                rows = self._conn.execute(
+                    f"SELECT id, text, extra FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for chunk_id, text, extra in rows:
+                    found[chunk_id] = (text, json.loads(extra) if extra else {})
+        return found
+
+    def hydrate(self, results):
+        """原地补全检索结果的 text 和 metadata 大字段"""
+        found = self.get_many(r["id"] for r in results)
+        for result in results:
+            if result["id"] not in found:
+                continue
+            text, extra = found[result["id"]]
+            result["text"] = text
+            if extra:
+                result["metadata"] = {**(result.get("metadata") or {}), **extra}
+        return results
+
+    def fill_source(self, chunk_id, source):
+        """补全单个文档的 _source, 用于导出快照或部分更新时重新提交被排除的字段"""
+        found = self.get_many([chunk_id]).get(chunk_id)
+        if found is not None:
+            source["text"] = found[0]
+            if found[1]:
+                source["metadata"] = {**(source.get("metadata") or {}), **found[1]}
+        return source
+
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            for i in range(0, len(ids), 900):
+                part = ids[i:i + 900]
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        size = sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+        return {"count": count, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_text_store(index_name, store_dir=None):
+    """同一索引在进程内共享一个 TextStore, 文件为 <store_dir>/<index_name>.sqlite"""
+    path = os.path.join(store_dir or TEXT_STORE_DIR, f"{index_name}.sqlite")
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = TextStore(path)
+        return _stores[path]
+
+
+def drop_text_store(index_name, store_dir=None):
+    """删除索引时一并删除其正文文件"""
+    path = os.path.join(store_dir or TEXT_STORE_DIR, f"{index_name}.sqlite")
+    with _stores_lock:
+        store = _stores.pop(path, None)
+        if store is not None:
+            store.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
@@ -0,0 +1,237 @@
+"""
+监听PDF目录, 增量加载新增、修改和删除的文件
+- 轮询目录 (不依赖额外的文件系统事件库), 文件大小和修改时间在 debounce 秒内不再变化才认为写入完成
+- 只对变化的文件执行步骤2-5, 使用有界线程池, 同一文件同时最多处理一次
+- 加载失败的文件在再次修改之前不会重试
+- 修改的文件先写入新版本, 再删除旧版本中不再存在的块; 删除的文件从索引中移除
+- 旧版本的块不参与新版本的去重; 被删除的块如果是其他文件副本的规范块, 改为归属副本所在的文件
+- 已加载文件的状态保存在JSON文件中, 启动时一并从索引重建去重状态, 重启后不会重新处理未变化的文件
+- 进度写入状态文件, 可以用 `cat` 或其他进程读取
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 状态文件中保留的最近事件数
+RECENT_EVENTS = 20
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class PDFDirectoryWatcher:
+    def __init__(self, pipeline, pdf_dir, chunk_size=1024, poll_interval=2.0, debounce=5.0, max_workers=2,
+                 state_path=None, status_path=None):
+        self.pipeline = pipeline
+        self.pdf_dir = pdf_dir
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_workers = max_workers
+        self.state_path = state_path or os.path.join(pdf_dir, f".rag_watch_{pipeline.index_name}.json")
+        self.status_path = status_path or os.path.join(pdf_dir, f".rag_watch_{pipeline.index_name}.status.json")
+
+        self.indexed = {}          # 已加载的文件 -> {"size", "mtime", "chunk_ids", "indexed_at"}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.indexed = json.load(f)
+            # 去重状态只在内存中, 不重建的话删除文件时会丢掉其他文件去重到该文件上的页
+            restored = pipeline.restore_dedupe_state()
+            if not restored["success"]:
+                print(f"⚠️ {restored['error']}, 删除文件前会再次尝试")
+        self.pending = {}          # 等待稳定的文件 -> (size, mtime, 首次看到该签名的时间)
+        self.in_progress = set()
+        self.failed_files = {}     # 加载失败的文件 -> (size, mtime), 文件再次变化前不重试
+        self.completed = 0
+        self.failed = 0
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.started = time.time()
+        self.last_scan = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+
+    # ------------------------------------------------------------------
+    # 变化检测
+    # ------------------------------------------------------------------
+
+    def _scan(self):
+        """返回 (可以加载的文件, 已删除的文件)"""
+        now = time.time()
+        current = {}
+        for path in glob.glob(os.path.join(self.pdf_dir, "*.pdf")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # 扫描期间被删除
+            current[path] = (stat.st_size, stat.st_mtime)
+
+        ready, deleted = [], []
+        with self._lock:
+            for path, signature in current.items():
+                if path in self.in_progress:
+                    continue
+                known = self.indexed.get(path)
+                if known and (known["size"], known["mtime"]) == signature:
+                    self.pending.pop(path, None)
+                    continue
+                if self.failed_files.get(path) == signature:
+                    continue
+                previous = self.pending.get(path)
+                if previous is None or previous[:2] != signature:
+                    # 新出现或仍在写入, 重新计时
+                    self.pending[path] = (*signature, now)
+                elif now - previous[2] >= self.debounce:
+                    ready.append(path)
+
+            for path in list(self.pending):
+                if path not in current:
+                    del self.pending[path]
+            deleted = [path for path in self.indexed if path not in current and path not in self.in_progress]
+            self.last_scan = now
+        return ready, deleted
+
+    # ------------------------------------------------------------------
+    # 加载和删除
+    # ------------------------------------------------------------------
+
+    def _event(self, path, action, result):
+        self.recent.appendleft({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "file": os.path.basename(path),
+                                "action": action, **result})
+
+    def _adopt(self, repointed):
+        """把改为归属其他文件的块记到该文件名下, 该文件之后修改或删除时一并处理; 调用时需持有锁"""
+        for chunk_id, file_name in repointed.items():
+            for path, entry in self.indexed.items():
+                if os.path.basename(path) == file_name:
+                    entry["chunk_ids"].append(chunk_id)
+                    break
+
+    def _ingest(self, path):
+        with self._lock:
+            size, mtime, _ = self.pending[path]
+            old_ids = list(self.indexed.get(path, {}).get("chunk_ids", []))
+        try:
+            start = time.time()
+            result = self.pipeline.ingest_file(path, self.chunk_size, replaces=old_ids if old_ids else None)
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+
+            # 新版本写入成功后再删除旧版本中不再存在的块, 避免中途出现空窗
+            new_ids = result["chunk_ids"]
+            stale_ids = sorted(set(old_ids) - set(new_ids))
+            repointed = {}
+            if stale_ids:
+                deleted = self.pipeline.delete_chunks(stale_ids, file_name=os.path.basename(path))
+                if not deleted["success"]:
+                    raise RuntimeError(deleted["error"])
+                repointed = deleted["repointed"]
+
+            with self._lock:
+                self._adopt(repointed)
+                self.indexed[path] = {"size": size, "mtime": mtime, "chunk_ids": new_ids,
+                                      "indexed_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+                self.pending.pop(path, None)
+                self.failed_files.pop(path, None)
+                self.completed += 1
+                self._event(path, "updated" if old_ids else "created",
+                            {"indexed": len(new_ids), "removed": len(stale_ids),
+                             "seconds": round(time.time() - start, 1)})
+                _write_json(self.state_path, self.indexed)
+        except Exception as e:
+            with self._lock:
+                self.pending.pop(path, None)
+                self.failed_files[path] = (size, mtime)
+                self.failed += 1
+                self._event(path, "failed", {"error": str(e)})
+        finally:
+            with self._lock:
+                self.in_progress.discard(path)
+            self._write_status()
+
+    def _delete(self, path):
+        try:
+            chunk_ids = self.indexed[path]["chunk_ids"]
+            result = self.pipeline.delete_chunks(chunk_ids, file_name=os.path.basename(path), file_removed=True)
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+            with self._lock:
+                del self.indexed[path]
+                self._adopt(result["repointed"])
+                self.completed += 1
+                self._event(path, "deleted", {"removed": result["deleted_count"]})
+                _write_json(self.state_path, self.indexed)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+                self._event(path, "failed", {"error": str(e)})
+        finally:
+            with self._lock:
+                self.in_progress.discard(path)
+            self._write_status()
+
+    def _submit(self, path, task):
+        with self._lock:
+            if path in self.in_progress:
+                return
+            self.in_progress.add(path)
+        self._executor.submit(task, path)
+
+    # ------------------------------------------------------------------
+    # 状态
+    # ------------------------------------------------------------------
+
+    def status(self):
+        with self._lock:
+            return {
+                "pdf_dir": self.pdf_dir,
+                "index": self.pipeline.index_name,
+                "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                "last_scan": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_scan))
+                if self.last_scan else None,
+                "indexed_files": len(self.indexed),
+                "waiting": sorted(os.path.basename(p) for p in self.pending if p not in self.in_progress),
+                "in_progress": sorted(os.path.basename(p) for p in self.in_progress),
+                "completed": self.completed,
+                "failed": self.failed,
+                "failed_files": sorted(os.path.basename(p) for p in self.failed_files),
+                "recent": list(self.recent),
+            }
+
+    def _write_status(self):
+        try:
+            _write_json(self.status_path, self.status())
+        except OSError as e:
+            print(f"⚠️ 写入状态文件失败: {e}")
+
+    def run(self):
+        """阻塞运行, Ctrl+C 退出 (等待正在处理的文件完成)"""
+        print(f"👀 监听目录 {self.pdf_dir} (每{self.poll_interval}秒扫描, 稳定{self.debounce}秒后加载, "
+              f"最多{self.max_workers}个文件并发)")
+        print(f"📊 状态文件: {self.status_path}")
+        try:
+            while not self._stop.is_set():
+                ready, deleted = self._scan()
+                for path in ready:
+                    self._submit(path, self._ingest)
+                for path in deleted:
+                    self._submit(path, self._delete)
+                self._write_status()
+                self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            print("\n⏹️ 停止监听, 等待正在处理的文件完成...")
+        finally:
+            self._executor.shutdown(wait=True)
+            self._write_status()
+
+    def stop(self):
+        self._stop.set()
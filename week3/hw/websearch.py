@@ -1,30 +1,69 @@
-import requests,json,os
+"""
+网络搜索 (博查) 与LLM调用
+web_search 复用同一个HTTP会话、带超时, 结果按归一化的问题缓存 WEB_SEARCH_CACHE_TTL 秒;
+submit_web_search 在后台线程中执行, 步骤6把它作为与文档检索并发的一路, 结果转换成与文档块相同的格式后一起融合。
+"""
 
-from dotenv import load_dotenv
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
-load_dotenv()
-WEB_SEARCH_KEY = os.getenv('WEB_SEARCH_KEY')
+import requests
 
+from cache import LRUCache, normalize_query
+from config import WEB_SEARCH_KEY, WEB_SEARCH_TIMEOUT, WEB_SEARCH_COUNT, WEB_SEARCH_CACHE_TTL, WEB_SEARCH_CACHE_SIZE
+from hedging import hedged
 
+WEB_SEARCH_URL = "https://api.bochaai.com/v1/web-search"
+# 网络搜索结果在检索结果中的来源名, 与联合检索中的索引名并列
+WEB_SOURCE = "web"
 
-def bocha_web_search(web_query):
-    key=WEB_SEARCH_KEY
-    url = "https://api.bochaai.com/v1/web-search"
+_session = requests.Session()
+# 值为 (过期时间, 结果列表)
+_cache = LRUCache(WEB_SEARCH_CACHE_SIZE)
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web-search")
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "errors": 0, "expired": 0}
 
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _lookup(key):
+    """TTL内的缓存结果, 没有或已过期时返回None"""
+    cached = _cache.get(key)
+    if cached is None:
+        return None
+    expires_at, results = cached
+    if time.time() >= expires_at:
+        _count("expired")
+        return None
+    return results
+
+
+def _fetch(web_query, count, timeout, key):
     payload = json.dumps({
     "query": web_query,
-    "count": 10,
+    "count": count,
     "summary": True,
     })
 
     headers = {
-    'Authorization': f'Bearer {key}',
+    'Authorization': f'Bearer {WEB_SEARCH_KEY}',
     'Content-Type': 'application/json'
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
-    # print(response.json())
-    web_pages = response.json().get('data', {}).get('webPages', {}).get('value', [])
+    _count("requests")
+    try:
+        response = _session.post(WEB_SEARCH_URL, headers=headers, data=payload, timeout=timeout)
+        response.raise_for_status()
+        web_pages = response.json().get('data', {}).get('webPages', {}).get('value', [])
+    except Exception:
+        _count("errors")
+        raise
 
     top_results = []
     for page in web_pages:
@@ -39,7 +78,71 @@ def bocha_web_search(web_query):
             'snippet': page.get('snippet')
         }
         top_results.append(result)
-        
+
+    _cache.put(key, (time.time() + WEB_SEARCH_CACHE_TTL, top_results))
+    return top_results
+
+
+def web_search(web_query, count=WEB_SEARCH_COUNT, timeout=WEB_SEARCH_TIMEOUT):
+    """返回网页结果列表 [{"title", "url", "date", "source", "logo", "summary", "snippet"}]
+
+    相同的问题 (归一化后) 在TTL内直接返回缓存; 请求失败时抛出异常, 失败的结果不缓存
+    """
+    key = (normalize_query(web_query), count)
+    results = _lookup(key)
+    if results is not None:
+        return results
+    return _fetch(web_query, count, timeout, key)
+
+
+def submit_web_search(web_query, count=WEB_SEARCH_COUNT, timeout=WEB_SEARCH_TIMEOUT):
+    """在后台线程中执行 web_search, 返回Future; 缓存命中时返回已完成的Future
+
+    调用方等待超时后请求仍会继续, 完成后写入缓存, 之后相同的问题可以直接命中
+    """
+    key = (normalize_query(web_query), count)
+    results = _lookup(key)
+    if results is not None:
+        future = Future()
+        future.set_result(results)
+        return future
+    return _pool.submit(_fetch, web_query, count, timeout, key)
+
+
+def web_results_to_docs(results):
+    """网页结果转换成与文档块相同格式的检索结果, 可以和文档检索结果一起融合、重排序和生成引用"""
+    docs = []
+    for result in results:
+        text = "\n".join(part for part in (result.get('title'), result.get('summary') or result.get('snippet')) if part)
+        if not text:
+            continue
+        docs.append({
+            'id': f"{WEB_SOURCE}:{result.get('url') or len(docs)}",
+            'text': text,
+            'file_id': None,
+            'image_id': None,
+            'metadata': {
+                'content_type': WEB_SOURCE,
+                'page_num': None,
+                'url': result.get('url'),
+                'title': result.get('title'),
+                'source': result.get('source'),
+                'date': result.get('date'),
+            },
+            'index': WEB_SOURCE,
+        })
+    return docs
+
+
+def web_search_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["cache"] = _cache.stats()
+    return stats
+
+
+def bocha_web_search(web_query, timeout=WEB_SEARCH_TIMEOUT):
+    top_results = web_search(web_query, timeout=timeout)
     web_articles_text = '\n\n```\n'.join(
         f"标题：{web.get('title', '无标题')}\n"
         f"日期：{web.get('date', '未知日期')}\n"
@@ -49,7 +152,7 @@ def bocha_web_search(web_query):
     return web_articles_text
 
 
-def ask_llm(query,websearch=None):
+def ask_llm(query,websearch=None,timeout=60):
     from openai import OpenAI
     
     client = OpenAI(
@@ -57,13 +160,13 @@ def ask_llm(query,websearch=None):
         api_key="ced64188-f9b4-4244-b020-23cfda56da35"
     )
     
-    response = client.chat.completions.create(
+    response = hedged("llm:deepseek-v3-250324", client.chat.completions.create,
         model="deepseek-v3-250324",
         messages=[
             {"role": "user", "content": f"{query}\n\n参考资料：\n{websearch}" if websearch is not None else query}
         ],
         max_tokens=4000,
-        timeout=60
+        timeout=timeout
     )
     
     return response.choices[0].message.content